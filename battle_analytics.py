@@ -0,0 +1,374 @@
+"""
+
+Holds all methods relating to the shot analytics job.
+
+The job reads every move of every game and counts shots per cell; by
+status, by the boat type hit and for each users' first shot, plus the
+shots it took to sink each boat type. Archived games are read from their
+archive and every other game from the Move kind, in cursor driven
+batches so memory stays bounded however many moves there are.
+
+Each task does one batch, then saves its progress and queues the task
+for the next batch in the same transaction. A task that fails or runs out
+of time before saving is retried from the last saved batch. The figures are published as a single
+ShotAnalytics entity when the run is finished.
+
+"""
+
+
+# numpy is imported inside the methods that use it so the API doesn't
+# load it on every new instance.
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from battle_models import Game
+from battle_models import Move
+from battle_models import ShotAnalytics
+
+from battle_consts import ANALYTICS_GAMES_BATCH
+from battle_consts import ANALYTICS_MOVES_BATCH
+from battle_consts import ANALYTICS_STALE_HOURS
+
+import battle_archive
+import battle_board
+import battle_cache
+import battle_replay
+
+
+# Rows of the counts array. A row holds a count for each cell.
+LAYER_MISS = 0  # The move statuses come first so status is the row.
+LAYER_HIT = 1
+LAYER_DUPLICATE = 2
+LAYER_BOAT_HITS = 3  # One row per boat type.
+LAYER_FIRST_SHOT = LAYER_BOAT_HITS + len(battle_board.BOAT_CODES)
+ANALYTICS_LAYERS = LAYER_FIRST_SHOT + 1
+
+WORKING_ID = 'working'
+LATEST_ID = 'latest'
+
+
+def _startShotAnalytics():
+    """
+    Start a new run of the job, unless one is already running.
+
+    Returns:
+      True if a run was started.
+    """
+    import numpy
+
+    @ndb.transactional
+    def start():
+        working = ndb.Key(ShotAnalytics, WORKING_ID).get()
+        stale = datetime.now() - timedelta(hours=ANALYTICS_STALE_HOURS)
+        if working is not None and working.updated > stale:
+            return False
+
+        boat_types = len(battle_board.BOAT_CODES)
+        ShotAnalytics(id=WORKING_ID,
+                      counts=numpy.zeros(ANALYTICS_LAYERS * battle_board.BOARD_SIZE,
+                                         dtype=numpy.int32).tostring(),
+                      sink_shots=[0] * boat_types,
+                      sink_count=[0] * boat_types,
+                      started=datetime.now()).put()
+        taskqueue.add(url='/tasks/shot_analytics', params={'step': 0},
+                      transactional=True)
+        return True
+
+    return start()
+
+
+def _runShotAnalytics(step):
+    """
+    Count the next batch, then save the progress and queue the task for
+    the step after it, or publish the figures if the run is finished.
+
+    Args:
+      step: the step the task was started for; the task does nothing if
+        another task has already done it.
+    """
+    import numpy
+
+    working = ndb.Key(ShotAnalytics, WORKING_ID).get()
+    if working is None or working.step != step:
+        logging.info('Shot analytics step %d has already been run.', step)
+        return
+
+    counts = numpy.fromstring(working.counts, dtype=numpy.int32).copy()
+
+    cells = []
+    if working.phase == 0:
+        more = _tallyArchivedGames(working, cells)
+        if not more:
+            working.phase = 1
+            working.cursor = None
+            more = True
+    else:
+        more = _tallyMoves(working, cells)
+
+    # Add up the whole batch at once.
+    if cells:
+        counts += numpy.bincount(numpy.array(cells),
+                                 minlength=counts.size).astype(numpy.int32)
+    working.counts = counts.tostring()
+
+    if not more:
+        if _publish(working, step):
+            battle_cache._bumpVersions(battle_cache.ANALYTICS_VERSION)
+        return
+
+    if not _saveProgress(working, step):
+        logging.info('Shot analytics step %d was run by another task.', step)
+
+
+@ndb.transactional
+def _saveProgress(working, step):
+    """
+    Save the working run and queue the task for the next step, if no
+    other task has saved this step already.
+
+    Returns:
+      True if the progress was saved.
+    """
+    current = working.key.get()
+    if current is None or current.step != step:
+        return False
+
+    working.step = step + 1
+    working.put()
+    taskqueue.add(url='/tasks/shot_analytics', params={'step': working.step},
+                  transactional=True)
+    return True
+
+
+@ndb.transactional(xg=True)
+def _publish(working, step):
+    """
+    Replace the published figures with the finished run.
+
+    Returns:
+      True if the figures were published.
+    """
+    current = working.key.get()
+    if current is None or current.step != step:
+        return False
+
+    ShotAnalytics(id=LATEST_ID,
+                  counts=working.counts,
+                  sink_shots=working.sink_shots,
+                  sink_count=working.sink_count,
+                  games=working.games,
+                  moves=working.moves,
+                  started=working.started).put()
+    working.key.delete()
+    return True
+
+
+def _newTally(selected_game, board1, board2):
+    """
+    Start counting the moves of a game.
+
+    Args:
+      selected_game: the Game object.
+      board1: the board of user1 before the first move.
+      board2: the board of user2 before the first move.
+
+    Returns:
+      A dict that can be saved as JSON between batches.
+    """
+    return {'game': selected_game.key.urlsafe(),
+            'user1': selected_game.user1.id(),
+            'boards': [board1, board2],
+            'shots': [0, 0]}
+
+
+def _tallyMove(working, tally, each_move, cells):
+    """
+    Count a move.
+
+    Args:
+      working: the working ShotAnalytics entity.
+      tally: the dict from _newTally for the moves' game.
+      each_move: the Move object.
+      cells: a list that the counts array index of each count is added to.
+    """
+    board_size = battle_board.BOARD_SIZE
+    shooter = 0 if each_move.user_id.id() == tally['user1'] else 1
+    target = 1 - shooter
+
+    tally['shots'][shooter] += 1
+    cell_index = battle_board._cellIndex(each_move.row, each_move.col)
+
+    cells.append(each_move.status * board_size + cell_index)
+    if tally['shots'][shooter] == 1:
+        cells.append(LAYER_FIRST_SHOT * board_size + cell_index)
+
+    board, result = battle_board._applyShot(tally['boards'][target],
+                                            each_move.row, each_move.col)
+    tally['boards'][target] = board
+
+    if result == 1:  # hit
+        boat_type = battle_board.BOAT_CODES.index(board[cell_index].upper())
+        cells.append((LAYER_BOAT_HITS + boat_type) * board_size + cell_index)
+
+        if battle_board._boatIsSunkOnBoard(board, boat_type):
+            working.sink_shots[boat_type] += tally['shots'][shooter]
+            working.sink_count[boat_type] += 1
+
+    working.moves += 1
+
+
+def _tallyArchivedGames(working, cells):
+    """
+    Count the moves of the next batch of archived games.
+
+    Returns:
+      True if there are more archived games.
+    """
+    start_cursor = None
+    if working.cursor:
+        start_cursor = ndb.Cursor(urlsafe=working.cursor)
+
+    games, next_cursor, more = Game.query(Game.archived == True).fetch_page(
+        ANALYTICS_GAMES_BATCH, start_cursor=start_cursor)
+
+    for each_game in games:
+        if each_game.archive is None:
+            continue
+
+        board1, board2 = battle_replay._getBoardsAt(each_game, 0)
+        tally = _newTally(each_game, board1, board2)
+        working.games += 1
+
+        for each_move in battle_archive._getArchivedMoves(each_game):
+            _tallyMove(working, tally, each_move, cells)
+
+    working.cursor = next_cursor.urlsafe() if next_cursor else None
+    return more
+
+
+def _tallyMoves(working, cells):
+    """
+    Count the next batch of the Move kind, ordered by game and sequence.
+
+    Moves of archived games are skipped; they were counted from the
+    archive, which is read first so no game is counted twice.
+
+    Returns:
+      True if there are more moves.
+    """
+    start_cursor = None
+    if working.cursor:
+        start_cursor = ndb.Cursor(urlsafe=working.cursor)
+
+    moves, next_cursor, more = Move.query().order(
+        Move.game_id, Move.sequence).fetch_page(ANALYTICS_MOVES_BATCH,
+                                                start_cursor=start_cursor)
+
+    # Get every game in the batch with one read.
+    game_keys = list(set(each_move.game_id for each_move in moves))
+    games = dict(zip(game_keys, ndb.get_multi(game_keys)))
+
+    tally = json.loads(working.open_game) if working.open_game else None
+
+    for each_move in moves:
+        websafe_game_key = each_move.game_id.urlsafe()
+
+        if tally is None or tally['game'] != websafe_game_key:
+            selected_game = games[each_move.game_id]
+
+            if selected_game is None or selected_game.archived:
+                tally = {'game': websafe_game_key, 'skip': True}
+            else:
+                board1, board2 = _getStartingBoards(selected_game)
+                tally = _newTally(selected_game, board1, board2)
+                working.games += 1
+
+        if not tally.get('skip'):
+            _tallyMove(working, tally, each_move, cells)
+
+    working.open_game = json.dumps(tally) if tally else None
+    working.cursor = next_cursor.urlsafe() if next_cursor else None
+    return more
+
+
+def _getStartingBoards(selected_game):
+    """
+    Get both boards of a game before the first move.
+
+    Args:
+      selected_game: the Game object.
+
+    Returns:
+      A tuple with the board of user1[0] and the board of user2[1].
+    """
+    if selected_game.board1 is not None:
+        return (battle_board._unshotBoard(selected_game.board1),
+                battle_board._unshotBoard(selected_game.board2))
+
+    # Games created before boards were stored on the Game.
+    return battle_replay._getBoardsAt(selected_game, 0)
+
+
+def _getLatestAnalytics():
+    """
+    Get the figures of the last finished run.
+
+    Returns:
+      A ShotAnalytics object, or None if the job has never finished.
+    """
+    return ndb.Key(ShotAnalytics, LATEST_ID).get()
+
+
+def _getHeatmaps(analytics):
+    """
+    Get the heatmaps of a finished run.
+
+    Args:
+      analytics: a ShotAnalytics object.
+
+    Returns:
+      A list of (name, list of 100 values, row A first) tuples.
+    """
+    import numpy
+
+    counts = numpy.fromstring(analytics.counts, dtype=numpy.int32).reshape(
+        ANALYTICS_LAYERS, battle_board.BOARD_SIZE).astype(numpy.float64)
+
+    hits = counts[LAYER_HIT]
+    fired = hits + counts[LAYER_MISS]
+    hit_rate = hits / numpy.maximum(fired, 1)
+
+    heatmaps = [('shots', counts[:LAYER_BOAT_HITS].sum(axis=0)),
+                ('hits', hits),
+                ('misses', counts[LAYER_MISS]),
+                ('duplicates', counts[LAYER_DUPLICATE]),
+                ('hit_rate', hit_rate),
+                ('first_shots', counts[LAYER_FIRST_SHOT])]
+
+    for boat_type, boat_name in enumerate(battle_board.BOAT_NAMES):
+        heatmaps.append(('hits_' + boat_name.lower(),
+                         counts[LAYER_BOAT_HITS + boat_type]))
+
+    return [(name, values.tolist()) for name, values in heatmaps]
+
+
+def _getSinkStats(analytics):
+    """
+    Get the average number of shots it took to sink each boat type.
+
+    Args:
+      analytics: a ShotAnalytics object.
+
+    Returns:
+      A list of (boat name, boats sunk, average shots) tuples.
+    """
+    return [(boat_name,
+             analytics.sink_count[boat_type],
+             float(analytics.sink_shots[boat_type]) /
+             max(analytics.sink_count[boat_type], 1))
+            for boat_type, boat_name in enumerate(battle_board.BOAT_NAMES)]
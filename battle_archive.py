@@ -0,0 +1,258 @@
+"""
+
+Holds all methods relating to archiving completed games.
+
+"""
+
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+
+from battle_models import Game
+from battle_models import Boat
+from battle_models import Move
+from battle_models import BoardSnapshot
+
+from battle_consts import ARCHIVE_GAMES_PER_RUN
+from battle_consts import ARCHIVE_DELETE_BATCH
+from battle_consts import ARCHIVE_LAG_SECONDS
+
+
+def _userIndex(selected_game, user_key):
+    """
+    Get the position of a user in a game.
+
+    Args:
+      selected_game: the Game object.
+      user_key: the key of the user.
+
+    Returns:
+      1 if the user is user1, 2 if the user is user2.
+    """
+    if selected_game.user1 == user_key:
+        return 1
+    return 2
+
+
+def _userKey(selected_game, user_index):
+    """
+    Get the key of a user from their position in a game.
+
+    Args:
+      selected_game: the Game object.
+      user_index: 1 for user1, 2 for user2.
+
+    Returns:
+      A User key.
+    """
+    if user_index == 1:
+        return selected_game.user1
+    return selected_game.user2
+
+
+def _buildGameArchive(selected_game, moves, boats):
+    """
+    Fold all moves and boats for a game into a single archive.
+
+    Args:
+      selected_game: the Game object being archived.
+      moves: a list of Move objects ordered by sequence.
+      boats: a list of Boat objects.
+
+    Returns:
+      A JSON string. The Game.archive property compresses it on save.
+    """
+    archive = {
+        'moves': [[_userIndex(selected_game, each_move.user_id),
+                   each_move.row,
+                   each_move.col,
+                   each_move.status,
+                   each_move.sequence,
+                   each_move.hits,
+                   each_move.miss,
+                   each_move.sunk] for each_move in moves],
+        'boats': [[_userIndex(selected_game, each_boat.user_id),
+                   each_boat.boat_type,
+                   each_boat.row,
+                   each_boat.col,
+                   1 if each_boat.hit else 0] for each_boat in boats]
+    }
+    return json.dumps(archive, separators=(',', ':'))
+
+
+def _getArchivedMoves(selected_game):
+    """
+    Get all moves for an archived game.
+
+    Args:
+      selected_game: a Game object with an archive.
+
+    Returns:
+      A list of unsaved Move objects ordered by sequence.
+    """
+    archive = json.loads(selected_game.archive)
+
+    return [Move(game_id=selected_game.key,
+                 user_id=_userKey(selected_game, each_move[0]),
+                 row=each_move[1],
+                 col=each_move[2],
+                 status=each_move[3],
+                 sequence=each_move[4],
+                 hits=each_move[5],
+                 miss=each_move[6],
+                 sunk=each_move[7]) for each_move in archive['moves']]
+
+
+def _getArchivedUsersLastMove(selected_game, user_key):
+    """
+    Return the last move that a user made in an archived game.
+
+    Args:
+      selected_game: a Game object with an archive.
+      user_key: the key of the user to get the move for.
+
+    Returns:
+      A Move object, or None if the user made no moves.
+    """
+    last_move = None
+
+    for each_move in _getArchivedMoves(selected_game):
+        if each_move.user_id == user_key:
+            last_move = each_move
+
+    return last_move
+
+
+def _getArchivedBoats(selected_game, user_key):
+    """
+    Get all boats for a user in an archived game.
+
+    Args:
+      selected_game: a Game object with an archive.
+      user_key: the key of the user to get the boats for.
+
+    Returns:
+      A list of unsaved Boat objects ordered by boat type, col and row.
+    """
+    archive = json.loads(selected_game.archive)
+    user_index = _userIndex(selected_game, user_key)
+
+    boats = [Boat(game_id=selected_game.key,
+                  user_id=user_key,
+                  boat_type=each_boat[1],
+                  row=each_boat[2],
+                  col=each_boat[3],
+                  hit=each_boat[4] == 1)
+             for each_boat in archive['boats'] if each_boat[0] == user_index]
+
+    return sorted(boats, key=lambda b: (b.boat_type, b.col, b.row))
+
+
+def _deleteInBatches(query):
+    """
+    Delete every entity matched by a query, one batch at a time.
+
+    Args:
+      query: the query for the entities to delete.
+    """
+    while True:
+        keys = query.fetch(ARCHIVE_DELETE_BATCH, keys_only=True)
+        if not keys:
+            break
+        ndb.delete_multi(keys)
+
+
+def _archiveGame(selected_game):
+    """
+    Archive a completed game and delete its Move and Boat entities.
+
+    The archive is saved before anything is deleted, so a run that is
+    interrupted part way through can be resumed by the next run. Games
+    with a move in the last ARCHIVE_LAG_SECONDS, or whose Move query is
+    still missing some of their moves, are left for a later run.
+
+    Args:
+      selected_game: a finished or cancelled Game object.
+
+    Returns:
+      True if the game was archived.
+    """
+    move_query = Move.query(Move.game_id == selected_game.key)
+    boat_query = Boat.query(Boat.game_id == selected_game.key)
+
+    # Only build the archive once. If a previous run was interrupted then
+    # some entities are already gone and the saved archive is the only
+    # complete copy.
+    if selected_game.archive is None:
+        lag = datetime.now() - timedelta(seconds=ARCHIVE_LAG_SECONDS)
+        if (selected_game.last_move_at is not None and
+                selected_game.last_move_at > lag):
+            return False
+
+        moves = move_query.order(Move.sequence).fetch()
+        if (selected_game.move_count is not None and
+                len(moves) != selected_game.move_count):
+            logging.warning('Not archiving game %s yet, found %d of its %d '
+                            'moves.', selected_game.key.id(), len(moves),
+                            selected_game.move_count)
+            return False
+
+        _saveGameArchive(selected_game.key, moves, boat_query.fetch())
+
+    _deleteInBatches(move_query)
+    _deleteInBatches(boat_query)
+
+    # Replays of archived games are built from the archive instead.
+    _deleteInBatches(BoardSnapshot.query(ancestor=selected_game.key))
+
+    _markGameArchived(selected_game.key)
+    return True
+
+
+@ndb.transactional
+def _saveGameArchive(game_key, moves, boats):
+    """
+    Build and save a games' archive, unless it already has one.
+
+    Args:
+      game_key: the key of the game.
+      moves: a list of the games' Move objects ordered by sequence.
+      boats: a list of the games' Boat objects.
+    """
+    selected_game = game_key.get()
+    if selected_game.archive is None:
+        selected_game.archive = _buildGameArchive(selected_game, moves, boats)
+        selected_game.put()
+
+
+@ndb.transactional
+def _markGameArchived(game_key):
+    """Mark a game as archived once its Move and Boat entities are gone."""
+    selected_game = game_key.get()
+    selected_game.archived = True
+    selected_game.put()
+
+
+def _compactFinishedGames():
+    """
+    Archive a batch of finished and cancelled games.
+
+    Games saved before archived was added to Game only match once the
+    game backfill has written archived = False, see battle_backfill.
+
+    Returns:
+      The number of games archived.
+    """
+    games = Game.query(Game.archived == False,
+                       Game.status > 0  # Finished or Cancelled
+                       ).fetch(ARCHIVE_GAMES_PER_RUN)
+
+    archived = 0
+    for each_game in games:
+        if _archiveGame(each_game):
+            archived += 1
+
+    return archived
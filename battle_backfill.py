@@ -0,0 +1,205 @@
+"""
+
+Holds the one-off backfill of Game entities saved before newer properties
+were added to the Game model.
+
+Re-putting a Game writes the default of every property it was saved
+without, ie. archived = False so _compactFinishedGames can find finished
+games from before games were archived, and runs Game._pre_put_hook, which
+fills in players so a users' older games are found by their scores and
+games lists. Games in progress from before next_to_move and last_move_at
+were saved get both, from their last move, so they get reminder emails
+and can expire. Each game is re-put in its own transaction so a move
+made while the backfill runs is never overwritten.
+
+Start it once after deploying, from /admin/backfill_games.
+
+Also holds the one-off counter seed, which counts the games, shots and
+hits from before the global statistics counters existed and sets each
+counters' seed shard so its total matches. The running count is carried
+from task to task with the cursor. Start it once after deploying, from
+/admin/seed_counters.
+
+"""
+
+
+import logging
+
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from battle_models import Game
+from battle_models import Move
+
+from battle_consts import BACKFILL_BATCH
+from battle_consts import COUNTER_SEED_BATCH
+
+import battle_archive
+import battle_board
+import battle_counters
+import battle_game
+import battle_replay
+
+
+def _startGameBackfill():
+    """Queue the first task of the backfill."""
+    taskqueue.add(url='/tasks/backfill_games')
+
+
+def _backfillGames(websafe_cursor=None):
+    """
+    Re-put a batch of games, and queue a task for the next batch.
+
+    Args:
+      websafe_cursor: where the last batch stopped, if any.
+
+    Returns:
+      The number of games re-put.
+    """
+    start_cursor = None
+    if websafe_cursor:
+        start_cursor = ndb.Cursor(urlsafe=websafe_cursor)
+
+    game_keys, next_cursor, more = Game.query().fetch_page(
+        BACKFILL_BATCH, start_cursor=start_cursor, keys_only=True)
+
+    for game_key in game_keys:
+        selected_game = game_key.get()
+        if selected_game is None:
+            continue
+
+        if selected_game.status == 0 and selected_game.last_move_at is None:
+            # The turn is worked out from the last move, which can't be
+            # queried in the transaction.
+            _timeLegacyGame(game_key, _getNextToMove(selected_game))
+
+        _backfillGame(game_key)
+
+    if more and next_cursor:
+        taskqueue.add(url='/tasks/backfill_games',
+                      params={'cursor': next_cursor.urlsafe()})
+    else:
+        logging.info('Finished the game backfill.')
+
+    return len(game_keys)
+
+
+@ndb.transactional
+def _backfillGame(game_key):
+    """Re-put a game so every property it lacks is written."""
+    selected_game = game_key.get()
+    if selected_game is not None:
+        selected_game.put()
+
+
+def _getNextToMove(selected_game):
+    """
+    Work out whose turn it is in a game from before next_to_move was
+    saved, from its last move.
+
+    Args:
+      selected_game: the Game object.
+
+    Returns:
+      The key of the user whose turn it is, or None before the first move.
+    """
+    last_move = battle_game._getGameLastMove(selected_game.key)
+
+    if last_move is None:
+        return None
+    if last_move.user_id == selected_game.user1:
+        return selected_game.user2
+    return selected_game.user1
+
+
+@ndb.transactional
+def _timeLegacyGame(game_key, next_to_move):
+    """
+    Give a game in progress from before last_move_at was saved the time
+    of the backfill, so it expires if no move is made from now on, and
+    set whose turn it is. Games with a move since they were read are left
+    alone.
+    """
+    selected_game = game_key.get()
+    if selected_game.last_move_at is not None:
+        return
+
+    selected_game.last_move_at = datetime.now()
+    selected_game.next_to_move = next_to_move
+    selected_game.put()
+
+
+def _startCounterSeed():
+    """Queue the first task of the counter seed."""
+    taskqueue.add(url='/tasks/seed_counters')
+
+
+def _countGames(websafe_cursor=None, counted=None):
+    """
+    Count a batch of games, and queue a task for the next batch. Once
+    every game is counted, set the seed shards.
+
+    Args:
+      websafe_cursor: where the last batch stopped, if any.
+      counted: a dict of counter name to the count so far, if any.
+
+    Returns:
+      The number of games counted.
+    """
+    if counted is None:
+        counted = dict((counter_name, 0)
+                       for counter_name in battle_counters.COUNTER_NAMES)
+
+    start_cursor = None
+    if websafe_cursor:
+        start_cursor = ndb.Cursor(urlsafe=websafe_cursor)
+
+    games, next_cursor, more = Game.query().fetch_page(
+        COUNTER_SEED_BATCH, start_cursor=start_cursor)
+
+    for each_game in games:
+        counted[battle_counters.GAMES_STARTED] += 1
+        if each_game.status == 1:  # Finished
+            counted[battle_counters.GAMES_FINISHED] += 1
+        elif each_game.status == 2:  # Cancelled
+            counted[battle_counters.GAMES_CANCELLED] += 1
+
+        counted[battle_counters.SHOTS] += battle_replay._getMoveCount(
+            each_game)
+        counted[battle_counters.HITS] += _countHits(each_game)
+
+    if more and next_cursor:
+        params = dict(counted, cursor=next_cursor.urlsafe())
+        taskqueue.add(url='/tasks/seed_counters', params=params)
+    else:
+        battle_counters._seedCounters(counted)
+        logging.info('Seeded the counters with %s.', counted)
+
+    return len(games)
+
+
+def _countHits(selected_game):
+    """
+    Count the hits made in a game, by both users.
+
+    Args:
+      selected_game: the Game object.
+
+    Returns:
+      The number of moves that were a hit.
+    """
+    if selected_game.board1 is not None:
+        hit_codes = battle_board.BOAT_CODES.lower()
+        return len([cell for cell in selected_game.board1 + selected_game.board2
+                    if cell in hit_codes])
+
+    if selected_game.archive is not None:
+        return len([each_move for each_move in
+                    battle_archive._getArchivedMoves(selected_game)
+                    if each_move.status == 1])  # Hit
+
+    return Move.query(Move.game_id == selected_game.key,
+                      Move.status == 1  # Hit
+                      ).count()
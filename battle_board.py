@@ -0,0 +1,271 @@
+"""
+
+Holds the compact board encoding shared by the board endpoints.
+
+A board is a 100 character string, one character per cell, row A first
+and column 1 first within a row. A users' own board holds their boats and
+every shot their opponent has made at it:
+
+  .  water that hasn't been shot
+  o  water that has been shot (a miss)
+  C B S D P  part of a Carrier, Battleship, Submarine, Destroyer or Patrol
+             boat that hasn't been hit
+  c b s d p  part of a boat that has been hit
+
+The opponent only sees a target view of the same board:
+
+  .  not shot yet
+  o  miss
+  x  hit
+  #  part of a sunk boat
+
+This module only depends on battle_consts so it can be used outside of
+App Engine.
+
+"""
+
+
+import battle_consts
+
+from random import randint
+
+
+BOAT_CODES = 'CBSDP'  # Indexed by boat type.
+
+BOAT_NAMES = ['Carrier', 'Battleship', 'Submarine', 'Destroyer', 'Patrol']
+
+BOAT_HITS = [battle_consts.CARRIER_HITS,  # Indexed by boat type.
+             battle_consts.BATTLESHIP_HITS,
+             battle_consts.SUBMARINE_HITS,
+             battle_consts.DESTROYER_HITS,
+             battle_consts.PATROL_HITS]
+
+WATER = '.'
+MISS = 'o'
+TARGET_HIT = 'x'
+TARGET_SUNK = '#'
+
+BOARD_SIZE = len(battle_consts.VALID_ROWS) * len(battle_consts.VALID_COLS)
+
+EMPTY_BOARD = WATER * BOARD_SIZE
+
+
+def _cellIndex(row, col):
+    """
+    Get the position of a cell in a board string.
+
+    Args:
+      row: the row letter, A-J.
+      col: the column number, 1-10.
+
+    Returns:
+      An integer from 0 to 99.
+    """
+    return (battle_consts.BOARD_ROWS.index(row) * len(battle_consts.VALID_COLS) +
+            col - 1)
+
+
+def _cellRowCol(cell_index):
+    """
+    Get the row and column of a position in a board string.
+
+    Args:
+      cell_index: an integer from 0 to 99.
+
+    Returns:
+      A tuple with the row letter[0] and column number[1].
+    """
+    row_index, col_index = divmod(cell_index, len(battle_consts.VALID_COLS))
+    return (battle_consts.BOARD_ROWS[row_index], col_index + 1)
+
+
+def _packMoves(moves):
+    """
+    Pack a games' moves into two bytes per move, for compact histories.
+
+    The first byte of a move is its cell index and the second is the
+    player index times 4 plus the move status; 0 = Miss, 1 = Hit and
+    2 = Duplicate.
+
+    Args:
+      moves: a list of (player index, cell index, status) tuples in order,
+        the player index being 0 for user1 and 1 for user2.
+
+    Returns:
+      A byte string.
+    """
+    packed = bytearray()
+    for player, cell_index, status in moves:
+        packed.append(cell_index)
+        packed.append(player << 2 | status)
+    return bytes(packed)
+
+
+def _unpackMoves(packed):
+    """
+    Unpack moves packed by _packMoves.
+
+    Returns:
+      A list of (player index, cell index, status) tuples.
+    """
+    packed = bytearray(packed)
+    return [(packed[index + 1] >> 2, packed[index], packed[index + 1] & 3)
+            for index in range(0, len(packed), 2)]
+
+
+def _boardFromBoats(boats):
+    """
+    Build a board with boats that haven't been hit.
+
+    Args:
+      boats: objects with boat_type, row and col attributes ie. Boat entities.
+
+    Returns:
+      A board string.
+    """
+    cells = list(EMPTY_BOARD)
+    for each_boat in boats:
+        cells[_cellIndex(each_boat.row, each_boat.col)] = (
+            BOAT_CODES[each_boat.boat_type])
+    return ''.join(cells)
+
+
+def _randomBoard():
+    """
+    Place a full fleet at random, without any Boat entities.
+
+    Used by the standalone server; games on App Engine place their boats
+    with battle_boat._generateBoats.
+
+    Returns:
+      A board string.
+    """
+    rows = len(battle_consts.VALID_ROWS)
+    cols = len(battle_consts.VALID_COLS)
+    cells = list(EMPTY_BOARD)
+
+    for boat_type, boat_hits in enumerate(BOAT_HITS):
+        while True:
+            if randint(0, 1) == 0:  # horizontal
+                start = randint(0, rows - 1) * cols + randint(0, cols - boat_hits)
+                boat_cells = range(start, start + boat_hits)
+            else:  # vertical
+                start = randint(0, rows - boat_hits) * cols + randint(0, cols - 1)
+                boat_cells = range(start, start + boat_hits * cols, cols)
+
+            if all(cells[cell_index] == WATER for cell_index in boat_cells):
+                break
+
+        for cell_index in boat_cells:
+            cells[cell_index] = BOAT_CODES[boat_type]
+
+    return ''.join(cells)
+
+
+def _unshotBoard(board):
+    """
+    Get a board as it was before any shots were fired at it.
+
+    Args:
+      board: a board string.
+
+    Returns:
+      A board string.
+    """
+    return ''.join(WATER if cell == MISS else cell.upper() for cell in board)
+
+
+def _applyShot(board, row, col):
+    """
+    Fire a shot at a board.
+
+    Args:
+      board: the board string being shot at.
+      row: the row letter, A-J.
+      col: the column number, 1-10.
+
+    Returns:
+      A tuple with the new board string[0] and the result of the shot[1];
+      0 = miss, 1 = hit, 2 = duplicate, the same as Move.status.
+    """
+    cell_index = _cellIndex(row, col)
+    cell = board[cell_index]
+
+    if cell == WATER:
+        return (board[:cell_index] + MISS + board[cell_index + 1:], 0)
+
+    if cell in BOAT_CODES:
+        return (board[:cell_index] + cell.lower() + board[cell_index + 1:], 1)
+
+    return (board, 2)
+
+
+def _boatIsSunkOnBoard(board, boat_type):
+    """
+    Determine if a boat is sunk.
+
+    Args:
+      board: a board string.
+      boat_type: the boat type to check.
+
+    Returns:
+      True if every part of the boat has been hit.
+    """
+    code = BOAT_CODES[boat_type]
+    return code.lower() in board and code not in board
+
+
+def _sunkBoatTypes(board):
+    """
+    Get the boats that are sunk.
+
+    Args:
+      board: a board string.
+
+    Returns:
+      A list of boat types.
+    """
+    return [boat_type for boat_type in range(len(BOAT_CODES))
+            if _boatIsSunkOnBoard(board, boat_type)]
+
+
+def _targetView(board):
+    """
+    Get the view of a board that the opponent is allowed to see.
+
+    Args:
+      board: a board string.
+
+    Returns:
+      A target string, see the module docstring.
+    """
+    sunk_codes = ''.join(BOAT_CODES[boat_type].lower()
+                         for boat_type in _sunkBoatTypes(board))
+    cells = []
+    for cell in board:
+        if cell == MISS:
+            cells.append(MISS)
+        elif cell.islower() and cell in sunk_codes:
+            cells.append(TARGET_SUNK)
+        elif cell.islower():
+            cells.append(TARGET_HIT)
+        else:
+            cells.append(WATER)
+    return ''.join(cells)
+
+
+def _boardScore(board):
+    """
+    Get the score of the user shooting at a board.
+
+    Args:
+      board: a board string.
+
+    Returns:
+      a tuple;
+        hits[0]
+        misses[1]
+        sunk boats[2]
+    """
+    hits = sum(1 for cell in board if cell.islower() and cell != MISS)
+    return (hits, board.count(MISS), len(_sunkBoatTypes(board)))
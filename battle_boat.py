@@ -5,16 +5,10 @@ Holds all methods relating to boat actions and/or Boat kind.
 """
 
 
-import endpoints
-
 from google.appengine.ext import ndb
 
 from battle_models import Boat
 
-from battle_messages import SingleBoatForList
-
-from battle_game import _validateAndGetGame
-
 import battle_consts
 
 from random import randint
@@ -89,6 +83,8 @@ def _copyBoatToList(boat_to_copy):
     Returns:
       an outbound message populated with info from boat_to_copy arg
     """
+    from battle_messages import SingleBoatForList
+
     selected_boat = SingleBoatForList()
 
     # Iterate through all fields in the boat message.
@@ -127,6 +123,11 @@ def _copyBoatToList(boat_to_copy):
     return selected_boat
 
 
+# A blank 10x10 board is the same every time, so it is built once when the
+# module is loaded and _buildBoard hands out copies of it.
+_BLANK_BOARD = [[x, y] for x in range(1, 11) for y in range(1, 11)]
+
+
 def _buildBoard():
     """
     Build a 10x10 board.
@@ -134,21 +135,11 @@ def _buildBoard():
     Returns:
       A list of tuples representing a blank 10x10 board.
     """
-    x = 1
-    y = 1
-    master_coord = []
-
-    for x in range(1, 11):
-        for y in range(1, 11):
-            single_coord = [x, y]
-            master_coord.append(single_coord)
-            y += 1
-        x += 1
+    return [list(each_coord) for each_coord in _BLANK_BOARD]
 
-    return master_coord
 
-
-def _addBoat(game_key, user_key, master_coord, boat_type, boat_hits):
+def _addBoat(game_key, user_key, master_coord, boat_type, boat_hits,
+             placed_boats):
     """
     Add a boat to a users' board.
 
@@ -158,6 +149,7 @@ def _addBoat(game_key, user_key, master_coord, boat_type, boat_hits):
       master_coord: the co-ordinates that are still available.
       boat_type: the type of boat that's being added.
       boat_hits: the number of hits to sink the boat.
+      placed_boats: a list that each new, unsaved Boat entity is added to.
 
     Returns:
       True if the boat was successfully added to the players' board.
@@ -236,9 +228,10 @@ def _addBoat(game_key, user_key, master_coord, boat_type, boat_hits):
                 row=battle_consts.BOARD_ROWS[boat_row],
                 col=boat_col
             )
-            new_boat.put()
+            placed_boats.append(new_boat)
 
-            new_boat_coord = (new_boat.row, new_boat.col)
+            # master_coord holds [row number, col] pairs.
+            new_boat_coord = [boat_row + 1, boat_col]
 
             # Remove coords from master coord so they can't be used again.
             for mc in range(0, len(master_coord)):
@@ -254,45 +247,73 @@ def _addBoat(game_key, user_key, master_coord, boat_type, boat_hits):
     return False
 
 
-def _generateBoardAndBoats(game_key, user_key):
+def _generateBoats(game_key, user_key):
     """
-    Generate a board and all boats for a user.
+    Generate a board and all boats for a user, without saving them.
 
     Args:
       game_key: the game that the user is playing.
       user_key: the user that's playing.
+
+    Returns:
+      A list of unsaved Boat entities.
     """
 
     # Get a list of all available co-ords on the board.
     master_coord = _buildBoard()
 
+    placed_boats = []
+
     # Create all boats for the user.
     _addBoat(game_key,
              user_key,
              master_coord,
              battle_consts.CARRIER,
-             battle_consts.CARRIER_HITS)
+             battle_consts.CARRIER_HITS,
+             placed_boats)
 
     _addBoat(game_key,
              user_key,
              master_coord,
              battle_consts.BATTLESHIP,
-             battle_consts.BATTLESHIP_HITS)
+             battle_consts.BATTLESHIP_HITS,
+             placed_boats)
 
     _addBoat(game_key,
              user_key,
              master_coord,
              battle_consts.SUBMARINE,
-             battle_consts.SUBMARINE_HITS)
+             battle_consts.SUBMARINE_HITS,
+             placed_boats)
 
     _addBoat(game_key,
              user_key,
              master_coord,
              battle_consts.DESTROYER,
-             battle_consts.DESTROYER_HITS)
+             battle_consts.DESTROYER_HITS,
+             placed_boats)
 
     _addBoat(game_key,
              user_key,
              master_coord,
              battle_consts.PATROL,
-             battle_consts.PATROL_HITS)
+             battle_consts.PATROL_HITS,
+             placed_boats)
+
+    return placed_boats
+
+
+def _generateBoardAndBoats(game_key, user_key):
+    """
+    Generate a board and all boats for a user.
+
+    Args:
+      game_key: the game that the user is playing.
+      user_key: the user that's playing.
+
+    Returns:
+      A list of the Boat entities that were created.
+    """
+    placed_boats = _generateBoats(game_key, user_key)
+    ndb.put_multi(placed_boats)
+    return placed_boats
@@ -0,0 +1,237 @@
+"""
+
+Holds the versioned response cache for the read endpoints.
+
+Every cached response is stored under a key that includes the current
+version of the games and users it was built from. Write paths bump those
+versions, so stale responses are never served; they simply stop being
+looked up and age out of the cache.
+
+"""
+
+
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+from battle_consts import CACHE_TTL_SECONDS
+from battle_consts import CACHE_LOCAL_SIZE
+from battle_consts import CACHE_LOG_EVERY
+
+
+class LocalLRUCache(object):
+    """
+    A least recently used cache in this instances' memory. It supports the
+    parts of the memcache API used by this module so it can stand in for
+    memcache on the dev server and in tests.
+    """
+
+    def __init__(self, max_size=CACHE_LOCAL_SIZE):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def get_multi(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set(self, key, value, time=0):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+        return True
+
+    def add(self, key, value, time=0):
+        with self._lock:
+            if key in self._items:
+                return False
+        return self.set(key, value, time)
+
+    def incr(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            value = self._items.pop(key) + 1
+            self._items[key] = value
+            return value
+
+
+_backend = None
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _getBackend():
+    """
+    Get the cache backend.
+
+    Returns:
+      A LocalLRUCache on the dev server, otherwise the memcache module.
+    """
+    global _backend
+
+    if _backend is None:
+        if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+            _backend = LocalLRUCache()
+        else:
+            _backend = memcache
+
+    return _backend
+
+
+def _setBackend(backend):
+    """
+    Replace the cache backend, ie. in tests.
+
+    Args:
+      backend: a LocalLRUCache, the memcache module or a compatible object.
+    """
+    global _backend
+    _backend = backend
+
+
+def _newVersion():
+    """
+    Get a starting version for a version counter. A counter that was
+    evicted starts again from the current time, which is higher than any
+    version it held before, so old responses can't be matched again.
+
+    Returns:
+      An integer version.
+    """
+    return int(time.time() * 1000)
+
+
+def _getVersions(version_names):
+    """
+    Get the current version of each name.
+
+    Args:
+      version_names: a list of names ie. 'game:<websafe key>'.
+
+    Returns:
+      A list of integer versions in the same order as version_names.
+    """
+    backend = _getBackend()
+    keys = ['version:' + name for name in version_names]
+    found = backend.get_multi(keys)
+
+    versions = []
+    for key in keys:
+        if key not in found:
+            new_version = _newVersion()
+            if not backend.add(key, new_version):
+                new_version = backend.get(key) or new_version
+            found[key] = new_version
+        versions.append(found[key])
+
+    return versions
+
+
+def _bumpVersions(*version_names):
+    """
+    Bump the version of each name so cached responses built from the old
+    version are no longer served.
+
+    Args:
+      version_names: names ie. 'game:<websafe key>'.
+    """
+    backend = _getBackend()
+
+    for name in version_names:
+        key = 'version:' + name
+        if backend.incr(key) is None:
+            backend.set(key, _newVersion())
+
+
+def _gameVersion(game_key):
+    """Get the version name for a game."""
+    return 'game:' + game_key.urlsafe()
+
+
+def _userVersion(user_key):
+    """Get the version name for a user."""
+    return 'user:' + user_key.urlsafe()
+
+
+RANKINGS_VERSION = 'rankings'
+
+ANALYTICS_VERSION = 'shot_analytics'
+
+
+def _recordLookup(endpoint_name, hit):
+    """
+    Count a cache lookup and log the hit rate now and then.
+
+    Args:
+      endpoint_name: the name of the endpoint.
+      hit: True if the response came from the cache.
+    """
+    with _stats_lock:
+        hits, lookups = _stats.get(endpoint_name, (0, 0))
+        hits += 1 if hit else 0
+        lookups += 1
+        _stats[endpoint_name] = (hits, lookups)
+
+    if lookups % CACHE_LOG_EVERY == 0:
+        logging.info('Response cache %s: %d hits / %d lookups (%.1f%%)',
+                     endpoint_name, hits, lookups, 100.0 * hits / lookups)
+
+
+def _cachedResponse(endpoint_name, request_key, version_names,
+                    message_type, build_response, cacheable=None):
+    """
+    Serve a response from the cache, building and caching it on a miss.
+
+    Args:
+      endpoint_name: the name of the endpoint.
+      request_key: a string identifying the request arguments.
+      version_names: the names of the versions the response depends on.
+      message_type: the ProtoRPC message class of the response.
+      build_response: a function that builds the response.
+      cacheable: a function that gets the built response and returns False
+        if it must not be cached, ie. an eventually consistent query may
+        have missed a write made just before the versions were bumped.
+
+    Returns:
+      A message_type instance.
+    """
+    from protorpc import protojson
+
+    backend = _getBackend()
+    versions = _getVersions(version_names)
+    cache_key = 'response:%s:%s:%s' % (
+        endpoint_name, request_key, ':'.join(str(v) for v in versions))
+
+    cached = backend.get(cache_key)
+    if cached is not None:
+        _recordLookup(endpoint_name, True)
+        return protojson.decode_message(message_type, cached)
+
+    _recordLookup(endpoint_name, False)
+    response = build_response()
+    if cacheable is None or cacheable(response):
+        backend.set(cache_key, protojson.encode_message(response),
+                    time=CACHE_TTL_SECONDS)
+
+    return response
@@ -0,0 +1,475 @@
+"""
+
+Python client for the Battleship Game API, for bots and load tests.
+
+Connections are kept alive and shared between threads through a small
+pool, so a bot making hundreds of moves only pays for the TCP and TLS
+handshakes once per connection. Every call is timed into a latency
+histogram per API method.
+
+This file is not deployed with the app (see skip_files in app.yaml).
+
+Usage:
+  from battle_client import BattleshipClient
+
+  client = BattleshipClient('https://<your app id>.appspot.com')
+  # or a local dev server for offline testing;
+  client = BattleshipClient('http://localhost:8080')
+
+  harry = client.create_user('Harry')['message']
+  ...
+  results = client.fan_out(client.get_user_score,
+                           [(user_key,) for user_key in user_keys])
+  print client.latency_report()
+
+"""
+
+
+import httplib
+import json
+import random
+import socket
+import threading
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty, Full
+
+
+API_ROOT = '/_ah/api/battleship/v1/'
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500,
+                   1000, 2000, 5000, 10000, float('inf')]
+
+# Responses worth retrying; the server didn't handle the request.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class ApiError(Exception):
+    """The API returned an error response."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, '{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class LatencyHistogram(object):
+    """A thread-safe histogram of call latencies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms):
+        """
+        Record one call.
+
+        Args:
+          elapsed_ms: how long the call took in milliseconds.
+        """
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed_ms <= bound:
+                break
+
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, percent):
+        """
+        Get an upper bound for a percentile of the recorded latencies.
+
+        Args:
+          percent: the percentile ie. 99.
+
+        Returns:
+          The upper bound of the bucket holding the percentile, in ms.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            max_ms = self.max_ms
+
+        wanted = count * percent / 100.0
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            seen += bucket_count
+            if seen >= wanted and seen > 0:
+                return min(bound, max_ms)
+        return 0.0
+
+    def buckets(self):
+        """
+        Get the count in each bucket.
+
+        Returns:
+          A list of (upper bound in ms, count) tuples.
+        """
+        with self._lock:
+            return zip(LATENCY_BUCKETS, list(self._counts))
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of keep-alive connections to one host."""
+
+    def __init__(self, base_url, size, timeout):
+        parsed = urlparse.urlparse(base_url)
+        self.secure = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self._idle = Queue(maxsize=size)
+
+    def acquire(self):
+        """
+        Get an idle connection, or open a new one.
+
+        Returns:
+          a tuple;
+            an HTTP(S)Connection[0]
+            True if the connection has been used before[1]
+        """
+        try:
+            return (self._idle.get_nowait(), True)
+        except Empty:
+            pass
+
+        if self.secure:
+            connection = httplib.HTTPSConnection(self.host, self.port,
+                                                 timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(self.host, self.port,
+                                                timeout=self.timeout)
+        return (connection, False)
+
+    def release(self, connection):
+        """
+        Return a connection to the pool, closing it if the pool is full.
+
+        Args:
+          connection: a connection from acquire whose response has been read.
+        """
+        try:
+            self._idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+class BattleshipClient(object):
+    """
+    Client for every method of the battleship v1 API.
+
+    A single client can be shared by any number of threads.
+    """
+
+    def __init__(self, base_url='http://localhost:8080', pool_size=10,
+                 timeout=30, retries=3, backoff=0.1):
+        """
+        Args:
+          base_url: the app url ie. https://<app id>.appspot.com, or a local
+            dev server.
+          pool_size: the most idle connections to keep open.
+          timeout: the socket timeout of each call in seconds.
+          retries: the most times to retry a failed call.
+          backoff: the delay before the first retry in seconds; it doubles
+            with each retry.
+        """
+        self._pool = ConnectionPool(base_url, pool_size, timeout)
+        self._retries = retries
+        self._backoff = backoff
+        self._histograms = {}
+        self._histograms_lock = threading.Lock()
+
+    def close(self):
+        """Close all pooled connections."""
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _histogram(self, name):
+        with self._histograms_lock:
+            if name not in self._histograms:
+                self._histograms[name] = LatencyHistogram()
+            return self._histograms[name]
+
+    def _send(self, http_method, url, body):
+        """
+        Send one request over a pooled connection.
+
+        Returns:
+          a tuple;
+            the response status[0]
+            the response body[1]
+
+        Raises:
+          _StaleConnection if a reused connection turned out to be closed
+          by the server, in which case the request was never handled.
+        """
+        connection, reused = self._pool.acquire()
+        headers = {'Content-Type': 'application/json'}
+        try:
+            connection.request(http_method, url, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except socket.timeout:
+            # The server may still handle the request; never treat as stale.
+            connection.close()
+            raise
+        except (httplib.BadStatusLine, socket.error):
+            connection.close()
+            if reused:
+                raise _StaleConnection()
+            raise
+
+        if response.getheader('connection', '').lower() == 'close':
+            connection.close()
+        else:
+            self._pool.release(connection)
+        return (response.status, data)
+
+    def call(self, name, http_method, path, params=None):
+        """
+        Call an API method.
+
+        GET requests are retried on connection errors and server errors.
+        POST requests aren't idempotent so they're only retried when the
+        server can't have handled them; a stale keep-alive connection or a
+        503.
+
+        Args:
+          name: the API method name, used for the latency histogram.
+          http_method: 'GET' or 'POST'.
+          path: the API method path ie. 'makeMove'.
+          params: a dict of request parameters; lists become repeated params.
+
+        Returns:
+          The decoded JSON response.
+
+        Raises:
+          ApiError if the API returns an error, or the retries run out.
+        """
+        query = urllib.urlencode(
+            [(param, value) for param, value in sorted((params or {}).items())
+             if value is not None], doseq=True)
+        url = API_ROOT + path + ('?' + query if query else '')
+        body = '{}' if http_method == 'POST' else None
+
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                status, data = self._send(http_method, url, body)
+            except _StaleConnection:
+                # Retry straight away on a fresh connection.
+                continue
+            except (httplib.HTTPException, socket.error) as error:
+                if http_method != 'GET' or attempt >= self._retries:
+                    raise ApiError(0, str(error))
+                status, data = (0, None)
+            else:
+                self._histogram(name).record((time.time() - start) * 1000)
+
+            if status and status < 400:
+                return json.loads(data) if data else {}
+
+            retry = (status == 503 or
+                     (http_method == 'GET' and
+                      (status == 0 or status in RETRY_STATUSES)))
+            if not retry or attempt >= self._retries:
+                raise ApiError(status, _errorMessage(data))
+
+            # Exponential backoff with jitter so bots don't retry in step.
+            time.sleep(self._backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def fan_out(self, method, args_list, workers=10):
+        """
+        Run many calls concurrently over the shared connection pool.
+
+        Args:
+          method: a bound client method ie. client.get_game.
+          args_list: a list of argument tuples, one per call.
+          workers: the number of threads.
+
+        Returns:
+          A list of results in the same order as args_list. A call that
+          failed has its ApiError in place of a result.
+        """
+        def run(args):
+            try:
+                return method(*args)
+            except ApiError as error:
+                return error
+
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(run, args_list)
+        finally:
+            pool.close()
+            pool.join()
+
+    def latency(self):
+        """
+        Get the latency histogram of every API method called so far.
+
+        Returns:
+          A dict of method name to LatencyHistogram.
+        """
+        with self._histograms_lock:
+            return dict(self._histograms)
+
+    def latency_report(self):
+        """
+        Get a printable summary of the latency of every API method.
+
+        Returns:
+          A string with one line per API method.
+        """
+        lines = ['%-26s %8s %9s %9s %9s %9s' % ('method', 'calls', 'mean ms',
+                                                'p50 ms', 'p99 ms', 'max ms')]
+        for name, histogram in sorted(self.latency().items()):
+            lines.append('%-26s %8d %9.1f %9.1f %9.1f %9.1f' % (
+                name, histogram.count,
+                histogram.total_ms / max(histogram.count, 1),
+                histogram.percentile(50), histogram.percentile(99),
+                histogram.max_ms))
+        return '\n'.join(lines)
+
+    #   API Methods ------------------------------------------------------------
+
+    def create_user(self, username, email=None):
+        return self.call('create_user', 'POST', 'createUser',
+                         {'username': username, 'email': email})
+
+    def new_game(self, websafe_username1_key, websafe_username2_key):
+        return self.call('new_game', 'POST', 'newGame',
+                         {'websafe_username1_key': websafe_username1_key,
+                          'websafe_username2_key': websafe_username2_key})
+
+    def cancel_game(self, websafe_game_key):
+        return self.call('cancel_game', 'POST', 'cancelGame',
+                         {'websafe_game_key': websafe_game_key})
+
+    def make_move(self, websafe_game_key, websafe_user_key, row, col):
+        return self.call('make_move', 'POST', 'makeMove',
+                         {'websafe_game_key': websafe_game_key,
+                          'websafe_user_key': websafe_user_key,
+                          'row': row, 'col': col})
+
+    def get_user_games(self, websafe_user_key):
+        return self.call('get_user_games', 'GET', 'getUserGames',
+                         {'websafe_user_key': websafe_user_key})
+
+    def get_game_history(self, websafe_game_key, if_version=None):
+        return self.call('get_game_history', 'GET', 'getGameHistory',
+                         {'websafe_game_key': websafe_game_key,
+                          'if_version': if_version})
+
+    def get_compact_game_history(self, websafe_game_key, if_version=None):
+        return self.call('get_compact_game_history', 'GET',
+                         'getCompactGameHistory',
+                         {'websafe_game_key': websafe_game_key,
+                          'if_version': if_version})
+
+    def get_game(self, websafe_game_key, if_version=None):
+        return self.call('get_game', 'GET', 'getGameState',
+                         {'websafe_game_key': websafe_game_key,
+                          'if_version': if_version})
+
+    def get_games_state(self, websafe_game_keys):
+        return self.call('get_games_state', 'GET', 'getGamesState',
+                         {'websafe_game_keys': list(websafe_game_keys)})
+
+    def get_user_boats(self, websafe_game_key, websafe_user_key,
+                       if_version=None):
+        return self.call('get_user_boats', 'GET', 'getUserBoats',
+                         {'websafe_game_key': websafe_game_key,
+                          'websafe_user_key': websafe_user_key,
+                          'if_version': if_version})
+
+    def get_user_score(self, websafe_user_key):
+        return self.call('get_user_score', 'GET', 'getUserScore',
+                         {'websafe_user_key': websafe_user_key})
+
+    def get_user_rankings(self):
+        return self.call('get_user_rankings', 'GET', 'getUserRankings')
+
+    def get_board_at(self, websafe_game_key, move_index):
+        return self.call('get_board_at', 'GET', 'getBoardAt',
+                         {'websafe_game_key': websafe_game_key,
+                          'move_index': move_index})
+
+    def get_board_view(self, websafe_game_key, websafe_user_key):
+        return self.call('get_board_view', 'GET', 'getBoardView',
+                         {'websafe_game_key': websafe_game_key,
+                          'websafe_user_key': websafe_user_key})
+
+    def join_matchmaking(self, websafe_user_key):
+        return self.call('join_matchmaking', 'POST', 'joinMatchmaking',
+                         {'websafe_user_key': websafe_user_key})
+
+    def get_global_stats(self):
+        return self.call('get_global_stats', 'GET', 'getGlobalStats')
+
+    def get_matchmaking_status(self, websafe_user_key):
+        return self.call('get_matchmaking_status', 'GET',
+                         'getMatchmakingStatus',
+                         {'websafe_user_key': websafe_user_key})
+
+    def create_tournament(self, name, websafe_user_keys):
+        return self.call('create_tournament', 'POST', 'createTournament',
+                         {'name': name,
+                          'websafe_user_keys': list(websafe_user_keys)})
+
+    def get_shot_analytics(self):
+        return self.call('get_shot_analytics', 'GET', 'getShotAnalytics')
+
+    def get_shot_hint(self, websafe_game_key, websafe_user_key):
+        return self.call('get_shot_hint', 'GET', 'getShotHint',
+                         {'websafe_game_key': websafe_game_key,
+                          'websafe_user_key': websafe_user_key})
+
+    def get_tournament_standings(self, websafe_tournament_key):
+        return self.call('get_tournament_standings', 'GET',
+                         'getTournamentStandings',
+                         {'websafe_tournament_key': websafe_tournament_key})
+
+
+class _StaleConnection(Exception):
+    """A reused keep-alive connection was closed by the server."""
+
+
+def _errorMessage(data):
+    """
+    Get the error message from an API error response.
+
+    Args:
+      data: the response body.
+
+    Returns:
+      The error message, or the raw body if it isn't an API error.
+    """
+    try:
+        return json.loads(data)['error']['message']
+    except (TypeError, ValueError, KeyError):
+        return data
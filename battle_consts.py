@@ -23,3 +23,129 @@ PATROL_HITS = 2
 TOTAL_HITS = 17
 
 BOARD_ROWS = "ABCDEFGHIJ"
+
+# Number of completed games archived per cron run.
+ARCHIVE_GAMES_PER_RUN = 20
+
+# Number of games re-put by each task of the one-off game backfill.
+BACKFILL_BATCH = 100
+
+# Number of games counted by each task of the one-off counter seed.
+COUNTER_SEED_BATCH = 50
+
+# Seconds after a games' last move before it can be archived, so the
+# Move query has caught up with the last moves.
+ARCHIVE_LAG_SECONDS = 300
+
+# Number of Move/Boat entities deleted per batch when archiving.
+ARCHIVE_DELETE_BATCH = 500
+
+# Number of recent events kept for each game event channel.
+EVENTS_PER_CHANNEL = 64
+
+# Number of seconds a game event is kept in memcache.
+EVENTS_TTL_SECONDS = 3600
+
+# Number of seconds between memcache polls while waiting for an event.
+EVENTS_POLL_INTERVAL = 0.5
+
+# Maximum number of seconds a game events request waits for a new event.
+EVENTS_MAX_WAIT = 25
+
+# Moves per second allowed for a user, and how many can be made at once,
+# unless set under env_variables in app.yaml (see battle_throttle).
+MOVE_RATE_PER_USER = 1.0
+MOVE_BURST_PER_USER = 5
+
+# Moves per second allowed in a game, and how many can be made at once,
+# unless set under env_variables in app.yaml (see battle_throttle).
+MOVE_RATE_PER_GAME = 2.0
+MOVE_BURST_PER_GAME = 10
+
+# Number of attempts to update a token bucket in memcache before falling
+# back to a bucket in the instances' memory.
+THROTTLE_CAS_RETRIES = 3
+
+# Log the throttle reject counters every this many rejects.
+THROTTLE_LOG_EVERY = 100
+
+# Number of seconds a cached response is kept.
+CACHE_TTL_SECONDS = 600
+
+# Number of responses kept by the local LRU cache.
+CACHE_LOCAL_SIZE = 1000
+
+# Log the response cache hit rate every this many lookups.
+CACHE_LOG_EVERY = 100
+
+# Request header that asks for a call to be profiled.
+PROFILE_HEADER = 'X-Battleship-Profile'
+
+# Number of functions, allocations and reports listed by the profiler.
+PROFILE_TOP_N = 50
+
+# Number of moves between saved board snapshots used to replay a game.
+SNAPSHOT_INTERVAL = 16
+
+# Number of waiting users considered by each matchmaking run.
+MATCHMAKING_BATCH = 200
+
+# Most entities saved in a single batched put.
+PUT_BATCH = 500
+
+# Number of tournament games created by each request or task.
+TOURNAMENT_CHUNK = 20
+
+# Most players allowed in a tournament.
+TOURNAMENT_MAX_PLAYERS = 100
+
+# Standalone server; how often buffered moves are written behind, in seconds.
+SERVER_FLUSH_INTERVAL = 0.2
+
+# Standalone server; write buffered moves sooner once this many are waiting.
+SERVER_FLUSH_BATCH = 1000
+
+# Standalone server; write a fresh snapshot after this many journal records.
+SERVER_SNAPSHOT_EVERY = 50000
+
+# Most games in a single get_games_state request.
+GAMES_STATE_MAX = 100
+
+# Number of Move entities read by each shot analytics batch.
+ANALYTICS_MOVES_BATCH = 500
+
+# Number of archived games read by each shot analytics batch.
+ANALYTICS_GAMES_BATCH = 20
+
+# A shot analytics run that hasn't saved progress for this many hours is
+# assumed dead and started again.
+ANALYTICS_STALE_HOURS = 6
+
+# Fleets sampled at a time for a shot hint.
+HINT_SAMPLES = 4000
+
+# Most rounds of HINT_SAMPLES fleets sampled for one shot hint.
+HINT_MAX_ROUNDS = 5
+
+# A shot hint stops sampling once this many fleets explain every hit.
+HINT_MIN_ACCEPTED = 500
+
+# Days a game in progress can go without a move before it is cancelled,
+# unless BATTLESHIP_GAME_EXPIRY_DAYS is set in app.yaml.
+GAME_EXPIRY_DAYS = 14
+
+# Number of stale games each expiry task cancels.
+EXPIRY_BATCH = 240
+
+# Number of shards each global statistics counter is split over.
+COUNTER_SHARDS = 20
+
+# Seconds the summed global statistics counters are cached for.
+COUNTER_CACHE_SECONDS = 10
+
+# Number of games, with their moves and boats, each task deleting a user
+# deletes.
+USER_DELETE_GAMES_BATCH = 20
+
+# Number of users with an email read at a time by the email reminder job.
+REMINDER_BATCH = 200
@@ -20,6 +20,13 @@ from battle_messages import GameHistory
 from battle_messages import GetGameState
 from battle_messages import GetBoatList
 from battle_messages import GetSingleUserScore
+from battle_messages import GetBoardAt
+from battle_messages import GetBoardView
+from battle_messages import Matchmaking
+from battle_messages import NewTournament
+from battle_messages import GetTournamentStandings
+from battle_messages import GetGamesState
+from battle_messages import GetShotHint
 
 
 #   POST Requests -------------------------------------------------------------
@@ -54,6 +61,19 @@ MOVE_POST_REQUEST = endpoints.ResourceContainer(
 )
 
 
+MATCHMAKING_REQUEST = endpoints.ResourceContainer(
+    Matchmaking,
+    websafe_user_key=messages.StringField(1, required=True),
+)
+
+
+NEW_TOURNAMENT_REQUEST = endpoints.ResourceContainer(
+    NewTournament,
+    name=messages.StringField(1),
+    websafe_user_keys=messages.StringField(2, repeated=True),
+)
+
+
 #   GET Requests --------------------------------------------------------------
 
 
@@ -66,21 +86,52 @@ GET_USER_GAMES_REQUEST = endpoints.ResourceContainer(
 GET_GAME_HISTORY_REQUEST = endpoints.ResourceContainer(
     GameHistory,
     websafe_game_key=messages.StringField(1, required=True),
+    if_version=messages.IntegerField(2),
 )
 
 
 GET_GAME_STATE = endpoints.ResourceContainer(
     GetGameState,
     websafe_game_key=messages.StringField(1, required=True),
+    if_version=messages.IntegerField(2),
 )
 
 GET_BOAT_LIST = endpoints.ResourceContainer(
     GetBoatList,
     websafe_game_key=messages.StringField(1, required=True),
     websafe_user_key=messages.StringField(2, required=True),
+    if_version=messages.IntegerField(3),
 )
 
 GET_USER_SCORE = endpoints.ResourceContainer(
     GetSingleUserScore,
     websafe_user_key=messages.StringField(1, required=True),
 )
+
+GET_BOARD_AT = endpoints.ResourceContainer(
+    GetBoardAt,
+    websafe_game_key=messages.StringField(1, required=True),
+    move_index=messages.IntegerField(2, required=True),
+)
+
+GET_BOARD_VIEW = endpoints.ResourceContainer(
+    GetBoardView,
+    websafe_game_key=messages.StringField(1, required=True),
+    websafe_user_key=messages.StringField(2, required=True),
+)
+
+GET_TOURNAMENT_STANDINGS = endpoints.ResourceContainer(
+    GetTournamentStandings,
+    websafe_tournament_key=messages.StringField(1, required=True),
+)
+
+GET_GAMES_STATE = endpoints.ResourceContainer(
+    GetGamesState,
+    websafe_game_keys=messages.StringField(1, repeated=True),
+)
+
+GET_SHOT_HINT = endpoints.ResourceContainer(
+    GetShotHint,
+    websafe_game_key=messages.StringField(1, required=True),
+    websafe_user_key=messages.StringField(2, required=True),
+)
@@ -0,0 +1,146 @@
+"""
+
+Holds all methods relating to the global statistics counters.
+
+Counting games or moves with a query gets slower as they pile up, so
+global totals are kept in sharded counters instead. Each counter is
+split over COUNTER_SHARDS CounterShard entities and an increment updates
+one shard picked at random, so concurrent moves rarely touch the same
+entity group. A total is the sum of its shards.
+
+Each counter also has a seed shard, set once by the counter seed in
+battle_backfill to whatever was played before the counters existed.
+
+"""
+
+
+import logging
+import random
+
+from google.appengine.ext import ndb
+
+from battle_models import CounterShard
+
+from battle_consts import COUNTER_CACHE_SECONDS
+from battle_consts import COUNTER_SHARDS
+
+import battle_cache
+
+
+# Every counter. Games in progress are the games started less the games
+# finished or cancelled.
+GAMES_STARTED = 'games_started'
+GAMES_FINISHED = 'games_finished'
+GAMES_CANCELLED = 'games_cancelled'
+SHOTS = 'shots'
+HITS = 'hits'
+
+COUNTER_NAMES = [GAMES_STARTED, GAMES_FINISHED, GAMES_CANCELLED, SHOTS, HITS]
+
+# Shard index of the seed shard, which increments never pick.
+SEED_SHARD = 'seed'
+
+TOTALS_CACHE_KEY = 'counters:totals'
+
+
+def _shardKey(counter_name, shard_index):
+    """Get the key of a shard of a counter."""
+    return ndb.Key(CounterShard, '{}:{}'.format(counter_name, shard_index))
+
+
+def _allShardKeys():
+    """Get the keys of every shard of every counter, seed shards included."""
+    return [_shardKey(counter_name, shard_index)
+            for counter_name in COUNTER_NAMES
+            for shard_index in range(COUNTER_SHARDS) + [SEED_SHARD]]
+
+
+@ndb.transactional(xg=True)
+def _incrementShards(deltas):
+    """
+    Add to one random shard of each counter.
+
+    Args:
+      deltas: a dict of counter name to the amount to add.
+    """
+    counter_names = list(deltas)
+    shard_keys = [_shardKey(counter_name, random.randrange(COUNTER_SHARDS))
+                  for counter_name in counter_names]
+    shards = ndb.get_multi(shard_keys)
+
+    for index, counter_name in enumerate(counter_names):
+        if shards[index] is None:
+            shards[index] = CounterShard(key=shard_keys[index])
+        shards[index].count += deltas[counter_name]
+
+    ndb.put_multi(shards)
+
+
+def _incrementCounters(**deltas):
+    """
+    Add to counters, ie. _incrementCounters(shots=1, hits=1).
+
+    A failed increment is logged rather than raised; the move or game it
+    counts has already been saved.
+
+    Args:
+      deltas: the amount to add to each counter, by counter name.
+    """
+    deltas = dict((counter_name, delta)
+                  for counter_name, delta in deltas.items() if delta)
+    if not deltas:
+        return
+
+    try:
+        _incrementShards(deltas)
+    except Exception:
+        logging.exception('Could not increment counters %s', deltas)
+
+
+def _getCounterTotals():
+    """
+    Get the total of every counter, summing the shards with a single
+    get_multi. The totals are cached for COUNTER_CACHE_SECONDS.
+
+    Returns:
+      A dict of counter name to total.
+    """
+    backend = battle_cache._getBackend()
+    totals = backend.get(TOTALS_CACHE_KEY)
+    if totals is not None:
+        return totals
+
+    shard_keys = _allShardKeys()
+    shards = ndb.get_multi(shard_keys)
+
+    totals = dict((counter_name, 0) for counter_name in COUNTER_NAMES)
+    for shard_key, shard in zip(shard_keys, shards):
+        if shard is not None:
+            totals[shard_key.id().split(':')[0]] += shard.count
+
+    backend.set(TOTALS_CACHE_KEY, totals, time=COUNTER_CACHE_SECONDS)
+    return totals
+
+
+def _seedCounters(counted):
+    """
+    Set the seed shards so each counters' total is what was counted.
+
+    Args:
+      counted: a dict of counter name to the total counted from the games.
+    """
+    shard_keys = _allShardKeys()
+    shards = ndb.get_multi(shard_keys)
+
+    # What the random shards have counted already.
+    counted_by_shards = dict((counter_name, 0) for counter_name in COUNTER_NAMES)
+    for shard_key, shard in zip(shard_keys, shards):
+        shard_name, shard_index = shard_key.id().split(':')
+        if shard is not None and shard_index != SEED_SHARD:
+            counted_by_shards[shard_name] += shard.count
+
+    ndb.put_multi([
+        CounterShard(key=_shardKey(counter_name, SEED_SHARD),
+                     count=counted[counter_name] -
+                     counted_by_shards[counter_name])
+        for counter_name in COUNTER_NAMES])
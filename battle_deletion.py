@@ -0,0 +1,201 @@
+"""
+
+Holds all methods relating to deleting a user and all of their data.
+
+The User is deleted straight away, so the user can't start a game or make
+a move while the rest is cleaned up. Their games, with each games' moves,
+boats and board snapshots, are then deleted by tasks that each take a
+batch of games and carry on from a query cursor, so a user with thousands
+of games is deleted without hitting a deadline. The games are found by
+user1 and then by user2, rather than by players, so games saved before
+players existed are deleted too. The games and the users' GamePairs are
+read in full to find their opponents; everything else is read as keys.
+
+"""
+
+
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from battle_models import Boat
+from battle_models import BoardSnapshot
+from battle_models import Game
+from battle_models import GamePair
+from battle_models import MatchmakingEntry
+from battle_models import Move
+
+from battle_consts import USER_DELETE_GAMES_BATCH
+
+import battle_archive
+import battle_cache
+import battle_counters
+import battle_events
+import battle_game
+import battle_matchmaking
+
+
+PHASE_USER1_GAMES = 'user1'
+PHASE_USER2_GAMES = 'user2'
+PHASE_PAIRS = 'pairs'
+
+# The Game property each games phase finds the users' games by, and the
+# phase after it.
+GAMES_PHASES = {
+    PHASE_USER1_GAMES: ('user1', PHASE_USER2_GAMES),
+    PHASE_USER2_GAMES: ('user2', PHASE_PAIRS),
+}
+
+
+@ndb.transactional(xg=True)
+def _startUserDeletion(user_key):
+    """
+    Delete a user and queue the task that deletes the rest of their data.
+
+    Args:
+      user_key: the key of the user.
+
+    Returns:
+      False if the user doesn't exist, otherwise True.
+    """
+    if user_key.get() is None:
+        return False
+
+    ndb.delete_multi([user_key, battle_matchmaking._entryKey(user_key)])
+
+    taskqueue.add(url='/tasks/delete_user',
+                  params={'user': user_key.urlsafe(),
+                          'phase': PHASE_USER1_GAMES},
+                  transactional=True)
+    return True
+
+
+def _deleteUserData(user_key, phase, websafe_cursor=None):
+    """
+    Delete the next batch of a deleted users' data, and queue a task for
+    the batch after it.
+
+    Args:
+      user_key: the key of the deleted user.
+      phase: PHASE_USER1_GAMES or PHASE_USER2_GAMES to delete a batch of
+        the games the user played as user1 or user2, PHASE_PAIRS to delete
+        the users' GamePairs and matchmaking matches once the games are gone.
+      websafe_cursor: where the last batch of games stopped, if any.
+    """
+    # Tasks queued before games were found by user1 and user2 start over.
+    if phase == 'games':
+        phase, websafe_cursor = PHASE_USER1_GAMES, None
+
+    if phase in GAMES_PHASES:
+        property_name, next_phase = GAMES_PHASES[phase]
+        user_property = getattr(Game, property_name)
+
+        if phase == PHASE_USER1_GAMES and not websafe_cursor:
+            _cancelGamesInProgress(user_key)
+
+        start_cursor = None
+        if websafe_cursor:
+            start_cursor = ndb.Cursor(urlsafe=websafe_cursor)
+
+        games, next_cursor, more = Game.query(
+            user_property == user_key).fetch_page(USER_DELETE_GAMES_BATCH,
+                                                  start_cursor=start_cursor)
+
+        _deleteGames([each_game.key for each_game in games])
+
+        # Cached responses for the opponents no longer match.
+        opponent_keys = set(each_game.user2 if each_game.user1 == user_key
+                            else each_game.user1 for each_game in games)
+        battle_cache._bumpVersions(*[battle_cache._userVersion(opponent_key)
+                                     for opponent_key in opponent_keys])
+
+        params = {'user': user_key.urlsafe(), 'phase': phase}
+        if more and next_cursor:
+            params['cursor'] = next_cursor.urlsafe()
+        else:
+            params['phase'] = next_phase
+
+        taskqueue.add(url='/tasks/delete_user', params=params)
+    else:
+        _deletePairs(user_key)
+        logging.info('Finished deleting user %s.', user_key.id())
+
+
+def _cancelGamesInProgress(user_key):
+    """
+    Cancel a deleted users' games in progress, so their opponents and the
+    global counters see the games end before they are deleted.
+
+    Args:
+      user_key: the key of the deleted user.
+    """
+    game_keys = (Game.query(Game.user1 == user_key,
+                            Game.status == 0  # In Progress
+                            ).fetch(keys_only=True) +
+                 Game.query(Game.user2 == user_key,
+                            Game.status == 0  # In Progress
+                            ).fetch(keys_only=True))
+
+    cancelled = 0
+    for game_key in game_keys:
+        selected_game = battle_game._endGame(game_key, 2)  # Cancelled
+
+        # The game ended since it was queried.
+        if selected_game is None:
+            continue
+
+        cancelled += 1
+        battle_events._publishGameEvent(game_key, {
+            'type': 'status',
+            'game_status': selected_game.status
+        })
+
+    battle_counters._incrementCounters(games_cancelled=cancelled)
+
+
+def _deleteGames(game_keys):
+    """
+    Delete games with their moves, boats and board snapshots.
+
+    A games' own entities are deleted before the Game, so a task that is
+    retried part way through finds the game again and finishes it.
+
+    Args:
+      game_keys: the keys of the games.
+    """
+    for game_key in game_keys:
+        battle_archive._deleteInBatches(Move.query(Move.game_id == game_key))
+        battle_archive._deleteInBatches(Boat.query(Boat.game_id == game_key))
+        battle_archive._deleteInBatches(
+            BoardSnapshot.query(ancestor=game_key))
+
+    ndb.delete_multi(game_keys)
+
+    battle_cache._bumpVersions(*[battle_cache._gameVersion(game_key)
+                                 for game_key in game_keys])
+
+
+def _deletePairs(user_key):
+    """
+    Delete a deleted users' GamePairs, and the matchmaking entries of
+    users who were matched with them, then refresh their opponents'
+    cached responses.
+
+    Args:
+      user_key: the key of the deleted user.
+    """
+    pairs = GamePair.query(GamePair.users == user_key).fetch()
+    opponent_keys = set(each_user for each_pair in pairs
+                        for each_user in each_pair.users
+                        if each_user != user_key)
+
+    battle_archive._deleteInBatches(
+        MatchmakingEntry.query(MatchmakingEntry.opponent == user_key))
+    ndb.delete_multi([each_pair.key for each_pair in pairs])
+
+    battle_cache._bumpVersions(
+        battle_cache._userVersion(user_key),
+        battle_cache.RANKINGS_VERSION,
+        *[battle_cache._userVersion(opponent_key)
+          for opponent_key in opponent_keys])
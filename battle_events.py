@@ -0,0 +1,249 @@
+"""
+
+Holds the publish/subscribe channels used to stream game events.
+
+Every event published to a channel is given an id one higher than the
+previous event on that channel. Subscribers pass the last id they have
+seen and wait for anything newer, so a poll that finds nothing new never
+touches the datastore.
+
+"""
+
+
+import os
+import threading
+import time
+
+from collections import deque
+
+from google.appengine.api import memcache
+
+from battle_consts import EVENTS_PER_CHANNEL
+from battle_consts import EVENTS_TTL_SECONDS
+from battle_consts import EVENTS_POLL_INTERVAL
+
+
+class LocalPubSub(object):
+    """
+    In-process pub/sub. Waiters are woken as soon as an event is published,
+    but only within the same process, so this is used on the dev server and
+    in tests.
+    """
+
+    def __init__(self, max_events=EVENTS_PER_CHANNEL):
+        self._max_events = max_events
+        self._condition = threading.Condition()
+        self._channels = {}
+
+    def publish(self, channel, event):
+        """
+        Publish an event to a channel.
+
+        Args:
+          channel: the name of the channel.
+          event: a dict describing the event.
+
+        Returns:
+          The id given to the event.
+        """
+        with self._condition:
+            last_id, events = self._channels.get(
+                channel, (0, deque(maxlen=self._max_events)))
+            last_id += 1
+            events.append(dict(event, id=last_id))
+            self._channels[channel] = (last_id, events)
+            self._condition.notify_all()
+        return last_id
+
+    def fetch(self, channel, since):
+        """
+        Get the events published to a channel after an event id.
+
+        Args:
+          channel: the name of the channel.
+          since: the id of the last event the caller has seen.
+
+        Returns:
+          a tuple;
+            the id of the last event published to the channel[0]
+            a list of events newer than since, oldest first[1]
+        """
+        with self._condition:
+            last_id, events = self._channels.get(channel, (0, ()))
+            return (last_id, [e for e in events if e['id'] > since])
+
+    def wait(self, channel, since, timeout):
+        """
+        Wait until there are events newer than since, or the timeout passes.
+
+        Args:
+          channel: the name of the channel.
+          since: the id of the last event the caller has seen.
+          timeout: the maximum number of seconds to wait.
+
+        Returns:
+          The same tuple as fetch.
+        """
+        deadline = time.time() + timeout
+
+        with self._condition:
+            while True:
+                last_id, events = self.fetch(channel, since)
+                remaining = deadline - time.time()
+                if last_id != since or remaining <= 0:
+                    return (last_id, events)
+                self._condition.wait(remaining)
+
+
+class MemcachePubSub(object):
+    """
+    Memcache backed pub/sub, shared by every instance of the app. Waiters
+    poll memcache, which is far cheaper than querying the Move kind.
+    """
+
+    def _counterKey(self, channel):
+        return 'events:%s' % channel
+
+    def _eventKey(self, channel, event_id):
+        return 'events:%s:%d' % (channel, event_id)
+
+    def publish(self, channel, event):
+        """
+        Publish an event to a channel.
+
+        Args:
+          channel: the name of the channel.
+          event: a dict describing the event.
+
+        Returns:
+          The id given to the event, or None if memcache is unavailable.
+        """
+        event_id = memcache.incr(self._counterKey(channel), initial_value=0)
+        if event_id is None:
+            return None
+
+        memcache.set(self._eventKey(channel, event_id),
+                     dict(event, id=event_id),
+                     time=EVENTS_TTL_SECONDS)
+        return event_id
+
+    def fetch(self, channel, since):
+        """
+        Get the events published to a channel after an event id.
+
+        Args:
+          channel: the name of the channel.
+          since: the id of the last event the caller has seen.
+
+        Returns:
+          a tuple;
+            the id of the last event published to the channel[0]
+            a list of events newer than since, oldest first[1]
+        """
+        last_id = memcache.get(self._counterKey(channel)) or 0
+        if last_id <= since:
+            return (last_id, [])
+
+        first_id = max(since + 1, last_id - EVENTS_PER_CHANNEL + 1)
+        keys = [self._eventKey(channel, event_id)
+                for event_id in range(first_id, last_id + 1)]
+        found = memcache.get_multi(keys)
+
+        return (last_id, [found[key] for key in keys if key in found])
+
+    def wait(self, channel, since, timeout):
+        """
+        Wait until there are events newer than since, or the timeout passes.
+
+        Args:
+          channel: the name of the channel.
+          since: the id of the last event the caller has seen.
+          timeout: the maximum number of seconds to wait.
+
+        Returns:
+          The same tuple as fetch.
+        """
+        deadline = time.time() + timeout
+
+        while True:
+            last_id, events = self.fetch(channel, since)
+            if last_id != since or time.time() >= deadline:
+                return (last_id, events)
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+
+_pubsub = None
+
+
+def _getPubSub():
+    """
+    Get the pub/sub used to stream game events.
+
+    Returns:
+      A LocalPubSub on the dev server, otherwise a MemcachePubSub.
+    """
+    global _pubsub
+
+    if _pubsub is None:
+        if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+            _pubsub = LocalPubSub()
+        else:
+            _pubsub = MemcachePubSub()
+
+    return _pubsub
+
+
+def _setPubSub(pubsub):
+    """
+    Replace the pub/sub used to stream game events, ie. in tests.
+
+    Args:
+      pubsub: a LocalPubSub, MemcachePubSub or compatible object.
+    """
+    global _pubsub
+    _pubsub = pubsub
+
+
+def _publishGameEvent(game_key, event):
+    """
+    Publish an event for a game.
+
+    Args:
+      game_key: the key of the game.
+      event: a dict describing the event.
+    """
+    _getPubSub().publish(game_key.urlsafe(), event)
+
+
+def _waitForGameEvents(game_key, since, timeout):
+    """
+    Wait for events for a game that are newer than since.
+
+    Args:
+      game_key: the key of the game.
+      since: the id of the last event the caller has seen. If this is None
+        the call returns straight away with the id of the last event.
+      timeout: the maximum number of seconds to wait.
+
+    Returns:
+      a dict;
+        last_id: the id of the last event for the game
+        events: the events newer than since, oldest first
+        resync: True if events were missed and the caller should reload
+          the game history before carrying on from last_id
+    """
+    pubsub = _getPubSub()
+    channel = game_key.urlsafe()
+
+    if since is None:
+        last_id, events = pubsub.fetch(channel, 0)
+        return {'last_id': last_id, 'events': [], 'resync': False}
+
+    last_id, events = pubsub.wait(channel, since, timeout)
+
+    # Either the channel was reset (the counter went backwards) or some
+    # events expired before they were read.
+    resync = last_id < since or (
+        last_id > since and (not events or events[0]['id'] != since + 1))
+
+    return {'last_id': last_id, 'events': events, 'resync': resync}
@@ -0,0 +1,94 @@
+"""
+
+Holds all methods relating to expiring abandoned games.
+
+A game in progress with no move for BATTLESHIP_GAME_EXPIRY_DAYS days
+(set under env_variables in app.yaml) is cancelled, so it no longer
+shows up in a users' games, blocks a new game between the same users or
+gets reminder emails. Stale games are found with the (status,
+last_move_at) index and cancelled with battle_game._endGame, the same as
+cancel_game; a big backlog is worked through by tasks that carry on from
+a query cursor. Games from before last_move_at was saved only expire
+once the game backfill has set it, see battle_backfill.
+
+"""
+
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from battle_models import Game
+
+from battle_consts import EXPIRY_BATCH
+from battle_consts import GAME_EXPIRY_DAYS
+
+import battle_cache
+import battle_counters
+import battle_events
+import battle_game
+
+
+EXPIRY_DAYS = float(
+    os.environ.get('BATTLESHIP_GAME_EXPIRY_DAYS', '') or GAME_EXPIRY_DAYS)
+
+
+def _expiryThreshold():
+    """Get the time before which a game without a move has expired."""
+    return datetime.now() - timedelta(days=EXPIRY_DAYS)
+
+
+def _expireStaleGames(websafe_cursor=None):
+    """
+    Cancel a batch of expired games, and queue a task for the next batch.
+
+    Args:
+      websafe_cursor: where the last batch stopped, if any.
+
+    Returns:
+      The number of games cancelled.
+    """
+    threshold = _expiryThreshold()
+    start_cursor = None
+    if websafe_cursor:
+        start_cursor = ndb.Cursor(urlsafe=websafe_cursor)
+
+    game_keys, next_cursor, more = Game.query(
+        Game.status == 0,  # In Progress
+        Game.last_move_at < threshold).order(
+            Game.last_move_at).fetch_page(EXPIRY_BATCH,
+                                          start_cursor=start_cursor,
+                                          keys_only=True)
+
+    expired = []
+    for game_key in game_keys:
+        selected_game = battle_game._endGame(
+            game_key, 2, expired_before=threshold)  # Cancelled
+
+        # A move was made since the game was queried, or it ended.
+        if selected_game is not None:
+            expired.append(selected_game)
+
+    for each_game in expired:
+        battle_events._publishGameEvent(each_game.key, {
+            'type': 'status',
+            'game_status': each_game.status
+        })
+
+    battle_cache._bumpVersions(*[
+        version_name for each_game in expired
+        for version_name in (battle_cache._gameVersion(each_game.key),
+                             battle_cache._userVersion(each_game.user1),
+                             battle_cache._userVersion(each_game.user2))])
+
+    battle_counters._incrementCounters(games_cancelled=len(expired))
+
+    if more and next_cursor:
+        taskqueue.add(url='/tasks/expire_games',
+                      params={'cursor': next_cursor.urlsafe()})
+
+    logging.info('Cancelled %d expired games.', len(expired))
+    return len(expired)
@@ -5,21 +5,29 @@ Holds all methods relating to game actions and/or Game kind.
 """
 
 
-import endpoints
+# endpoints and the ProtoRPC messages are imported inside the methods that
+# use them, so the cron handlers can use this module without loading them.
+
+from datetime import datetime
 
 from google.appengine.ext import ndb
 
 from battle_models import Game
 from battle_models import Boat
 from battle_models import Move
+from battle_models import GamePair
 
 from battle_consts import TOTAL_HITS
 
-from battle_messages import SingleGame
-from battle_messages import SingleMoveForList
+import battle_board
+import battle_boat
+import battle_utils
+import battle_counters
 
 from battle_users import _getUserViaWebsafeKey
 
+from battle_archive import _getArchivedUsersLastMove
+
 
 def _validateAndGetGame(websafe_game_to_validate):
     """
@@ -32,11 +40,16 @@ def _validateAndGetGame(websafe_game_to_validate):
       An error is raised if the game doesn't exist.
       If the game exists then a Game object is returned.
     """
+    import endpoints
+
     try:
         selected_game = ndb.Key(urlsafe=websafe_game_to_validate).get()
     except:
         raise endpoints.BadRequestException('Game does not exist.')
 
+    if selected_game is None:
+        raise endpoints.BadRequestException('Game does not exist.')
+
     return selected_game
 
 
@@ -67,16 +80,20 @@ def _userHasWonGame(game_key, user_key):
     return False
 
 
-def _copyGameToList(game_to_copy):
+def _copyGameToList(game_to_copy, player_names=None):
     """
     Populate the outbound game message with values from game_to_copy.
 
     Args:
       game_to_copy: the game object to copy to the outbound message
+      player_names: the games' (user1 name, user2 name) tuple from
+        _getPlayerNames, or None to leave the names out
 
     Returns:
       an outbound message populated with info from game_to_copy arg
     """
+    from battle_messages import SingleGame
+
     selected_game = SingleGame()
 
     # Iterate through all fields in the game message.
@@ -90,6 +107,10 @@ def _copyGameToList(game_to_copy):
         elif field.name == "websafeKey":
             # Encode the key so it's suitable to embed in a URL.
             setattr(selected_game, field.name, game_to_copy.key.urlsafe())
+        elif field.name in ("user1_name", "user2_name"):
+            if player_names is not None:
+                setattr(selected_game, field.name,
+                        player_names[0 if field.name == "user1_name" else 1])
         elif hasattr(game_to_copy, field.name):
             setattr(selected_game, field.name,
                     getattr(game_to_copy, field.name))
@@ -101,6 +122,30 @@ def _copyGameToList(game_to_copy):
     return selected_game
 
 
+def _getMoveStatusName(move_status):
+    """
+    Get the display name of a move status.
+
+    Args:
+      move_status: the status of a Move; 0 = miss, 1 = hit, 2 = duplicate.
+
+    Returns:
+      'Miss', 'Hit' or 'Duplicate'.
+    """
+    temp_status = ''
+
+    if move_status == 0:
+        temp_status = 'Miss'
+
+    if move_status == 1:
+        temp_status = 'Hit'
+
+    if move_status == 2:
+        temp_status = 'Duplicate'
+
+    return temp_status
+
+
 def _copyMoveToList(move_to_copy):
     """
     Populate the outbound move message with values from move_to_copy.
@@ -111,6 +156,8 @@ def _copyMoveToList(move_to_copy):
     Returns:
       an outbound message populated with info from move_to_copy arg
     """
+    from battle_messages import SingleMoveForList
+
     selected_move = SingleMoveForList()
 
     # Iterate through all fields in the move message.
@@ -120,18 +167,8 @@ def _copyMoveToList(move_to_copy):
         if (field.name == "websafe_user_key_for_move"):
             setattr(selected_move, field.name, move_to_copy.user_id.urlsafe())
         if (field.name == "status"):
-            temp_status = ''
-
-            if move_to_copy.status == 0:
-                temp_status = 'Miss'
-
-            if move_to_copy.status == 1:
-                temp_status = 'Hit'
-
-            if move_to_copy.status == 2:
-                temp_status = 'Duplicate'
-
-            setattr(selected_move, field.name, temp_status)
+            setattr(selected_move, field.name,
+                    _getMoveStatusName(move_to_copy.status))
         elif hasattr(move_to_copy, field.name):
             setattr(selected_move, field.name,
                     getattr(move_to_copy, field.name))
@@ -158,6 +195,25 @@ def _getUsersLastMove(game_key, user_key):
                       Move.user_id == user_key).order(-Move.sequence).get()
 
 
+def _gameIsUnchanged(game_key, if_version):
+    """
+    Check if a game is still at the version a client last saw. Only the
+    Game is read, so this is a single key get.
+
+    Args:
+      game_key: the key of the game.
+      if_version: the version the client last saw, or None.
+
+    Returns:
+      True if if_version was given and the game hasn't changed since.
+    """
+    if if_version is None:
+        return False
+
+    selected_game = game_key.get()
+    return selected_game is not None and selected_game.version == if_version
+
+
 def _getGameLastMove(game_key):
     """
     Return the last move made in a specific game.
@@ -171,6 +227,67 @@ def _getGameLastMove(game_key):
     return Move.query(Move.game_id == game_key).order(-Move.sequence).get()
 
 
+@ndb.transactional
+def _claimTurn(game_key, user_key, opponent_key, move_row, move_col):
+    """
+    Record that a user is making a move and pass the turn to the opponent.
+
+    The games' version is bumped by _bumpGameVersion once the Move is
+    saved, not here, so a response with the new version always has it.
+
+    Args:
+      game_key: the key of the game being played.
+      user_key: the key of the user making the move.
+      opponent_key: the key of the users' opponent.
+      move_row: the row of the move.
+      move_col: the col of the move.
+
+    Returns:
+      The updated Game object if it was the users' turn.
+      None if it is not the users' turn.
+      The unchanged Game object, with status 1 or 2, if the game is no
+      longer in progress.
+    """
+    selected_game = game_key.get()
+
+    # Finished, cancelled and archived games can't be played.
+    if selected_game.status != 0:
+        return selected_game
+
+    if selected_game.next_to_move not in (None, user_key):
+        return None
+
+    selected_game.next_to_move = opponent_key
+    selected_game.last_move_at = datetime.now()
+    if selected_game.move_count is not None:
+        selected_game.move_count += 1
+
+    # Fire the shot at the opponents' board.
+    if selected_game.board1 is not None:
+        if opponent_key == selected_game.user1:
+            selected_game.board1 = battle_board._applyShot(
+                selected_game.board1, move_row, move_col)[0]
+        else:
+            selected_game.board2 = battle_board._applyShot(
+                selected_game.board2, move_row, move_col)[0]
+    selected_game.put()
+
+    return selected_game
+
+
+@ndb.transactional
+def _bumpGameVersion(game_key):
+    """
+    Bump a games' version after a move, and the boat it hit, are saved.
+
+    Args:
+      game_key: the key of the game.
+    """
+    selected_game = game_key.get()
+    selected_game.version += 1
+    selected_game.put()
+
+
 def _getGameStateForUser(game_key, selected_game, user_to_get):
     """
     Get the game state for a user for a selected game.
@@ -187,27 +304,55 @@ def _getGameStateForUser(game_key, selected_game, user_to_get):
     if user_to_get == 1:
         user_key = selected_game.user1
         websafe_user_key = selected_game.user1.urlsafe()
+        user_name = selected_game.user1_name
     else:
         user_key = selected_game.user2
         websafe_user_key = selected_game.user2.urlsafe()
+        user_name = selected_game.user2_name
 
-    # Get the last user move. The move contains the sum
-    # of hits, misses and sunk boats.
-    last_user_move = _getUsersLastMove(game_key, user_key)
+    # The users' name is on the Game, except for older games.
+    if user_name is None:
+        user_name = _getUserViaWebsafeKey(websafe_user_key).user_name
 
-    # Need to get the users' name.
-    user_profile = _getUserViaWebsafeKey(websafe_user_key)
+    # The boards are updated in the same transaction as the turn, so they
+    # are never behind the Game like a Move query can be.
+    if selected_game.board1 is not None:
+        if user_to_get == 1:
+            return _getGameStateFromBoard(user_name, selected_game.board2)
+        return _getGameStateFromBoard(user_name, selected_game.board1)
+
+    # Get the last user move. The move contains the sum
+    # of hits, misses and sunk boats. Archived games no longer
+    # have Move entities so read the move from the archive.
+    if selected_game.archive is not None:
+        last_user_move = _getArchivedUsersLastMove(selected_game, user_key)
+    else:
+        last_user_move = _getUsersLastMove(game_key, user_key)
 
     if last_user_move is None:
-        return user_profile.user_name + ' has not made any moves yet.'
+        return user_name + ' has not made any moves yet.'
 
-    return 'User ' + str(user_profile.user_name) + ' : Hits ' + str(last_user_move.hits) + ' : Miss ' + str(last_user_move.miss) + ' : Sunk ' + str(last_user_move.sunk)
+    return 'User ' + str(user_name) + ' : Hits ' + str(last_user_move.hits) + ' : Miss ' + str(last_user_move.miss) + ' : Sunk ' + str(last_user_move.sunk)
+
+
+def _pairKey(user1_key, user2_key):
+    """
+    Get the key of the GamePair for two users.
+
+    Args:
+      user1_key: the key of one of the users.
+      user2_key: the key of the other user.
+
+    Returns:
+      A GamePair key.
+    """
+    user_ids = sorted([str(user1_key.id()), str(user2_key.id())])
+    return ndb.Key(GamePair, ':'.join(user_ids))
 
 
 def _gameInProgress(user1_key, user2_key):
     """
     Determine if two users have a game in progress.
-    It doesn't really matter which games, just get a count.
 
     Args:
       user1_key: the key of one of the users in the game.
@@ -217,15 +362,123 @@ def _gameInProgress(user1_key, user2_key):
       True if there's a game in progress.
       False if there's no game in progress.
     """
-    q = Game.query(Game.user1.IN([user1_key, user2_key]),
-                   Game.user2.IN([user1_key, user2_key]),
-                   Game.status == 0  # In Progress
-                   ).count()
+    pair = _pairKey(user1_key, user2_key).get()
+
+    if pair is not None:
+        return pair.active_game is not None
+
+    # Users that haven't played since GamePair was added may still have a
+    # game in progress from before, so check the games themselves.
+    q = _legacyGameQuery(user1_key, user2_key).count(1)
     if q > 0:
         return True
     return False
 
 
+def _legacyGameQuery(user1_key, user2_key):
+    """
+    Get a query for a game in progress between two users, for users that
+    have no GamePair.
+
+    Args:
+      user1_key: the key of one of the users in the game.
+      user2_key: the key of one of the users in the game.
+
+    Returns:
+      A Game query.
+    """
+    return Game.query(Game.user1.IN([user1_key, user2_key]),
+                      Game.user2.IN([user1_key, user2_key]),
+                      Game.status == 0  # In Progress
+                      )
+
+
+@ndb.transactional_tasklet(xg=True)
+def _startGameAsync(a_new_game):
+    """
+    Save a new game if its users don't already have a game in progress.
+
+    Args:
+      a_new_game: an unsaved Game with a key, see _buildNewGame.
+
+    Returns:
+      A future for True if the game was saved.
+      False if the users already have a game in progress.
+    """
+    # Tournament games have keys reserved by the tournament, and may have
+    # been saved by an earlier try of the same task.
+    if a_new_game.tournament is not None:
+        existing_game = yield a_new_game.key.get_async()
+        if existing_game is not None:
+            raise ndb.Return(False)
+
+    pair_key = _pairKey(a_new_game.user1, a_new_game.user2)
+    pair = yield pair_key.get_async()
+
+    if pair is None:
+        users = sorted([a_new_game.user1, a_new_game.user2],
+                       key=lambda user_key: str(user_key.id()))
+        pair = GamePair(key=pair_key, users=users, wins=[0, 0])
+
+    if pair.active_game is not None:
+        raise ndb.Return(False)
+
+    pair.active_game = a_new_game.key
+    yield ndb.put_multi_async([pair, a_new_game])
+
+    raise ndb.Return(True)
+
+
+@ndb.transactional(xg=True)
+def _endGame(game_key, status, winner_key=None, expired_before=None):
+    """
+    Finish or cancel a game and free up its users to play each other again.
+
+    Args:
+      game_key: the key of the game.
+      status: 1 = Finished, 2 = Cancelled.
+      winner_key: the key of the winner if the game is finished.
+      expired_before: only end the game if its last move was before this
+        time, see battle_expiry.
+
+    Returns:
+      The updated Game object.
+      None if the game has already been finished or cancelled, or has had
+      a move since expired_before.
+    """
+    selected_game = game_key.get()
+
+    # Another request ended the game since the caller read it.
+    if selected_game is None or selected_game.status != 0:
+        return None
+
+    # A move was made since the game was found to have expired.
+    if expired_before is not None and (
+            selected_game.last_move_at is None or
+            selected_game.last_move_at >= expired_before):
+        return None
+
+    selected_game.status = status
+    selected_game.winner = winner_key
+    selected_game.version += 1
+
+    pair = _pairKey(selected_game.user1, selected_game.user2).get()
+
+    if pair is None or pair.active_game != game_key:
+        selected_game.put()
+        return selected_game
+
+    pair.active_game = None
+
+    if status == 1:
+        pair.games_played += 1
+        pair.wins[pair.users.index(winner_key)] += 1
+
+    ndb.put_multi([selected_game, pair])
+
+    return selected_game
+
+
 def _getListOfGamesForUser(user_key):
     """
     Get a list of all games that are currently in progress for a user.
@@ -234,14 +487,63 @@ def _getListOfGamesForUser(user_key):
       user_key: the user to get the games for.
 
     Returns:
-      A list of Game entities.
+      A list of Game entities. Games saved before players was added to
+      Game are only found once the game backfill has run.
     """
-    games = Game.query(ndb.AND(Game.status == 0, ndb.OR(
-        Game.user1 == user_key, Game.user2 == user_key)))
+    games = Game.query(Game.players == user_key,
+                       Game.status == 0)  # In Progress
     games = games.order(Game.user1, Game.user2)
     return games
 
 
+def _movesAreComplete(selected_game, moves):
+    """
+    Check that the moves read for a game include every move the Game has
+    counted. Move queries are eventually consistent, so a move made a
+    moment ago can be missing.
+
+    Args:
+      selected_game: the Game object.
+      moves: a list of the games' Move objects.
+
+    Returns:
+      True if no move is missing, or the game is too old to tell.
+    """
+    return (selected_game.move_count is None or
+            len(moves) >= selected_game.move_count)
+
+
+def _boatsAreComplete(selected_game, user_key, boats):
+    """
+    Check that the boats read for a user include all of their boats, and
+    every hit their board shows. Boat queries are eventually consistent,
+    so a boat hit a moment ago can still read as not hit.
+
+    Args:
+      selected_game: the Game object.
+      user_key: the key of the user the boats belong to.
+      boats: a list of the users' Boat objects.
+
+    Returns:
+      True if no boat or hit is missing.
+    """
+    if len(boats) < TOTAL_HITS:
+        return False
+
+    # Games from before boards were saved can only be checked by count.
+    if selected_game.board1 is None:
+        return True
+
+    if user_key == selected_game.user1:
+        board = selected_game.board1
+    else:
+        board = selected_game.board2
+
+    hit_codes = battle_board.BOAT_CODES.lower()
+    return (len([each_boat for each_boat in boats if each_boat.hit]) >=
+            len([cell for cell in board if cell in hit_codes]))
+
+
 def _getAllMovesForAGame(game_key):
     """
     Get a listing of all moves for a game.
@@ -255,3 +557,250 @@ def _getAllMovesForAGame(game_key):
     moves = Move.query(Move.game_id == game_key)
     moves = moves.order(Move.sequence)
     return moves
+
+
+def _getPlayerNames(games):
+    """
+    Get the names of both users of many games.
+
+    The names are copied onto games when they are created, so only the
+    users of older games are read, all with one get_multi.
+
+    Args:
+      games: a list of Game objects.
+
+    Returns:
+      A list with a (user1 name, user2 name) tuple for each game.
+    """
+    user_keys = list(set(user_key for each_game in games
+                         if each_game.user1_name is None
+                         for user_key in (each_game.user1, each_game.user2)))
+    user_names = dict((each_user.key, each_user.user_name)
+                      for each_user in ndb.get_multi(user_keys)
+                      if each_user is not None)
+
+    return [(each_game.user1_name if each_game.user1_name is not None
+             else user_names.get(each_game.user1, '<deleted user>'),
+             each_game.user2_name if each_game.user2_name is not None
+             else user_names.get(each_game.user2, '<deleted user>'))
+            for each_game in games]
+
+
+def _getGameStateFromBoard(user_name, opponent_board):
+    """
+    Get the game state for a user from the board they're shooting at.
+
+    Args:
+      user_name: the name of the user.
+      opponent_board: the board string of the users' opponent.
+
+    Returns:
+      A string in the format; <username> : Hits <x> : Miss <x> : Sunk <x>
+    """
+    hits, miss, sunk = battle_board._boardScore(opponent_board)
+
+    if hits == 0 and miss == 0:
+        return user_name + ' has not made any moves yet.'
+
+    return 'User ' + str(user_name) + ' : Hits ' + str(hits) + ' : Miss ' + str(miss) + ' : Sunk ' + str(sunk)
+
+
+def _getGamesState(games):
+    """
+    Get the game state of both users for many games at once.
+
+    The users' names are read from the games, see _getPlayerNames. Games
+    with boards are scored from the boards; older games need each users'
+    last move, and those queries are all started before any of them is
+    waited on.
+
+    Args:
+      games: a list of Game objects.
+
+    Returns:
+      A list with a list of both users' game state strings for each game,
+      see _getGameStateForUser.
+    """
+    player_names = _getPlayerNames(games)
+
+    # Start the last move queries for games without boards.
+    last_moves = {}
+    for each_game in games:
+        if each_game.board1 is not None or each_game.archive is not None:
+            continue
+        for user_key in (each_game.user1, each_game.user2):
+            last_moves[(each_game.key, user_key)] = Move.query(
+                Move.game_id == each_game.key,
+                Move.user_id == user_key).order(-Move.sequence).get_async()
+
+    all_states = []
+    for each_game, names in zip(games, player_names):
+        game_states = []
+        for user_key, user_name, opponent_board in (
+                (each_game.user1, names[0], each_game.board2),
+                (each_game.user2, names[1], each_game.board1)):
+
+            if each_game.board1 is not None:
+                game_states.append(_getGameStateFromBoard(user_name,
+                                                          opponent_board))
+                continue
+
+            if each_game.archive is not None:
+                last_user_move = _getArchivedUsersLastMove(each_game, user_key)
+            else:
+                last_user_move = last_moves[(each_game.key,
+                                             user_key)].get_result()
+
+            if last_user_move is None:
+                game_states.append(user_name + ' has not made any moves yet.')
+            else:
+                game_states.append('User ' + str(user_name) + ' : Hits ' + str(last_user_move.hits) + ' : Miss ' + str(last_user_move.miss) + ' : Sunk ' + str(last_user_move.sunk))
+
+        all_states.append(game_states)
+
+    return all_states
+
+
+def _buildNewGame(game_key, user1, user2, tournament_key=None):
+    """
+    Build a new game and both users' boats, without saving them.
+
+    Args:
+      game_key: the key reserved for the game, see Game.allocate_ids.
+      user1: the User object of the first user.
+      user2: the User object of the second user.
+      tournament_key: the key of the tournament the game is part of, if any.
+
+    Returns:
+      A tuple with the unsaved Game[0] and a list of its unsaved Boats[1].
+    """
+    user1_key = user1.key
+    user2_key = user2.key
+
+    # Auto-generate all boats on user 1's board.
+    user1_boats = battle_boat._generateBoats(game_key, user1_key)
+
+    # Auto-generate all boats on user 2's board.
+    user2_boats = battle_boat._generateBoats(game_key, user2_key)
+
+    a_new_game = Game(
+        key=game_key,
+        user1=user1_key,
+        user2=user2_key,
+        user1_name=user1.user_name,
+        user2_name=user2.user_name,
+        user1_has_email=bool(user1.email),
+        user2_has_email=bool(user2.email),
+        status=0,  # In Progress
+        move_count=0,
+        last_move_at=datetime.now(),  # so a game with no moves expires
+        board1=battle_board._boardFromBoats(user1_boats),
+        board2=battle_board._boardFromBoats(user2_boats),
+        tournament=tournament_key
+    )
+
+    return (a_new_game, user1_boats + user2_boats)
+
+
+def _newGameKeys(number_of_games):
+    """
+    Reserve keys for new games.
+
+    Args:
+      number_of_games: the number of keys to reserve.
+
+    Returns:
+      A list of Game keys.
+    """
+    first_id, last_id = Game.allocate_ids(number_of_games)
+    return [ndb.Key(Game, game_id) for game_id in range(first_id, last_id + 1)]
+
+
+def _createGames(user_pairs, tournament_key=None, game_keys=None):
+    """
+    Create games for many pairs of users with batched writes.
+
+    All boats are generated in memory and saved in large batches, then the
+    games are started concurrently. A pair that already has a game in
+    progress is skipped and its boats are removed, as is a pair with a
+    user that no longer exists. A game whose key was reserved and is
+    already saved is left as it is, so a retried task doesn't create it
+    twice.
+
+    Args:
+      user_pairs: a list of (user key, user key) tuples.
+      tournament_key: the key of the tournament the games are part of.
+      game_keys: the keys reserved for the games, one per pair, or None to
+        reserve new keys.
+
+    Returns:
+      A list with the game key for each pair, including games saved by an
+      earlier try, or None where the pair was skipped.
+    """
+    if not user_pairs:
+        return []
+
+    new_games = []
+    new_boats = []
+
+    if game_keys is not None:
+        existing_games = ndb.get_multi(game_keys)
+    else:
+        game_keys = _newGameKeys(len(user_pairs))
+        existing_games = [None] * len(user_pairs)
+
+    # Pairs without a GamePair may have a game in progress from before
+    # GamePair was added, which _startGameAsync can't see.
+    pairs = ndb.get_multi([_pairKey(user1_key, user2_key)
+                           for user1_key, user2_key in user_pairs])
+    legacy_counts = [_legacyGameQuery(user1_key, user2_key).count_async(1)
+                     if pair is None else None
+                     for pair, (user1_key, user2_key) in zip(pairs, user_pairs)]
+
+    # Read every user once, for the names copied onto the games.
+    user_keys = list(set(user_key for each_pair in user_pairs
+                         for user_key in each_pair))
+    users = dict(zip(user_keys, ndb.get_multi(user_keys)))
+
+    for game_key, existing_game, legacy_count, (user1_key, user2_key) in zip(
+            game_keys, existing_games, legacy_counts, user_pairs):
+        if (existing_game is not None or
+                users[user1_key] is None or users[user2_key] is None or
+                (legacy_count is not None and legacy_count.get_result() > 0)):
+            new_games.append(None)
+            new_boats.append([])
+            continue
+
+        a_new_game, boats = _buildNewGame(game_key, users[user1_key],
+                                          users[user2_key], tournament_key)
+        new_games.append(a_new_game)
+        new_boats.append(boats)
+
+    # Save the boats before the games, so a game is never seen without
+    # its boats.
+    battle_utils._putInBatches([each_boat for fleet in new_boats
+                                for each_boat in fleet])
+
+    futures = [_startGameAsync(each_game) if each_game is not None else None
+               for each_game in new_games]
+
+    started_keys = []
+    unused_boats = []
+    games_started = 0
+    for future, game_key, fleet, existing_game in zip(
+            futures, game_keys, new_boats, existing_games):
+        if existing_game is not None:
+            started_keys.append(game_key)
+        elif future is not None and future.get_result():
+            started_keys.append(game_key)
+            games_started += 1
+        else:
+            started_keys.append(None)
+            unused_boats.extend(fleet)
+
+    if unused_boats:
+        ndb.delete_multi([each_boat.key for each_boat in unused_boats])
+
+    battle_counters._incrementCounters(games_started=games_started)
+
+    return started_keys
@@ -0,0 +1,142 @@
+"""
+
+Holds all methods relating to shot hints.
+
+A hint is the probability that each cell of the opponents' board holds
+part of a boat, given what the user has seen so far; their misses, hits
+and sunk boats. It is estimated by sampling thousands of fleets at once:
+each boat that isn't sunk yet is placed at random from every placement
+that avoids the misses and sunk boats, fleets with overlapping boats or
+that don't explain every hit are thrown away, and the rest are counted.
+
+"""
+
+
+# numpy is imported inside the methods that use it so the API doesn't
+# load it on every new instance.
+
+import battle_board
+import battle_consts
+
+from battle_consts import HINT_MAX_ROUNDS
+from battle_consts import HINT_MIN_ACCEPTED
+from battle_consts import HINT_SAMPLES
+
+
+# Every placement of a boat on an empty board, by boat length. Built the
+# first time each length is needed.
+_placements = {}
+
+
+def _getPlacements(boat_hits):
+    """
+    Get every placement of a boat on an empty board.
+
+    Args:
+      boat_hits: the length of the boat.
+
+    Returns:
+      A numpy bool array with a row of 100 cells for each placement.
+    """
+    import numpy
+
+    if boat_hits not in _placements:
+        rows = len(battle_consts.VALID_ROWS)
+        cols = len(battle_consts.VALID_COLS)
+        masks = []
+
+        for row in range(rows):
+            for col in range(cols - boat_hits + 1):
+                mask = numpy.zeros(battle_board.BOARD_SIZE, dtype=bool)
+                start = row * cols + col
+                mask[start:start + boat_hits] = True  # horizontal
+                masks.append(mask)
+
+        for row in range(rows - boat_hits + 1):
+            for col in range(cols):
+                mask = numpy.zeros(battle_board.BOARD_SIZE, dtype=bool)
+                start = row * cols + col
+                mask[start:start + boat_hits * cols:cols] = True  # vertical
+                masks.append(mask)
+
+        _placements[boat_hits] = numpy.array(masks)
+
+    return _placements[boat_hits]
+
+
+def _getShotProbabilities(opponent_board):
+    """
+    Estimate where the opponents' boats that aren't sunk yet are.
+
+    Args:
+      opponent_board: the board string the user is shooting at. Only what
+        the user can see of it is used, see battle_board._targetView.
+
+    Returns:
+      a tuple;
+        a list of 100 probabilities, row A first; 0 for cells that have
+          already been shot[0]
+        the number of fleets the probabilities are based on[1]
+    """
+    import numpy
+
+    cells = numpy.array(list(battle_board._targetView(opponent_board)))
+    blocked = ((cells == battle_board.MISS) |
+               (cells == battle_board.TARGET_SUNK))
+    hits = cells == battle_board.TARGET_HIT
+    unshot = cells == battle_board.WATER
+    hit_count = hits.sum()
+
+    # The user is told when a boat is sunk, so only the others are placed.
+    # The longest boats go first as they have the fewest placements.
+    sunk = battle_board._sunkBoatTypes(opponent_board)
+    boat_lengths = sorted((battle_board.BOAT_HITS[boat_type]
+                           for boat_type in range(len(battle_board.BOAT_CODES))
+                           if boat_type not in sunk), reverse=True)
+
+    placements = []
+    for boat_hits in boat_lengths:
+        masks = _getPlacements(boat_hits)
+        placements.append(masks[~(masks & blocked).any(axis=1)])
+
+    totals = numpy.zeros(battle_board.BOARD_SIZE)
+    accepted_count = 0
+
+    # Fleets that miss some hits are kept apart, weighted by the hits they
+    # explain, in case no sampled fleet explains them all.
+    partial_totals = numpy.zeros(battle_board.BOARD_SIZE)
+    partial_weight = 0
+
+    if boat_lengths and all(len(masks) for masks in placements):
+        random = numpy.random.RandomState()
+
+        for each_round in range(HINT_MAX_ROUNDS):
+            occupied = numpy.zeros((HINT_SAMPLES, battle_board.BOARD_SIZE),
+                                   dtype=bool)
+            valid = numpy.ones(HINT_SAMPLES, dtype=bool)
+
+            for masks in placements:
+                picks = masks[random.randint(0, len(masks), HINT_SAMPLES)]
+                valid &= ~(occupied & picks).any(axis=1)
+                occupied |= picks
+
+            covered = occupied[:, hits].sum(axis=1)
+            accepted = valid & (covered == hit_count)
+            totals += occupied[accepted].sum(axis=0)
+            accepted_count += int(accepted.sum())
+
+            weights = numpy.where(valid, covered, 0)
+            partial_totals += (occupied * weights[:, numpy.newaxis]).sum(axis=0)
+            partial_weight += int(weights.sum())
+
+            if accepted_count >= HINT_MIN_ACCEPTED:
+                break
+
+    if accepted_count:
+        probabilities = totals / accepted_count
+    elif partial_weight:
+        probabilities = partial_totals / partial_weight
+    else:
+        probabilities = unshot / float(max(unshot.sum(), 1))
+
+    return (numpy.where(unshot, probabilities, 0.0).tolist(), accepted_count)
@@ -0,0 +1,169 @@
+"""
+
+Holds all methods relating to pairing waiting users for new games.
+
+Users join the queue through the API. A cron job pairs waiting users in
+batches, creates all of their games with batched writes and records the
+new game on each users' entry so they can find it with a single key get.
+
+"""
+
+
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from battle_models import MatchmakingEntry
+
+from battle_consts import MATCHMAKING_BATCH
+
+import battle_cache
+import battle_game
+import battle_utils
+
+
+def _entryKey(user_key):
+    """
+    Get the key of a users' matchmaking entry.
+
+    Args:
+      user_key: the key of the user.
+
+    Returns:
+      A MatchmakingEntry key.
+    """
+    return ndb.Key(MatchmakingEntry, user_key.id())
+
+
+def _joinQueue(user_key):
+    """
+    Add a user to the matchmaking queue.
+
+    Args:
+      user_key: the key of the user.
+
+    Returns:
+      True if the user was added.
+      False if the user is already waiting.
+    """
+    entry = _entryKey(user_key).get()
+
+    if entry is not None and entry.status == 0:
+        return False
+
+    MatchmakingEntry(key=_entryKey(user_key),
+                     user=user_key,
+                     status=0,  # Waiting
+                     enqueued_at=datetime.now()).put()
+    return True
+
+
+def _getEntry(user_key):
+    """
+    Get a users' matchmaking entry.
+
+    Args:
+      user_key: the key of the user.
+
+    Returns:
+      A MatchmakingEntry, or None if the user never joined the queue.
+    """
+    return _entryKey(user_key).get()
+
+
+def _pairEntries(entries):
+    """
+    Pair waiting users, oldest first, skipping pairs that already have a
+    game in progress.
+
+    Each round proposes pairs for every user it can and reads all of their
+    GamePairs with one get_multi. Users in a pair with an active game go
+    back into the queue and are paired again, with anyone but each other,
+    in the next round.
+
+    Args:
+      entries: MatchmakingEntry objects ordered by enqueued_at.
+
+    Returns:
+      A list of (entry, entry) tuples.
+    """
+    pairs = []
+    busy_pairs = set()
+    unpaired = list(entries)
+
+    while len(unpaired) > 1:
+        proposed = []
+        left_over = []
+        waiting = list(unpaired)
+
+        while waiting:
+            first = waiting.pop(0)
+
+            for position, second in enumerate(waiting):
+                pair_key = battle_game._pairKey(first.user, second.user)
+                if pair_key not in busy_pairs:
+                    proposed.append((pair_key, first, waiting.pop(position)))
+                    break
+            else:
+                left_over.append(first)
+
+        if not proposed:
+            break
+
+        game_pairs = ndb.get_multi([proposal[0] for proposal in proposed])
+
+        rejected = []
+        for (pair_key, first, second), pair in zip(proposed, game_pairs):
+            if pair is not None and pair.active_game is not None:
+                busy_pairs.add(pair_key)
+                rejected.extend([first, second])
+            else:
+                pairs.append((first, second))
+
+        if not rejected:
+            break
+
+        unpaired = [each_entry for each_entry in unpaired
+                    if each_entry in rejected or each_entry in left_over]
+
+    return pairs
+
+
+def _pairWaitingUsers():
+    """
+    Pair a batch of waiting users and create their games.
+
+    Returns:
+      The number of games created.
+    """
+    waiting = MatchmakingEntry.query(
+        MatchmakingEntry.status == 0  # Waiting
+    ).order(MatchmakingEntry.enqueued_at).fetch(MATCHMAKING_BATCH)
+
+    pairs = _pairEntries(waiting)
+    if not pairs:
+        return 0
+
+    game_keys = battle_game._createGames(
+        [(first.user, second.user) for first, second in pairs])
+
+    matched_entries = []
+    for game_key, (first, second) in zip(game_keys, pairs):
+        # The pair started a game since _pairEntries checked it, leave
+        # them waiting.
+        if game_key is None:
+            continue
+
+        first.status = second.status = 1  # Matched
+        first.game = second.game = game_key
+        first.opponent = second.user
+        second.opponent = first.user
+        matched_entries.extend([first, second])
+
+    # Save the entries last so users are only told about games that exist.
+    battle_utils._putInBatches(matched_entries)
+
+    battle_cache._bumpVersions(*[battle_cache._userVersion(each_entry.user)
+                                 for each_entry in matched_entries])
+
+    return len(matched_entries) // 2
@@ -65,6 +65,43 @@ class GetSingleUserScore(messages.Message):
     a_user_id = messages.StringField(1)
 
 
+class GetBoardAt(messages.Message):
+    """Inbound request for both boards of a game after a number of moves."""
+    a_game_id = messages.StringField(1)
+
+
+class GetBoardView(messages.Message):
+    """Inbound request for a users' view of both boards in a game."""
+    a_game_id = messages.StringField(1)
+    a_user_id = messages.StringField(2)
+
+
+class Matchmaking(messages.Message):
+    """Inbound request to join or check the matchmaking queue."""
+    a_user_id = messages.StringField(1)
+
+
+class NewTournament(messages.Message):
+    """Inbound request for a new round robin tournament."""
+    a_name = messages.StringField(1)
+
+
+class GetTournamentStandings(messages.Message):
+    """Inbound request for the standings of a tournament."""
+    a_tournament_id = messages.StringField(1)
+
+
+class GetGamesState(messages.Message):
+    """Inbound request for the current state of many games."""
+    a_game_ids = messages.StringField(1, repeated=True)
+
+
+class GetShotHint(messages.Message):
+    """Inbound request for a suggested next shot."""
+    a_game_id = messages.StringField(1)
+    a_user_id = messages.StringField(2)
+
+
 #   Outbound Response ---------------------------------------------------------
 
 
@@ -79,6 +116,8 @@ class SingleGame(messages.Message):
     user2 = messages.StringField(2)
     status = messages.IntegerField(3, variant=messages.Variant.INT32)
     websafeKey = messages.StringField(4)
+    user1_name = messages.StringField(5)
+    user2_name = messages.StringField(6)
 
 
 class ListOfGames(messages.Message):
@@ -97,11 +136,30 @@ class SingleMoveForList(messages.Message):
 class ListOfMoves(messages.Message):
     """Outbound message to return a list of moves."""
     all_moves = messages.MessageField(SingleMoveForList, 1, repeated=True)
+    version = messages.IntegerField(2)
+    not_modified = messages.BooleanField(3)
+
+
+class CompactMoves(messages.Message):
+    """
+    Outbound message to return a list of moves in two bytes per move.
+
+    moves is base64 in JSON; see battle_board._packMoves for the format.
+    Player index 0 is websafe_user1_key and 1 is websafe_user2_key.
+    """
+    websafe_user1_key = messages.StringField(1)
+    websafe_user2_key = messages.StringField(2)
+    moves = messages.BytesField(3)
+    move_count = messages.IntegerField(4)
+    version = messages.IntegerField(5)
+    not_modified = messages.BooleanField(6)
 
 
 class ReturnGameState(messages.Message):
     """Outbound response to return the state of a game for a user."""
     user_states = messages.MessageField(StringMessage, 1, repeated=True)
+    version = messages.IntegerField(2)
+    not_modified = messages.BooleanField(3)
 
 
 class SingleBoatForList(messages.Message):
@@ -114,8 +172,97 @@ class SingleBoatForList(messages.Message):
 class ListOfBoats(messages.Message)	:
     """Outbound message to return a list of boats."""
     all_boats = messages.MessageField(SingleBoatForList, 1, repeated=True)
+    version = messages.IntegerField(2)
+    not_modified = messages.BooleanField(3)
 
 
 class ListOfRankings(messages.Message):
     """Outbound message to return a list of user rankings."""
     rankings = messages.MessageField(StringMessage, 1, repeated=True)
+
+
+class BoardAtMove(messages.Message):
+    """Outbound message to return both boards of a game after a move."""
+    move_index = messages.IntegerField(1)
+    total_moves = messages.IntegerField(2)
+    user1 = messages.StringField(3)
+    user2 = messages.StringField(4)
+    board1 = messages.StringField(5)
+    board2 = messages.StringField(6)
+
+
+class BoardView(messages.Message):
+    """Outbound message to return a users' view of both boards."""
+    own_board = messages.StringField(1)
+    target_board = messages.StringField(2)
+    user_states = messages.MessageField(StringMessage, 3, repeated=True)
+    status = messages.IntegerField(4, variant=messages.Variant.INT32)
+    next_to_move = messages.StringField(5)
+
+
+class MatchmakingStatus(messages.Message):
+    """Outbound message to return a users' place in matchmaking."""
+    status = messages.StringField(1)
+    websafe_game_key = messages.StringField(2)
+    websafe_opponent_key = messages.StringField(3)
+
+
+class TournamentStandings(messages.Message):
+    """Outbound message to return the standings of a tournament."""
+    standings = messages.MessageField(StringMessage, 1, repeated=True)
+    games_finished = messages.IntegerField(2)
+    games_total = messages.IntegerField(3)
+    games_skipped = messages.IntegerField(4)
+
+
+class SingleGameState(messages.Message):
+    """Outbound message to return the state of one of many games."""
+    websafe_game_key = messages.StringField(1)
+    status = messages.IntegerField(2, variant=messages.Variant.INT32)
+    user_states = messages.MessageField(StringMessage, 3, repeated=True)
+
+
+class ListOfGameStates(messages.Message):
+    """Outbound message to return the state of many games."""
+    games = messages.MessageField(SingleGameState, 1, repeated=True)
+
+
+class Heatmap(messages.Message):
+    """Outbound message to return a value for each cell, row A first."""
+    name = messages.StringField(1)
+    cells = messages.FloatField(2, repeated=True)
+
+
+class BoatSinkStats(messages.Message):
+    """Outbound message to return how many shots it takes to sink a boat."""
+    boat_type = messages.StringField(1)
+    boats_sunk = messages.IntegerField(2)
+    average_shots = messages.FloatField(3)
+
+
+class ShotAnalyticsReport(messages.Message):
+    """Outbound message to return the shot analytics."""
+    heatmaps = messages.MessageField(Heatmap, 1, repeated=True)
+    sink_stats = messages.MessageField(BoatSinkStats, 2, repeated=True)
+    games = messages.IntegerField(3)
+    moves = messages.IntegerField(4)
+    updated = messages.StringField(5)
+
+
+class GlobalStats(messages.Message):
+    """Outbound message to return global statistics for every game."""
+    games_played = messages.IntegerField(1)
+    games_in_progress = messages.IntegerField(2)
+    games_cancelled = messages.IntegerField(3)
+    shots = messages.IntegerField(4)
+    hits = messages.IntegerField(5)
+    hit_ratio = messages.FloatField(6)
+
+
+class ShotHint(messages.Message):
+    """Outbound message to return a suggested next shot."""
+    probabilities = messages.FloatField(1, repeated=True)
+    row = messages.StringField(2)
+    col = messages.IntegerField(3)
+    samples = messages.IntegerField(4)
+    move_count = messages.IntegerField(5)
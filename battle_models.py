@@ -5,12 +5,6 @@ Helper module to hold Datastore models.
 """
 
 
-import endpoints
-
-from protorpc import messages
-from protorpc import message_types
-from protorpc import remote
-
 from google.appengine.ext import ndb
 
 
@@ -25,10 +19,52 @@ class Game(ndb.Model):
     user1 = ndb.KeyProperty(kind='User', required=True)
     user2 = ndb.KeyProperty(kind='User', required=True)
 
+    # Both users, so a users' games can be found with a single
+    # equality filter instead of an OR over user1 and user2.
+    players = ndb.KeyProperty(kind='User', repeated=True)
+
+    # Copied from the users when the game is created, so listing games
+    # doesn't need to read the users. None for games created before they
+    # were copied; see battle_game._getPlayerNames.
+    user1_name = ndb.StringProperty(indexed=False)
+    user2_name = ndb.StringProperty(indexed=False)
+    user1_has_email = ndb.BooleanProperty(indexed=False)
+    user2_has_email = ndb.BooleanProperty(indexed=False)
+
     # 0 = In Progress, 1 = Finished, 2 = Cancelled
     status = ndb.IntegerProperty(required=True)
     winner = ndb.KeyProperty(kind='User')
 
+    # The user whose turn it is (None until the first move) and the time
+    # of the last move. Both are updated with every move.
+    next_to_move = ndb.KeyProperty(kind='User')
+    last_move_at = ndb.DateTimeProperty()
+
+    # Number of moves made in the game, including duplicate moves.
+    # None for games created before moves were counted.
+    move_count = ndb.IntegerProperty()
+
+    # The current board of each user, see battle_board. Updated with every
+    # move. None for games created before boards were stored on the Game.
+    board1 = ndb.StringProperty(indexed=False)
+    board2 = ndb.StringProperty(indexed=False)
+
+    # The tournament the game is part of, if any.
+    tournament = ndb.KeyProperty(kind='Tournament')
+
+    # Bumped whenever a move is made or the game ends, so clients can ask
+    # the read endpoints for a response only if the game has changed.
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    # Completed games have their moves and boats folded into a compressed
+    # archive. Once archived = True the Move and Boat entities are deleted.
+    archived = ndb.BooleanProperty(default=False)
+    archive = ndb.BlobProperty(compressed=True)
+
+    def _pre_put_hook(self):
+        """Keep the players list in step with user1 and user2."""
+        self.players = [self.user1, self.user2]
+
 
 class Move(ndb.Model):
     """A move made by a user."""
@@ -50,6 +86,21 @@ class MoveSequence(ndb.Model):
     current_sequence = ndb.IntegerProperty(required=True)
 
 
+class BoardSnapshot(ndb.Model):
+    """
+    Both boards of a game after a number of moves. The parent is the Game
+    and the id is the move index as a string.
+    """
+    move_index = ndb.IntegerProperty(required=True)
+
+    # The sequence of the last move included, 0 if there are no moves.
+    sequence = ndb.IntegerProperty(required=True)
+
+    # Board strings, see battle_board.
+    board1 = ndb.StringProperty(required=True, indexed=False)
+    board2 = ndb.StringProperty(required=True, indexed=False)
+
+
 class Boat(ndb.Model):
     """A boat on a users board."""
     game_id = ndb.KeyProperty(kind='Game', required=True)
@@ -60,3 +111,100 @@ class Boat(ndb.Model):
     row = ndb.StringProperty(required=True)
     col = ndb.IntegerProperty(required=True)
     hit = ndb.BooleanProperty()
+
+
+class ProfileReport(ndb.Model):
+    """The cProfile stats and allocations for one profiled API call."""
+    method_name = ndb.StringProperty(required=True)
+    trigger = ndb.StringProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    duration_ms = ndb.FloatProperty()
+
+    # Marshalled pstats data; load it with pstats.Stats(<file>).
+    stats = ndb.BlobProperty(compressed=True)
+    summary = ndb.TextProperty()
+    allocations = ndb.TextProperty()
+
+
+class MatchmakingEntry(ndb.Model):
+    """A user waiting to be paired for a game. The id is the users' id."""
+    user = ndb.KeyProperty(kind='User', required=True)
+
+    # 0 = Waiting, 1 = Matched
+    status = ndb.IntegerProperty(required=True)
+    enqueued_at = ndb.DateTimeProperty(required=True)
+    game = ndb.KeyProperty(kind='Game')
+    opponent = ndb.KeyProperty(kind='User')
+
+
+class GamePair(ndb.Model):
+    """
+    Two users that have played each other. The id is both user ids in
+    sorted order, so the pair can be read with a single key get.
+    """
+    users = ndb.KeyProperty(kind='User', repeated=True)
+
+    # The game in progress between the users, if any.
+    active_game = ndb.KeyProperty(kind='Game')
+
+    # Head to head totals for finished games. wins is in the same order
+    # as users.
+    games_played = ndb.IntegerProperty(default=0)
+    wins = ndb.IntegerProperty(repeated=True)
+
+
+class Tournament(ndb.Model):
+    """A round robin tournament; every player plays every other player."""
+    name = ndb.StringProperty()
+    players = ndb.KeyProperty(kind='User', repeated=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    # Number of games the tournament should have, one per pair of players.
+    total_games = ndb.IntegerProperty(required=True)
+
+    # The first of the Game ids reserved for the tournament, one per
+    # pairing in _getPairings order. None for tournaments created before
+    # ids were reserved.
+    first_game_id = ndb.IntegerProperty(indexed=False)
+
+    # GamePair ids of the pairs whose game wasn't created because they
+    # started another game after the tournament was validated.
+    skipped_pairs = ndb.StringProperty(repeated=True)
+
+
+class CounterShard(ndb.Model):
+    """
+    One shard of a global statistics counter, see battle_counters. The id
+    is '<counter name>:<shard index>', or '<counter name>:seed' for the
+    shard set by the one-off counter seed.
+    """
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ShotAnalytics(ndb.Model):
+    """
+    Shot analytics aggregated over every move of every game. The id
+    'latest' holds the last finished run; 'working' holds the run in
+    progress and where it is up to.
+    """
+    # int32 cell counts, ANALYTICS_LAYERS x 100 cells, see battle_analytics.
+    counts = ndb.BlobProperty()
+
+    # Shots it took to sink each boat type, summed, and the boats sunk.
+    # Both are indexed by boat type.
+    sink_shots = ndb.IntegerProperty(repeated=True, indexed=False)
+    sink_count = ndb.IntegerProperty(repeated=True, indexed=False)
+
+    games = ndb.IntegerProperty(default=0, indexed=False)
+    moves = ndb.IntegerProperty(default=0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    # Progress of the working run. phase 0 reads archived games and phase
+    # 1 reads the Move kind, each from cursor. open_game is the tally of
+    # the game the cursor is part way through. step guards against two
+    # tasks running the same step.
+    phase = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    open_game = ndb.TextProperty()
+    step = ndb.IntegerProperty(default=0, indexed=False)
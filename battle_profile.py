@@ -0,0 +1,201 @@
+"""
+
+Holds the on-demand profiling hook for the BattleshipApi methods.
+
+A call is profiled when it sends the X-Battleship-Profile header with the
+token in the BATTLESHIP_PROFILE_TOKEN environment variable, or when it is
+picked by the BATTLESHIP_PROFILE_SAMPLE_RATE sampling rate (0 to 1). Both
+are set under env_variables in app.yaml. When neither is set, a call only
+pays for two falsy checks.
+
+"""
+
+
+import cProfile
+import functools
+import gc
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+
+from StringIO import StringIO
+
+from battle_models import ProfileReport
+
+from battle_consts import PROFILE_HEADER
+from battle_consts import PROFILE_TOP_N
+
+try:
+    import tracemalloc
+except ImportError:
+    # Not available on Python 2.7; object counts from gc are used instead.
+    tracemalloc = None
+
+
+PROFILE_TOKEN = os.environ.get('BATTLESHIP_PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(
+    os.environ.get('BATTLESHIP_PROFILE_SAMPLE_RATE', '0') or 0)
+
+
+def _profileTrigger(service):
+    """
+    Determine if a call should be profiled.
+
+    Args:
+      service: the BattleshipApi instance handling the call.
+
+    Returns:
+      'sample' or 'header' if the call should be profiled, otherwise None.
+    """
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+
+    if PROFILE_TOKEN:
+        headers = service.request_state.headers
+        if headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+            return 'header'
+
+    return None
+
+
+def _countObjects():
+    """
+    Count live objects by type.
+
+    Returns:
+      A dict of type name to number of live objects.
+    """
+    counts = {}
+    for each_object in gc.get_objects():
+        type_name = type(each_object).__name__
+        counts[type_name] = counts.get(type_name, 0) + 1
+    return counts
+
+
+def _allocationReport(before, after):
+    """
+    Describe the allocations made between two snapshots.
+
+    Args:
+      before: a tracemalloc snapshot, or the result of _countObjects.
+      after: a tracemalloc snapshot, or the result of _countObjects.
+
+    Returns:
+      A string listing the biggest allocations, one per line.
+    """
+    if tracemalloc is not None:
+        differences = after.compare_to(before, 'lineno')[:PROFILE_TOP_N]
+        return '\n'.join(str(each_difference)
+                         for each_difference in differences)
+
+    differences = [(after[type_name] - before.get(type_name, 0), type_name)
+                   for type_name in after]
+    differences = sorted((d for d in differences if d[0] > 0), reverse=True)
+    return '\n'.join('%s: +%d objects' % (type_name, count)
+                     for count, type_name in differences[:PROFILE_TOP_N])
+
+
+def _runProfiled(method, service, request, trigger):
+    """
+    Run an API method under cProfile and save a ProfileReport.
+
+    Args:
+      method: the undecorated API method.
+      service: the BattleshipApi instance handling the call.
+      request: the request message.
+      trigger: 'sample' or 'header'.
+
+    Returns:
+      The response from the API method.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    else:
+        before = _countObjects()
+
+    profiler = cProfile.Profile()
+    start_time = time.time()
+    try:
+        return profiler.runcall(method, service, request)
+    finally:
+        duration_ms = (time.time() - start_time) * 1000
+
+        if tracemalloc is not None:
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        else:
+            after = _countObjects()
+
+        try:
+            _saveReport(method.__name__, trigger, duration_ms, profiler,
+                        _allocationReport(before, after))
+        except Exception:
+            # Never fail the call because the report couldn't be saved.
+            logging.exception('Could not save profile for %s',
+                              method.__name__)
+
+
+def _saveReport(method_name, trigger, duration_ms, profiler, allocations):
+    """
+    Save a ProfileReport for a profiled call.
+
+    Args:
+      method_name: the name of the API method.
+      trigger: 'sample' or 'header'.
+      duration_ms: how long the call took.
+      profiler: the cProfile.Profile that ran the call.
+      allocations: the allocation report for the call.
+    """
+    profiler.create_stats()
+
+    summary = StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats(
+        'cumulative').print_stats(PROFILE_TOP_N)
+
+    ProfileReport(
+        method_name=method_name,
+        trigger=trigger,
+        duration_ms=duration_ms,
+        stats=marshal.dumps(profiler.stats),
+        summary=summary.getvalue(),
+        allocations=allocations
+    ).put()
+
+    logging.info('Profiled %s (%s) in %.1f ms', method_name, trigger,
+                 duration_ms)
+
+
+def profiled(method):
+    """
+    Decorator that lets calls to an API method be profiled on demand.
+    Apply it below @endpoints.method.
+
+    Args:
+      method: the API method.
+
+    Returns:
+      The wrapped API method.
+    """
+    @functools.wraps(method)
+    def wrapper(service, request):
+        trigger = _profileTrigger(service)
+        if trigger is None:
+            return method(service, request)
+        return _runProfiled(method, service, request, trigger)
+
+    return wrapper
+
+
+def _getRecentReports():
+    """
+    Get the most recent profile reports.
+
+    Returns:
+      A list of ProfileReport entities, newest first.
+    """
+    return ProfileReport.query().order(-ProfileReport.created).fetch(
+        PROFILE_TOP_N)
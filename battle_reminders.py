@@ -0,0 +1,89 @@
+"""
+
+Holds all methods relating to reminding users of games in progress.
+
+"""
+
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.ext import ndb
+
+from battle_models import Game
+from battle_models import User
+
+from battle_consts import REMINDER_BATCH
+
+
+def _sendEmailReminders():
+    """
+    Send email to remind a user of games in progress.
+    """
+    sender = 'noreply@%s.appspotmail.com' % (
+        app_identity.get_application_id())
+
+    # Only users with an email can be reminded, go through them a batch
+    # at a time.
+    query = User.query(User.email > '')
+    cursor = None
+
+    while True:
+        users, cursor, more = query.fetch_page(REMINDER_BATCH,
+                                               start_cursor=cursor)
+        _remindUsers(users, sender)
+
+        if not more:
+            break
+
+
+def _remindUsers(users, sender):
+    """
+    Email each user about the games in progress waiting for their move.
+
+    The games are found with the (status, next_to_move) index, so games
+    where the user made the last move are never read. Legacy games get
+    next_to_move from the game backfill, see battle_backfill. The
+    opponents' names are copied onto the Game, so only the opponents of
+    older games are read, with one get_multi.
+
+    Args:
+      users: a list of User objects with an email.
+      sender: the address to send from.
+    """
+    futures = [Game.query(Game.status == 0,  # In Progress
+                          Game.next_to_move == each_user.key).fetch_async()
+               for each_user in users]
+
+    reminders = []
+    for each_user, future in zip(users, futures):
+        for each_game in future.get_result():
+            # Grab the opponent, they made the last move.
+            if each_game.user1 == each_user.key:
+                opponent_key = each_game.user2
+                opponent_name = each_game.user2_name
+            else:
+                opponent_key = each_game.user1
+                opponent_name = each_game.user1_name
+
+            reminders.append((each_user, opponent_key, opponent_name))
+
+    opponent_keys = list(set(opponent_key
+                             for each_user, opponent_key, opponent_name
+                             in reminders if opponent_name is None))
+    opponents = dict(zip(opponent_keys, ndb.get_multi(opponent_keys)))
+
+    for each_user, opponent_key, opponent_name in reminders:
+        # Get the name of the opponent.
+        if opponent_name is None:
+            opponent = opponents[opponent_key]
+            if opponent is None:
+                continue
+            opponent_name = opponent.user_name
+
+        # Send email to remind a user of games in progress.
+        mail.send_mail(
+            sender,                                          # from
+            each_user.email,                                 # to
+            'Battleship Game is waiting for your move ...',  # subject
+            'Hey there! %s is waiting for you to make a move!' % opponent_name
+        )
@@ -0,0 +1,225 @@
+"""
+
+Holds all methods relating to replaying a game move by move.
+
+Both boards are saved in a BoardSnapshot every SNAPSHOT_INTERVAL moves.
+The boards at any move are rebuilt from the snapshot at or before that
+move plus fewer than SNAPSHOT_INTERVAL moves, however long the game is.
+Snapshots are created the first time they're needed.
+
+"""
+
+
+from google.appengine.ext import ndb
+
+from battle_models import Boat
+from battle_models import Move
+from battle_models import BoardSnapshot
+
+from battle_consts import SNAPSHOT_INTERVAL
+from battle_consts import TOTAL_HITS
+
+import battle_archive
+import battle_board
+
+
+def _snapshotKey(game_key, move_index):
+    """
+    Get the key of the snapshot of a game after a number of moves.
+
+    Args:
+      game_key: the key of the game.
+      move_index: the number of moves included in the snapshot.
+
+    Returns:
+      A BoardSnapshot key.
+    """
+    return ndb.Key(BoardSnapshot, str(move_index), parent=game_key)
+
+
+def _getMoveCount(selected_game):
+    """
+    Get the number of moves made in a game.
+
+    Args:
+      selected_game: the Game object.
+
+    Returns:
+      The number of moves, including duplicate moves.
+    """
+    if selected_game.archive is not None:
+        return len(battle_archive._getArchivedMoves(selected_game))
+
+    if selected_game.move_count is not None:
+        return selected_game.move_count
+
+    # Games created before moves were counted on the Game.
+    return Move.query(Move.game_id == selected_game.key).count()
+
+
+def _getInitialBoards(selected_game, boats):
+    """
+    Build both boards as they were before the first move.
+
+    Args:
+      selected_game: the Game object.
+      boats: the Boat objects for both users.
+
+    Returns:
+      A tuple with the board of user1[0] and the board of user2[1].
+    """
+    board1 = battle_board._boardFromBoats(
+        [b for b in boats if b.user_id == selected_game.user1])
+    board2 = battle_board._boardFromBoats(
+        [b for b in boats if b.user_id == selected_game.user2])
+    return (board1, board2)
+
+
+def _applyMoves(selected_game, board1, board2, moves):
+    """
+    Apply moves to both boards.
+
+    Args:
+      selected_game: the Game object.
+      board1: the board of user1.
+      board2: the board of user2.
+      moves: the Move objects to apply, ordered by sequence.
+
+    Returns:
+      A tuple with the board of user1[0] and the board of user2[1].
+    """
+    for each_move in moves:
+        # A users' moves are shots at their opponents' board.
+        if each_move.user_id == selected_game.user1:
+            board2 = battle_board._applyShot(board2, each_move.row,
+                                             each_move.col)[0]
+        else:
+            board1 = battle_board._applyShot(board1, each_move.row,
+                                             each_move.col)[0]
+    return (board1, board2)
+
+
+def _buildSnapshots(selected_game, snapshot_index):
+    """
+    Create the snapshot at snapshot_index, and any missing snapshots
+    before it.
+
+    The moves and boats are read with eventually consistent queries, so
+    the new snapshots are only saved if none are missing, ie. every move
+    the Game has counted was read. Otherwise they are only built for this
+    request. Games from before moves were counted are never saved.
+
+    Args:
+      selected_game: the Game object.
+      snapshot_index: a multiple of SNAPSHOT_INTERVAL.
+
+    Returns:
+      The BoardSnapshot at snapshot_index.
+    """
+    game_key = selected_game.key
+    indexes = range(0, snapshot_index + 1, SNAPSHOT_INTERVAL)
+    existing = ndb.get_multi([_snapshotKey(game_key, i) for i in indexes])
+    existing = [each_snapshot for each_snapshot in existing if each_snapshot]
+
+    new_snapshots = []
+    complete = True
+
+    if existing:
+        current = existing[-1]
+    else:
+        boats = Boat.query(Boat.game_id == game_key).fetch()
+        complete = len(boats) == 2 * TOTAL_HITS
+
+        board1, board2 = _getInitialBoards(selected_game, boats)
+        current = BoardSnapshot(key=_snapshotKey(game_key, 0),
+                                move_index=0,
+                                sequence=0,
+                                board1=board1,
+                                board2=board2)
+        new_snapshots.append(current)
+
+    # Read every move after the snapshot, to check none are missing.
+    moves = Move.query(Move.game_id == game_key,
+                       Move.sequence > current.sequence).order(
+                           Move.sequence).fetch()
+    complete = complete and (
+        selected_game.move_count is not None and
+        current.move_index + len(moves) == selected_game.move_count)
+    moves = moves[:snapshot_index - current.move_index]
+
+    for start in range(0, len(moves), SNAPSHOT_INTERVAL):
+        chunk = moves[start:start + SNAPSHOT_INTERVAL]
+
+        # Don't save a snapshot for moves that haven't been saved yet.
+        if len(chunk) < SNAPSHOT_INTERVAL:
+            break
+
+        board1, board2 = _applyMoves(selected_game, current.board1,
+                                     current.board2, chunk)
+        current = BoardSnapshot(
+            key=_snapshotKey(game_key, current.move_index + SNAPSHOT_INTERVAL),
+            move_index=current.move_index + SNAPSHOT_INTERVAL,
+            sequence=chunk[-1].sequence,
+            board1=board1,
+            board2=board2)
+        new_snapshots.append(current)
+
+    if complete:
+        ndb.put_multi(new_snapshots)
+
+    return current
+
+
+def _getBoardsAt(selected_game, move_index):
+    """
+    Get both boards of a game after a number of moves.
+
+    Args:
+      selected_game: the Game object.
+      move_index: the number of moves to include.
+
+    Returns:
+      A tuple with the board of user1[0] and the board of user2[1].
+    """
+    # Archived games have every move and boat in the archive already.
+    if selected_game.archive is not None:
+        boats = (battle_archive._getArchivedBoats(selected_game,
+                                                  selected_game.user1) +
+                 battle_archive._getArchivedBoats(selected_game,
+                                                  selected_game.user2))
+        board1, board2 = _getInitialBoards(selected_game, boats)
+        return _applyMoves(
+            selected_game, board1, board2,
+            battle_archive._getArchivedMoves(selected_game)[:move_index])
+
+    snapshot_index = move_index - move_index % SNAPSHOT_INTERVAL
+    snapshot = _snapshotKey(selected_game.key, snapshot_index).get()
+
+    if snapshot is None:
+        snapshot = _buildSnapshots(selected_game, snapshot_index)
+
+    moves = []
+    if move_index > snapshot.move_index:
+        moves = Move.query(Move.game_id == selected_game.key,
+                           Move.sequence > snapshot.sequence).order(
+                               Move.sequence).fetch(
+                                   move_index - snapshot.move_index)
+
+    return _applyMoves(selected_game, snapshot.board1, snapshot.board2, moves)
+
+
+def _getCurrentBoards(selected_game):
+    """
+    Get both boards of a game as they are now.
+
+    Args:
+      selected_game: the Game object.
+
+    Returns:
+      A tuple with the board of user1[0] and the board of user2[1].
+    """
+    if selected_game.board1 is not None:
+        return (selected_game.board1, selected_game.board2)
+
+    # Games created before boards were stored on the Game.
+    return _getBoardsAt(selected_game, _getMoveCount(selected_game))
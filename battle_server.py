@@ -0,0 +1,968 @@
+"""
+
+Standalone Battleship game server that keeps its games in memory.
+
+This is a deployment mode for latency-sensitive events. A move is a
+dictionary update instead of several datastore RPCs; the moves are
+written behind in batches to a journal on disk, and on a
+restart the server recovers every game from the last snapshot plus the
+journal written since.
+
+The server talks one JSON object per line over TCP:
+
+  request:  {"id": 1, "op": "make_move",
+             "args": {"websafe_game_key": "g1", "websafe_user_key": "u1",
+                      "row": "A", "col": 1}}
+  response: {"id": 1, "result": {"message": "That was a miss."}}
+        or: {"id": 1, "error": "That was not a valid row. ..."}
+
+The ops and their args are the BattleshipApi method names and request
+fields, and the results have the same shape as the API responses.
+
+Python 2.7 has no asyncio so the server is built on asyncore; a single
+thread serves every connection and a writer thread does the disk IO.
+
+This file is not deployed with the app (see skip_files in app.yaml).
+
+Usage:
+  python battle_server.py [--host 0.0.0.0] [--port 9090] [--data ./server_data]
+
+"""
+
+
+import argparse
+import asynchat
+import asyncore
+import base64
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from itertools import combinations
+from Queue import Queue
+
+import battle_board
+import battle_consts
+
+
+class GameServerError(Exception):
+    """A request was not valid; the message is returned to the client."""
+
+
+#   Game State -----------------------------------------------------------------
+
+class _Game(object):
+    """A game held in memory. board1 is user1s' own board."""
+
+    __slots__ = ('user1', 'user2', 'board1', 'board2', 'status', 'winner',
+                 'next_to_move', 'moves', 'tournament')
+
+    def __init__(self, user1, user2, board1, board2, tournament=None):
+        self.user1 = user1
+        self.user2 = user2
+        self.board1 = board1
+        self.board2 = board2
+        self.status = 0  # In Progress
+        self.winner = None
+        self.next_to_move = None
+        self.moves = []  # [user id, cell index, status]
+        self.tournament = tournament
+
+
+class GameStore(object):
+    """
+    Every user, game, matchmaking entry and tournament of the server.
+
+    Each op validates a request, then builds a journal record and applies
+    it with _apply. Recovery applies the same records, so a recovered
+    store is exactly the store that was running.
+    """
+
+    def __init__(self, on_record=None):
+        """
+        Args:
+          on_record: called with each journal record after it's applied.
+        """
+        self._on_record = on_record or (lambda record: None)
+        self.users = {}  # user id: [user name, email]
+        self.user_names = {}
+        self.emails = set()
+        self.games = {}
+        self.user_games = {}  # user id: [game ids]
+        self.active_pairs = {}  # (user id, user id): game id
+        self.waiting = []  # user ids waiting for a match, oldest first
+        self.matches = {}  # user id: [game id, opponent id]
+        self.tournaments = {}  # tournament id: [name, player ids, game ids]
+        self.last_id = 0
+        self.records_since_snapshot = 0
+
+    #   Journal --------------------------------------------------------------
+
+    def _newId(self, prefix):
+        self.last_id += 1
+        return prefix + str(self.last_id)
+
+    def _record(self, record):
+        """Apply a new record and hand it to the journal."""
+        self._apply(record)
+        self.records_since_snapshot += 1
+        self._on_record(record)
+
+    def _apply(self, record):
+        """
+        Apply a journal record to the store.
+
+        Args:
+          record: a dict with an 'op' key, see the ops below.
+        """
+        op = record['op']
+
+        if op == 'move':
+            self._applyMove(record['game'], record['user'], record['cell'])
+
+        elif op == 'user':
+            self.users[record['id']] = [record['user_name'], record['email']]
+            self.user_names[record['user_name']] = record['id']
+            if record['email'] is not None:
+                self.emails.add(record['email'])
+            self.user_games[record['id']] = []
+
+        elif op == 'game':
+            game = _Game(record['user1'], record['user2'], record['board1'],
+                         record['board2'], record.get('tournament'))
+            self.games[record['id']] = game
+            self.user_games[game.user1].append(record['id'])
+            self.user_games[game.user2].append(record['id'])
+            self.active_pairs[_pairId(game.user1, game.user2)] = record['id']
+
+            if record.get('match'):
+                for user_id, opponent_id in ((game.user1, game.user2),
+                                             (game.user2, game.user1)):
+                    if user_id in self.waiting:
+                        self.waiting.remove(user_id)
+                    self.matches[user_id] = [record['id'], opponent_id]
+
+            if game.tournament is not None:
+                self.tournaments[game.tournament][2].append(record['id'])
+
+        elif op == 'cancel':
+            self._endGame(record['game'], 2)  # Cancelled
+
+        elif op == 'join':
+            self.matches.pop(record['user'], None)
+            self.waiting.append(record['user'])
+
+        elif op == 'tournament':
+            self.tournaments[record['id']] = [record['name'],
+                                              record['players'], []]
+
+        self.last_id = max(self.last_id, record.get('last_id', 0))
+
+    def _applyMove(self, game_id, user_id, cell_index):
+        """
+        Fire a shot, pass the turn and finish the game if it was won.
+
+        Returns:
+          The status of the move; 0 = miss, 1 = hit, 2 = duplicate.
+        """
+        game = self.games[game_id]
+        row, col = battle_board._cellRowCol(cell_index)
+
+        if user_id == game.user1:
+            game.board2, status = battle_board._applyShot(game.board2, row, col)
+            game.next_to_move = game.user2
+            opponent_board = game.board2
+        else:
+            game.board1, status = battle_board._applyShot(game.board1, row, col)
+            game.next_to_move = game.user1
+            opponent_board = game.board1
+
+        game.moves.append([user_id, cell_index, status])
+
+        if status == 1 and not any(code in opponent_board
+                                   for code in battle_board.BOAT_CODES):
+            self._endGame(game_id, 1, user_id)  # Finished
+
+        return status
+
+    def _endGame(self, game_id, status, winner=None):
+        game = self.games[game_id]
+        game.status = status
+        game.winner = winner
+        game.next_to_move = None
+        self.active_pairs.pop(_pairId(game.user1, game.user2), None)
+
+    #   Snapshots ------------------------------------------------------------
+
+    def toState(self):
+        """
+        Copy the store into plain lists and dicts that can be saved.
+
+        The copy shares nothing mutable with the store, so it can be
+        written by another thread while the store keeps changing.
+
+        Returns:
+          A dict that fromState turns back into a store.
+        """
+        return {
+            'last_id': self.last_id,
+            'users': [[user_id, name, email]
+                      for user_id, (name, email) in self.users.iteritems()],
+            'games': [[game_id, game.user1, game.user2, game.board1,
+                       game.board2, game.status, game.winner,
+                       game.next_to_move, [list(move) for move in game.moves],
+                       game.tournament]
+                      for game_id, game in self.games.iteritems()],
+            'waiting': list(self.waiting),
+            'matches': [[user_id] + list(match)
+                        for user_id, match in self.matches.iteritems()],
+            'tournaments': [[tournament_id, name, list(players)]
+                            for tournament_id, (name, players, game_ids)
+                            in self.tournaments.iteritems()],
+        }
+
+    @classmethod
+    def fromState(cls, state, on_record=None):
+        """
+        Rebuild a store from a saved copy.
+
+        Args:
+          state: a dict from toState.
+          on_record: see __init__.
+
+        Returns:
+          A GameStore.
+        """
+        store = cls(on_record)
+        store.last_id = state['last_id']
+
+        for user_id, name, email in state['users']:
+            store._apply({'op': 'user', 'id': user_id, 'user_name': name,
+                          'email': email})
+
+        for tournament_id, name, players in state['tournaments']:
+            store._apply({'op': 'tournament', 'id': tournament_id,
+                          'name': name, 'players': players})
+
+        for (game_id, user1, user2, board1, board2, status, winner,
+             next_to_move, moves, tournament) in state['games']:
+            store._apply({'op': 'game', 'id': game_id, 'user1': user1,
+                          'user2': user2, 'board1': board1, 'board2': board2,
+                          'tournament': tournament})
+            game = store.games[game_id]
+            game.next_to_move = next_to_move
+            game.moves = moves
+            if status != 0:
+                store._endGame(game_id, status, winner)
+
+        store.waiting = state['waiting']
+        store.matches = dict((match[0], match[1:])
+                             for match in state['matches'])
+        return store
+
+    #   Helpers --------------------------------------------------------------
+
+    def _getUser(self, user_id, field='websafe_user_key'):
+        if user_id not in self.users:
+            raise GameServerError('{} does not exist.'.format(field))
+        return user_id
+
+    def _getGame(self, game_id):
+        if game_id not in self.games:
+            raise GameServerError('Game does not exist.')
+        return self.games[game_id]
+
+    def _newGame(self, user1, user2, tournament=None, match=False):
+        game_id = self._newId('g')
+        self._record({'op': 'game', 'id': game_id, 'last_id': self.last_id,
+                      'user1': user1, 'user2': user2,
+                      'board1': battle_board._randomBoard(),
+                      'board2': battle_board._randomBoard(),
+                      'tournament': tournament, 'match': match})
+        return game_id
+
+    def _userScore(self, user_id):
+        wins = losses = 0
+        for game_id in self.user_games[user_id]:
+            game = self.games[game_id]
+            if game.status == 1:
+                if game.winner == user_id:
+                    wins += 1
+                else:
+                    losses += 1
+        return (self.users[user_id][0], wins, losses)
+
+    def _gameState(self, user_id, opponent_board):
+        hits, miss, sunk = battle_board._boardScore(opponent_board)
+        user_name = self.users[user_id][0]
+
+        if hits == 0 and miss == 0:
+            return user_name + ' has not made any moves yet.'
+
+        return 'User {} : Hits {} : Miss {} : Sunk {}'.format(
+            user_name, hits, miss, sunk)
+
+    def _boardsAt(self, game, move_index):
+        """Replay a games' moves onto its starting boards."""
+        board1 = battle_board._unshotBoard(game.board1)
+        board2 = battle_board._unshotBoard(game.board2)
+
+        for user_id, cell_index, status in game.moves[:move_index]:
+            row, col = battle_board._cellRowCol(cell_index)
+            if user_id == game.user1:
+                board2 = battle_board._applyShot(board2, row, col)[0]
+            else:
+                board1 = battle_board._applyShot(board1, row, col)[0]
+
+        return (board1, board2)
+
+    #   Ops ------------------------------------------------------------------
+
+    def create_user(self, username, email=None):
+        if username in self.user_names:
+            raise GameServerError(
+                '{} already exists. Please enter a unique username.'.format(username))
+
+        if email is not None and email in self.emails:
+            raise GameServerError(
+                '{} is already used. Please enter a unique email.'.format(email))
+
+        user_id = self._newId('u')
+        self._record({'op': 'user', 'id': user_id, 'last_id': self.last_id,
+                      'user_name': username, 'email': email})
+
+        return {'message': 'User {} successfully created! Websafe Key: {}'.format(username, user_id)}
+
+    def new_game(self, websafe_username1_key, websafe_username2_key):
+        user1 = self._getUser(websafe_username1_key, 'websafe_username1_key')
+        user2 = self._getUser(websafe_username2_key, 'websafe_username2_key')
+
+        if user1 == user2:
+            raise GameServerError('Users cannot be the same.')
+
+        if _pairId(user1, user2) in self.active_pairs:
+            raise GameServerError(
+                'A game is currently in progress for these users.')
+
+        game_id = self._newGame(user1, user2)
+
+        return {'message': 'Game was successfully created! Websafe Key: {}'.format(game_id)}
+
+    def cancel_game(self, websafe_game_key):
+        game = self._getGame(websafe_game_key)
+
+        if game.status == 2:
+            return {'message': 'Game is already cancelled.'}
+
+        if game.status == 1:
+            return {'message': 'Game is already finished, cannot cancel.'}
+
+        self._record({'op': 'cancel', 'game': websafe_game_key})
+
+        return {'message': 'Game was successfully cancelled.'}
+
+    def make_move(self, websafe_game_key, websafe_user_key, row, col):
+        game = self._getGame(websafe_game_key)
+        user_id = self._getUser(websafe_user_key)
+
+        if user_id not in (game.user1, game.user2):
+            raise GameServerError('User is not playing this game.')
+
+        if game.status != 0:
+            raise GameServerError('Game is not in progress.')
+
+        my_row = str(row).upper()
+
+        if my_row not in battle_consts.VALID_ROWS:
+            raise GameServerError(
+                'That was not a valid row. Valid rows are one of the following: ABCDEFGHIJ.')
+
+        try:
+            my_col = int(col)
+        except (TypeError, ValueError):
+            my_col = None
+
+        if my_col not in battle_consts.VALID_COLS:
+            raise GameServerError(
+                'That was not a valid column. Valid columns are 1-10 inclusive.')
+
+        if game.next_to_move not in (None, user_id):
+            return {'message': 'Its not your turn yet, please wait for the other player to make a move.'}
+
+        cell_index = battle_board._cellIndex(my_row, my_col)
+        self._record({'op': 'move', 'game': websafe_game_key,
+                      'user': user_id, 'cell': cell_index})
+
+        status = game.moves[-1][2]
+
+        if status == 2:
+            return {'message': 'Whoops! You already made that move.'}
+
+        if status == 0:
+            return {'message': 'That was a miss.'}
+
+        if game.status == 1:
+            return {'message': 'You won!'}
+
+        opponent_board = game.board2 if user_id == game.user1 else game.board1
+        boat_type = battle_board.BOAT_CODES.index(
+            opponent_board[cell_index].upper())
+
+        if battle_board._boatIsSunkOnBoard(opponent_board, boat_type):
+            boat_name = battle_board.BOAT_NAMES[boat_type]
+            if boat_type == battle_consts.PATROL:
+                boat_name += ' Boat'
+            return {'message': 'You sunk the {}!'.format(boat_name)}
+
+        return {'message': 'That was a hit!'}
+
+    def get_user_games(self, websafe_user_key):
+        user_id = self._getUser(websafe_user_key)
+
+        games = [(self.games[game_id], game_id)
+                 for game_id in self.user_games[user_id]
+                 if self.games[game_id].status == 0]
+
+        return {'all_games': [{'user1': game.user1, 'user2': game.user2,
+                               'user1_name': self.users[game.user1][0],
+                               'user2_name': self.users[game.user2][0],
+                               'status': game.status, 'websafeKey': game_id}
+                              for game, game_id in sorted(
+                                  games, key=lambda (game, game_id): (game.user1, game.user2))]}
+
+    def get_game_history(self, websafe_game_key):
+        game = self._getGame(websafe_game_key)
+
+        all_moves = []
+        for user_id, cell_index, status in game.moves:
+            row, col = battle_board._cellRowCol(cell_index)
+            all_moves.append({'websafe_user_key_for_move': user_id,
+                              'row': row, 'col': col,
+                              'status': _MOVE_STATUS_NAMES[status]})
+
+        return {'all_moves': all_moves}
+
+    def get_compact_game_history(self, websafe_game_key):
+        game = self._getGame(websafe_game_key)
+
+        moves = battle_board._packMoves(
+            [(0 if user_id == game.user1 else 1, cell_index, status)
+             for user_id, cell_index, status in game.moves])
+
+        return {'websafe_user1_key': game.user1,
+                'websafe_user2_key': game.user2,
+                'moves': base64.b64encode(moves),
+                'move_count': len(game.moves)}
+
+    def get_game(self, websafe_game_key):
+        game = self._getGame(websafe_game_key)
+
+        return {'user_states': [
+            {'message': self._gameState(game.user1, game.board2)},
+            {'message': self._gameState(game.user2, game.board1)}]}
+
+    def get_games_state(self, websafe_game_keys):
+        if len(websafe_game_keys) > battle_consts.GAMES_STATE_MAX:
+            raise GameServerError(
+                'At most {} games can be requested at once.'.format(
+                    battle_consts.GAMES_STATE_MAX))
+
+        if any(game_id not in self.games for game_id in websafe_game_keys):
+            raise GameServerError('One or more games do not exist.')
+
+        return {'games': [
+            {'websafe_game_key': game_id,
+             'status': self.games[game_id].status,
+             'user_states': self.get_game(game_id)['user_states']}
+            for game_id in websafe_game_keys]}
+
+    def get_user_boats(self, websafe_game_key, websafe_user_key):
+        game = self._getGame(websafe_game_key)
+        user_id = self._getUser(websafe_user_key)
+
+        own_board = game.board1 if user_id == game.user1 else game.board2
+
+        all_boats = []
+        for cell_index, cell in enumerate(own_board):
+            if cell.upper() in battle_board.BOAT_CODES:
+                row, col = battle_board._cellRowCol(cell_index)
+                boat_type = battle_board.BOAT_CODES.index(cell.upper())
+                all_boats.append((boat_type, col, row))
+
+        return {'all_boats': [{'boat_type': battle_board.BOAT_NAMES[
+                                   each_boat[0]],
+                               'row': each_boat[2], 'col': each_boat[1]}
+                              for each_boat in sorted(all_boats)]}
+
+    def get_user_score(self, websafe_user_key):
+        user_id = self._getUser(websafe_user_key)
+        return {'message': _userScoreMessage(self._userScore(user_id))}
+
+    def get_user_rankings(self):
+        all_rankings = [self._userScore(user_id) for user_id in self.users]
+        all_rankings = [each_rank for each_rank in all_rankings
+                        if each_rank[1] or each_rank[2]]
+        all_rankings.sort(key=lambda each_rank: (-each_rank[1], each_rank[2]))
+
+        return {'rankings': [{'message': _userScoreMessage(each_rank)}
+                             for each_rank in all_rankings]}
+
+    def get_board_at(self, websafe_game_key, move_index):
+        game = self._getGame(websafe_game_key)
+        move_index = int(move_index)
+
+        if move_index < 0 or move_index > len(game.moves):
+            raise GameServerError(
+                'move_index must be between 0 and {}.'.format(len(game.moves)))
+
+        board1, board2 = self._boardsAt(game, move_index)
+
+        return {'move_index': move_index, 'total_moves': len(game.moves),
+                'user1': game.user1, 'user2': game.user2,
+                'board1': board1, 'board2': board2}
+
+    def get_board_view(self, websafe_game_key, websafe_user_key):
+        game = self._getGame(websafe_game_key)
+        user_id = self._getUser(websafe_user_key)
+
+        if user_id == game.user1:
+            own_board, opponent_board = game.board1, game.board2
+        elif user_id == game.user2:
+            own_board, opponent_board = game.board2, game.board1
+        else:
+            raise GameServerError('User is not playing this game.')
+
+        return {'own_board': own_board,
+                'target_board': battle_board._targetView(opponent_board),
+                'user_states': self.get_game(websafe_game_key)['user_states'],
+                'status': game.status,
+                'next_to_move': game.next_to_move}
+
+    def get_shot_hint(self, websafe_game_key, websafe_user_key):
+        import battle_hint
+
+        game = self._getGame(websafe_game_key)
+        user_id = self._getUser(websafe_user_key)
+
+        if user_id not in (game.user1, game.user2):
+            raise GameServerError('User is not playing this game.')
+
+        opponent_board = game.board2 if user_id == game.user1 else game.board1
+        probabilities, samples = battle_hint._getShotProbabilities(
+            opponent_board)
+
+        best_cell = max(range(len(probabilities)),
+                        key=lambda cell_index: probabilities[cell_index])
+        row, col = battle_board._cellRowCol(best_cell)
+
+        return {'probabilities': probabilities, 'row': row, 'col': col,
+                'samples': samples, 'move_count': len(game.moves)}
+
+    def join_matchmaking(self, websafe_user_key):
+        user_id = self._getUser(websafe_user_key)
+
+        if user_id in self.waiting:
+            return {'message': 'You are already waiting for a game.'}
+
+        self._record({'op': 'join', 'user': user_id})
+
+        # Everything is in memory so users are paired as soon as they join,
+        # with the longest waiting user they don't have a game with.
+        for opponent_id in self.waiting[:-1]:
+            if _pairId(user_id, opponent_id) not in self.active_pairs:
+                self._newGame(opponent_id, user_id, match=True)
+                break
+
+        return {'message': 'You are waiting for a game. Use get_matchmaking_status to find your game.'}
+
+    def get_matchmaking_status(self, websafe_user_key):
+        user_id = self._getUser(websafe_user_key)
+
+        if user_id in self.waiting:
+            return {'status': 'Waiting'}
+
+        if user_id in self.matches:
+            game_id, opponent_id = self.matches[user_id]
+            return {'status': 'Matched', 'websafe_game_key': game_id,
+                    'websafe_opponent_key': opponent_id}
+
+        return {'status': 'Not waiting'}
+
+    def create_tournament(self, name, websafe_user_keys):
+        players = [self._getUser(user_id) for user_id in websafe_user_keys]
+
+        if len(players) < 2:
+            raise GameServerError('A tournament needs at least 2 players.')
+
+        if len(players) > battle_consts.TOURNAMENT_MAX_PLAYERS:
+            raise GameServerError('A tournament can have at most {} players.'.format(
+                battle_consts.TOURNAMENT_MAX_PLAYERS))
+
+        if len(set(players)) != len(players):
+            raise GameServerError('Each player can only be entered once.')
+
+        pairings = list(combinations(players, 2))
+        if any(_pairId(user1, user2) in self.active_pairs
+               for user1, user2 in pairings):
+            raise GameServerError(
+                'Some of these players already have a game in progress.')
+
+        tournament_id = self._newId('t')
+        self._record({'op': 'tournament', 'id': tournament_id,
+                      'last_id': self.last_id, 'name': name,
+                      'players': players})
+
+        for user1, user2 in pairings:
+            self._newGame(user1, user2, tournament=tournament_id)
+
+        return {'message': 'Tournament was successfully created! Websafe Key: {}'.format(tournament_id)}
+
+    def get_tournament_standings(self, websafe_tournament_key):
+        if websafe_tournament_key not in self.tournaments:
+            raise GameServerError('Tournament does not exist.')
+
+        name, players, game_ids = self.tournaments[websafe_tournament_key]
+        played = dict((user_id, 0) for user_id in players)
+        won = dict((user_id, 0) for user_id in players)
+        games_finished = 0
+
+        for game_id in game_ids:
+            game = self.games[game_id]
+            if game.status == 1:
+                games_finished += 1
+                played[game.user1] += 1
+                played[game.user2] += 1
+                won[game.winner] += 1
+
+        standings = sorted(players,
+                           key=lambda user_id: (-won[user_id], played[user_id]))
+
+        return {'standings': [
+            {'message': '{} : Played {} : Wins {} : Losses {}'.format(
+                self.users[user_id][0], played[user_id], won[user_id],
+                played[user_id] - won[user_id])}
+            for user_id in standings],
+            'games_finished': games_finished,
+            'games_total': len(game_ids)}
+
+
+# The ops a client may call.
+OPS = frozenset([
+    'create_user', 'new_game', 'cancel_game', 'make_move', 'get_user_games',
+    'get_game_history', 'get_compact_game_history', 'get_game',
+    'get_games_state', 'get_user_boats', 'get_user_score',
+    'get_user_rankings', 'get_board_at', 'get_board_view', 'get_shot_hint',
+    'join_matchmaking', 'get_matchmaking_status',
+    'create_tournament', 'get_tournament_standings',
+])
+
+_MOVE_STATUS_NAMES = ['Miss', 'Hit', 'Duplicate']
+
+
+def _pairId(user1, user2):
+    return tuple(sorted((user1, user2)))
+
+
+def _userScoreMessage(user_score):
+    return user_score[0] + ' : Wins ' + str(user_score[1]) + ' : Losses ' + str(user_score[2])
+
+
+#   Persistence ----------------------------------------------------------------
+
+class FilePersistence(object):
+    """
+    Saves a JSON snapshot and a JSON-lines journal to a directory.
+
+    To save somewhere else, ie. Cloud Storage or a database, pass
+    GameServer an object with the same load, append, snapshot and close
+    methods.
+
+    Each snapshot has the next generation number and the journal starts
+    with a header line holding the generation it follows on from. If the
+    server stops after a snapshot is saved but before the journal is
+    emptied, the journal's generation is older than the snapshots' and
+    its records, which are already in the snapshot, are not replayed.
+    """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._snapshot_path = os.path.join(directory, 'snapshot.json')
+        self._journal_path = os.path.join(directory, 'journal.jsonl')
+        self._journal = None
+        self._generation = 0
+
+    def load(self):
+        """
+        Load the saved state.
+
+        Returns:
+          a tuple;
+            the last snapshot from GameStore.toState, or None[0]
+            a list of journal records written since the snapshot[1]
+        """
+        state = None
+        if os.path.exists(self._snapshot_path):
+            with open(self._snapshot_path) as snapshot_file:
+                state = json.load(snapshot_file)
+            self._generation = state.pop('journal_generation', 0)
+
+        journal_generation = 0
+        records = []
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path) as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A half written last line from a crash.
+                        logging.warning('Ignoring a damaged journal record.')
+                        break
+
+                    if 'journal_generation' in record:
+                        journal_generation = record['journal_generation']
+                    else:
+                        records.append(record)
+
+        if journal_generation < self._generation:
+            # The snapshot was saved after these records.
+            logging.info('Skipping %d journal records already in the '
+                         'snapshot.', len(records))
+            records = []
+            self._openJournal('w')
+
+        return (state, records)
+
+    def append(self, records):
+        """
+        Save a batch of journal records after those already saved.
+
+        Args:
+          records: a list of journal record dicts.
+        """
+        if self._journal is None:
+            self._openJournal('a')
+        self._journal.write(''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                                    for record in records))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def snapshot(self, state):
+        """
+        Replace the snapshot; the journal saved so far is no longer needed.
+
+        Args:
+          state: a dict from GameStore.toState.
+        """
+        state = dict(state, journal_generation=self._generation + 1)
+
+        temp_path = self._snapshot_path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump(state, snapshot_file, separators=(',', ':'))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.rename(temp_path, self._snapshot_path)
+        self._generation += 1
+
+        # Everything in the journal is in the new snapshot.
+        self._openJournal('w')
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _openJournal(self, mode):
+        """
+        Open the journal, writing the generation header if it's empty.
+
+        Args:
+          mode: 'a' to add to the journal, 'w' to empty it.
+        """
+        self.close()
+        self._journal = open(self._journal_path, mode)
+
+        if self._journal.tell() == 0:
+            self._journal.write(json.dumps(
+                {'journal_generation': self._generation}) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+
+class WriteBehind(object):
+    """
+    Buffers journal records and saves them in batches on a writer thread,
+    so the server never waits on disk.
+    """
+
+    def __init__(self, persistence):
+        self._persistence = persistence
+        self._buffer = []
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= battle_consts.SERVER_FLUSH_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._queue.put(('append', self._buffer))
+            self._buffer = []
+
+    def snapshot(self, state):
+        # The snapshot holds every buffered record, so they're written
+        # first to keep the journal in order.
+        self.flush()
+        self._queue.put(('snapshot', state))
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._persistence.close()
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            action, argument = item
+            try:
+                getattr(self._persistence, action)(argument)
+            except Exception:
+                logging.exception('Writing the %s failed.', action)
+
+
+#   Network --------------------------------------------------------------------
+
+class _Connection(asynchat.async_chat):
+    """One client connection; a JSON request per line."""
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock)
+        self.set_terminator('\n')
+        self._incoming = []
+        self._server = server
+
+    def collect_incoming_data(self, data):
+        self._incoming.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self._incoming)
+        self._incoming = []
+        if line.strip():
+            self.push(self._server.handleLine(line) + '\n')
+
+
+class GameServer(asyncore.dispatcher):
+    """Accepts connections and runs requests against the GameStore."""
+
+    def __init__(self, host, port, persistence):
+        asyncore.dispatcher.__init__(self)
+        self._writer = WriteBehind(persistence)
+
+        state, records = persistence.load()
+        if state is not None:
+            self.store = GameStore.fromState(state, self._writer.append)
+        else:
+            self.store = GameStore(self._writer.append)
+        for record in records:
+            self.store._apply(record)
+        self.store.records_since_snapshot = len(records)
+
+        logging.info('Recovered %d users and %d games (%d journal records).',
+                     len(self.store.users), len(self.store.games),
+                     len(records))
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(1024)
+        self._running = True
+
+    def handle_accept(self):
+        accepted = self.accept()
+        if accepted is not None:
+            _Connection(accepted[0], self)
+
+    def handleLine(self, line):
+        """
+        Run one request.
+
+        Args:
+          line: a JSON request, see the module docstring.
+
+        Returns:
+          A JSON response.
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            op = request.get('op')
+
+            if op not in OPS:
+                raise GameServerError('Unknown op {}.'.format(op))
+
+            result = getattr(self.store, op)(**(request.get('args') or {}))
+            response = {'id': request_id, 'result': result}
+        except GameServerError as error:
+            response = {'id': request_id, 'error': str(error)}
+        except (ValueError, TypeError, AttributeError) as error:
+            response = {'id': request_id,
+                        'error': 'Bad request: {}'.format(error)}
+
+        return json.dumps(response, separators=(',', ':'))
+
+    def stop(self, *args):
+        self._running = False
+
+    def serve_forever(self):
+        """Serve until stop is called, then save a final snapshot."""
+        next_flush = time.time() + battle_consts.SERVER_FLUSH_INTERVAL
+
+        while self._running:
+            asyncore.loop(timeout=battle_consts.SERVER_FLUSH_INTERVAL,
+                          use_poll=True, count=1)
+
+            if time.time() >= next_flush:
+                self._writer.flush()
+                next_flush = time.time() + battle_consts.SERVER_FLUSH_INTERVAL
+
+            if (self.store.records_since_snapshot >=
+                    battle_consts.SERVER_SNAPSHOT_EVERY):
+                self._writer.snapshot(self.store.toState())
+                self.store.records_since_snapshot = 0
+
+        self._writer.snapshot(self.store.toState())
+        self._writer.close()
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--data', default='server_data',
+                        help='directory for the snapshot and journal')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = GameServer(args.host, args.port, FilePersistence(args.data))
+    signal.signal(signal.SIGINT, server.stop)
+    signal.signal(signal.SIGTERM, server.stop)
+
+    logging.info('Serving on %s:%d', args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
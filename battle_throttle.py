@@ -0,0 +1,262 @@
+"""
+
+Holds the token buckets used to limit how fast moves can be made.
+
+Each bucket holds up to burst tokens and refills at rate tokens per second.
+A move takes one token from the users' bucket and one from the games'
+bucket; if either is empty the move is rejected before the datastore is
+touched, and neither token is used up. Buckets live in memcache so they
+are shared by every instance. If memcache is unreachable a bucket local
+to this instance is used; a bucket that is too contended to update is
+treated as empty.
+
+The rates and bursts default to the values in battle_consts and can be
+set with the BATTLESHIP_MOVE_RATE_PER_USER, BATTLESHIP_MOVE_BURST_PER_USER,
+BATTLESHIP_MOVE_RATE_PER_GAME and BATTLESHIP_MOVE_BURST_PER_GAME
+variables under env_variables in app.yaml.
+
+"""
+
+
+import logging
+import os
+import threading
+import time
+
+from google.appengine.api import memcache
+
+from battle_consts import MOVE_RATE_PER_USER
+from battle_consts import MOVE_BURST_PER_USER
+from battle_consts import MOVE_RATE_PER_GAME
+from battle_consts import MOVE_BURST_PER_GAME
+from battle_consts import THROTTLE_CAS_RETRIES
+from battle_consts import THROTTLE_LOG_EVERY
+
+
+USER_RATE = float(
+    os.environ.get('BATTLESHIP_MOVE_RATE_PER_USER', '') or MOVE_RATE_PER_USER)
+USER_BURST = float(
+    os.environ.get('BATTLESHIP_MOVE_BURST_PER_USER', '') or MOVE_BURST_PER_USER)
+GAME_RATE = float(
+    os.environ.get('BATTLESHIP_MOVE_RATE_PER_GAME', '') or MOVE_RATE_PER_GAME)
+GAME_BURST = float(
+    os.environ.get('BATTLESHIP_MOVE_BURST_PER_GAME', '') or MOVE_BURST_PER_GAME)
+
+_local_buckets = {}
+_local_lock = threading.Lock()
+
+_reject_counts = {'user': 0, 'game': 0}
+_reject_lock = threading.Lock()
+
+
+def _refill(tokens, last_time, now, rate, burst):
+    """
+    Work out how many tokens are in a bucket now.
+
+    Args:
+      tokens: the number of tokens at last_time.
+      last_time: the time the bucket was last updated.
+      now: the current time.
+      rate: tokens added per second.
+      burst: the most tokens the bucket can hold.
+
+    Returns:
+      The number of tokens in the bucket.
+    """
+    return min(burst, tokens + max(0, now - last_time) * rate)
+
+
+def _takeLocalToken(bucket_key, rate, burst):
+    """
+    Take a token from a bucket held in this instances' memory.
+
+    Args:
+      bucket_key: the name of the bucket.
+      rate: tokens added per second.
+      burst: the most tokens the bucket can hold.
+
+    Returns:
+      True if a token was taken, False if the bucket is empty.
+    """
+    now = time.time()
+
+    with _local_lock:
+        tokens, last_time = _local_buckets.get(bucket_key, (burst, now))
+        tokens = _refill(tokens, last_time, now, rate, burst)
+
+        if tokens < 1:
+            _local_buckets[bucket_key] = (tokens, now)
+            return False
+
+        _local_buckets[bucket_key] = (tokens - 1, now)
+        return True
+
+
+def _hasToken(bucket_key, rate, burst):
+    """
+    Check if a bucket has a token, without taking it.
+
+    Args:
+      bucket_key: the name of the bucket.
+      rate: tokens added per second.
+      burst: the most tokens the bucket can hold.
+
+    Returns:
+      True if the bucket has a token.
+    """
+    now = time.time()
+    bucket = memcache.get(bucket_key)
+
+    if bucket is None:
+        with _local_lock:
+            bucket = _local_buckets.get(bucket_key)
+        if bucket is None:
+            # A new bucket starts full.
+            return True
+
+    return _refill(bucket[0], bucket[1], now, rate, burst) >= 1
+
+
+def _takeToken(bucket_key, rate, burst):
+    """
+    Take a token from a bucket held in memcache.
+
+    Args:
+      bucket_key: the name of the bucket.
+      rate: tokens added per second.
+      burst: the most tokens the bucket can hold.
+
+    Returns:
+      True if a token was taken, False if the bucket is empty.
+    """
+    client = memcache.Client()
+    expiry = int(burst / rate) + 60
+    unreachable = False
+
+    for attempt in range(THROTTLE_CAS_RETRIES):
+        now = time.time()
+        bucket = client.gets(bucket_key)
+
+        if bucket is None:
+            # A new bucket starts full, less the token being taken now.
+            if client.add(bucket_key, (burst - 1, now), time=expiry):
+                return True
+            # Either another request added the bucket first, or memcache
+            # can't be reached.
+            unreachable = True
+            continue
+
+        unreachable = False
+        tokens = _refill(bucket[0], bucket[1], now, rate, burst)
+
+        if tokens < 1:
+            return False
+
+        if client.cas(bucket_key, (tokens - 1, now), time=expiry):
+            return True
+
+    if unreachable:
+        return _takeLocalToken(bucket_key, rate, burst)
+
+    # The bucket is too contended to update, which only happens when
+    # moves are coming in too quickly.
+    return False
+
+
+def _returnToken(bucket_key, rate, burst):
+    """
+    Put back a token taken by _takeToken, ie. when the move is turned
+    away by its other bucket.
+
+    Args:
+      bucket_key: the name of the bucket.
+      rate: tokens added per second.
+      burst: the most tokens the bucket can hold.
+    """
+    client = memcache.Client()
+    expiry = int(burst / rate) + 60
+    bucket = None
+
+    for attempt in range(THROTTLE_CAS_RETRIES):
+        now = time.time()
+        bucket = client.gets(bucket_key)
+
+        if bucket is None:
+            break
+
+        tokens = _refill(bucket[0], bucket[1], now, rate, burst)
+        if client.cas(bucket_key, (min(burst, tokens + 1), now),
+                      time=expiry):
+            return
+
+    # Too contended to put back; the user waits for a refill instead.
+    if bucket is not None:
+        return
+
+    # The token came from this instances' bucket if memcache couldn't be
+    # reached.
+    now = time.time()
+    with _local_lock:
+        if bucket_key in _local_buckets:
+            tokens, last_time = _local_buckets[bucket_key]
+            tokens = _refill(tokens, last_time, now, rate, burst)
+            _local_buckets[bucket_key] = (min(burst, tokens + 1), now)
+
+
+def _countReject(bucket_type, bucket_key):
+    """
+    Count and log a rejected move.
+
+    Args:
+      bucket_type: 'user' or 'game'.
+      bucket_key: the name of the bucket that was empty.
+    """
+    with _reject_lock:
+        _reject_counts[bucket_type] += 1
+        count = _reject_counts[bucket_type]
+
+    if count == 1 or count % THROTTLE_LOG_EVERY == 0:
+        logging.warning('make_move throttled on %s; rejected on this '
+                        'instance so far: user=%d game=%d',
+                        bucket_key,
+                        _reject_counts['user'],
+                        _reject_counts['game'])
+
+
+def _admitMove(websafe_user_key, websafe_game_key):
+    """
+    Determine if a move may go ahead.
+
+    Args:
+      websafe_user_key: the url-safe key of the user making the move.
+      websafe_game_key: the url-safe key of the game.
+
+    Returns:
+      True if the move may go ahead.
+      False if the user or the game is making moves too quickly.
+    """
+    user_bucket = 'throttle:user:' + websafe_user_key
+    game_bucket = 'throttle:game:' + websafe_game_key
+
+    # Check both buckets first, so most moves turned away by the game
+    # never take one of the users' tokens.
+    if not _hasToken(user_bucket, USER_RATE, USER_BURST):
+        _countReject('user', user_bucket)
+        return False
+
+    if not _hasToken(game_bucket, GAME_RATE, GAME_BURST):
+        _countReject('game', game_bucket)
+        return False
+
+    if not _takeToken(user_bucket, USER_RATE, USER_BURST):
+        _countReject('user', user_bucket)
+        return False
+
+    if not _takeToken(game_bucket, GAME_RATE, GAME_BURST):
+        # The game ran out since it was checked, give the user their
+        # token back.
+        _returnToken(user_bucket, USER_RATE, USER_BURST)
+        _countReject('game', game_bucket)
+        return False
+
+    return True
@@ -0,0 +1,211 @@
+"""
+
+Holds all methods relating to round robin tournaments.
+
+Every player in a tournament plays every other player once. The games
+are created server-side with batched writes; big tournaments are split
+into task queue chunks so no single request runs for too long.
+
+"""
+
+
+import logging
+from itertools import combinations
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from battle_models import Game
+from battle_models import Tournament
+
+from battle_consts import TOURNAMENT_CHUNK
+from battle_consts import TOURNAMENT_MAX_PLAYERS
+
+import battle_cache
+import battle_game
+
+
+def _getPairings(players):
+    """
+    Get every pairing of the players, in a fixed order.
+
+    Args:
+      players: a list of User keys.
+
+    Returns:
+      A list of (user key, user key) tuples.
+    """
+    return list(combinations(players, 2))
+
+
+def _validatePlayers(user_keys):
+    """
+    Validate the players for a new tournament.
+
+    Args:
+      user_keys: a list of User keys.
+
+    Returns:
+      None if the players are valid, otherwise a string describing why not.
+    """
+    if len(user_keys) < 2:
+        return 'A tournament needs at least 2 players.'
+
+    if len(user_keys) > TOURNAMENT_MAX_PLAYERS:
+        return 'A tournament can have at most {} players.'.format(
+            TOURNAMENT_MAX_PLAYERS)
+
+    if len(set(user_keys)) != len(user_keys):
+        return 'Each player can only be entered once.'
+
+    # Validate every user with one read.
+    if None in ndb.get_multi(user_keys):
+        return 'One or more users do not exist.'
+
+    # Check every pairing for a game in progress with one more read.
+    pairs = ndb.get_multi([battle_game._pairKey(user1_key, user2_key)
+                           for user1_key, user2_key in _getPairings(user_keys)])
+    if any(pair is not None and pair.active_game is not None
+           for pair in pairs):
+        return 'Some of these players already have a game in progress.'
+
+    return None
+
+
+def _createTournament(name, user_keys):
+    """
+    Create a tournament and start creating its games.
+
+    Small tournaments have their games created straight away. Bigger
+    tournaments are split into chunks that are created by tasks.
+
+    Args:
+      name: the name of the tournament.
+      user_keys: a list of validated User keys, see _validatePlayers.
+
+    Returns:
+      The key of the new Tournament.
+    """
+    pairings = _getPairings(user_keys)
+
+    # Reserve every games' key up front, so a retried chunk task finds the
+    # games it has already created.
+    first_game_id = Game.allocate_ids(len(pairings))[0]
+
+    tournament_key = Tournament(name=name,
+                                players=user_keys,
+                                total_games=len(pairings),
+                                first_game_id=first_game_id).put()
+
+    if len(pairings) <= TOURNAMENT_CHUNK:
+        _createTournamentGames(tournament_key, 0, len(pairings))
+        return tournament_key
+
+    for start in range(0, len(pairings), TOURNAMENT_CHUNK):
+        taskqueue.add(url='/tasks/create_tournament_games',
+                      params={'tournament': tournament_key.urlsafe(),
+                              'start': start,
+                              'end': min(start + TOURNAMENT_CHUNK,
+                                         len(pairings))})
+
+    return tournament_key
+
+
+def _createTournamentGames(tournament_key, start, end):
+    """
+    Create the games for a chunk of a tournaments' pairings.
+
+    Args:
+      tournament_key: the key of the tournament.
+      start: the index of the first pairing in the chunk.
+      end: the index after the last pairing in the chunk.
+    """
+    tournament = tournament_key.get()
+
+    pairings = []
+    reserved_keys = []
+    for index, pairing in enumerate(_getPairings(tournament.players)):
+        if index < start or index >= end:
+            continue
+
+        # Pairs skipped by an earlier try of this task stay skipped, so
+        # the tournament has the number of games it reports.
+        if battle_game._pairKey(*pairing).id() in tournament.skipped_pairs:
+            continue
+
+        pairings.append(pairing)
+        if tournament.first_game_id is not None:
+            reserved_keys.append(
+                ndb.Key(Game, tournament.first_game_id + index))
+
+    game_keys = battle_game._createGames(pairings, tournament_key,
+                                         reserved_keys or None)
+
+    skipped = [pairing for pairing, game_key in zip(pairings, game_keys)
+               if game_key is None]
+
+    if skipped:
+        logging.warning('Skipped %d games of tournament %s, their players '
+                        'already have a game in progress.',
+                        len(skipped), tournament_key.id())
+        _recordSkippedPairs(tournament_key,
+                            [battle_game._pairKey(user1_key, user2_key).id()
+                             for user1_key, user2_key in skipped])
+
+    battle_cache._bumpVersions(*[battle_cache._userVersion(user_key)
+                                 for pairing in pairings
+                                 for user_key in pairing])
+
+
+@ndb.transactional
+def _recordSkippedPairs(tournament_key, pair_ids):
+    """
+    Add pairs to a tournaments' skipped pairs.
+
+    Args:
+      tournament_key: the key of the tournament.
+      pair_ids: the GamePair ids of the skipped pairs.
+    """
+    tournament = tournament_key.get()
+    new_ids = [pair_id for pair_id in pair_ids
+               if pair_id not in tournament.skipped_pairs]
+
+    if new_ids:
+        tournament.skipped_pairs.extend(new_ids)
+        tournament.put()
+
+
+def _getStandings(tournament):
+    """
+    Get the standings of a tournament.
+
+    Args:
+      tournament: the Tournament object.
+
+    Returns:
+      a tuple;
+        a list of (user key, games played, games won) tuples ordered by
+          wins descending then games played ascending[0]
+        the number of finished games[1]
+    """
+    played = dict((user_key, 0) for user_key in tournament.players)
+    won = dict((user_key, 0) for user_key in tournament.players)
+    finished_games = set()
+
+    # The projection returns one result per player of each finished game.
+    results = Game.query(Game.tournament == tournament.key,
+                         Game.status == 1  # Finished
+                         ).fetch(projection=[Game.players, Game.winner])
+
+    for each_result in results:
+        finished_games.add(each_result.key)
+        player_key = each_result.players[0]
+        played[player_key] += 1
+        if each_result.winner == player_key:
+            won[player_key] += 1
+
+    standings = sorted(((user_key, played[user_key], won[user_key])
+                        for user_key in tournament.players),
+                       key=lambda standing: (-standing[2], standing[1]))
+
+    return (standings, len(finished_games))
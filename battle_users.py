@@ -5,12 +5,11 @@ Holds all methods relating to user actions and/or User kind.
 """
 
 
-import endpoints
-
 from google.appengine.ext import ndb
 
 from battle_models import User
 from battle_models import Game
+from battle_models import GamePair
 
 
 def _createUser(username, email):
@@ -24,6 +23,8 @@ def _createUser(username, email):
     Returns:
       A User object if the user is successfully created.
     """
+    import endpoints
+
     new_user = User(user_name=username,
                     email=email)
     try:
@@ -44,6 +45,8 @@ def _getUserViaWebsafeKey(websafe_user_key):
       An error is raised if the user doesn't exist.
       If the user exists then a User object is returned.
     """
+    import endpoints
+
     try:
         selected_user = ndb.Key(urlsafe=websafe_user_key).get()
     except:
@@ -104,13 +107,18 @@ def _getUserScore(websafe_user_key):
     # Get the user key.
     user_key = ndb.Key(urlsafe=websafe_user_key)
 
-    # Get games the user won.
-    games_won = Game.query(ndb.AND(Game.status == 1, Game.winner == user_key, ndb.OR(
-        Game.user1 == user_key, Game.user2 == user_key))).count()
+    # Get games the user won. Wins are counted with the same players
+    # filter as the games played, so a game is either in both counts or
+    # in neither; games are only found by players once the game backfill
+    # has run (see battle_backfill).
+    games_won = Game.query(Game.status == 1,
+                           Game.players == user_key,
+                           Game.winner == user_key).count()
 
-    # Get games the user lost.
-    games_lost = Game.query(ndb.AND(Game.status == 1, Game.winner != user_key, ndb.OR(
-        Game.user1 == user_key, Game.user2 == user_key))).count()
+    # Get games the user lost. Every finished game the user played
+    # and did not win was lost.
+    games_lost = Game.query(Game.status == 1,
+                            Game.players == user_key).count() - games_won
 
     # Create a tuple with the username, wins and losses.
     user_score = (selected_user.user_name, games_won, games_lost)
@@ -118,25 +126,43 @@ def _getUserScore(websafe_user_key):
     return user_score
 
 
-def _getUserScoreMessage(user_score):
+def _scoreIsComplete(user_key, user_score):
     """
-    Generate a message with the users wins/losses.
+    Check that a score counted with Game queries includes every finished
+    game the users' GamePairs have recorded. Game queries are eventually
+    consistent, so a game finished a moment ago can be missing; the
+    GamePairs are read by key, so their totals are up to date.
 
     Args:
-      user_score: a tuple with the username[0], games won[1], games lost[2]
-      (this can be generated via _getUserScore).
+      user_key: the key of the user.
+      user_score: the users' score from _getUserScore.
 
     Returns:
-      a string in the format; <username> : Wins <x> : Losses <x>
+      True if no finished game is missing from the score.
     """
-    return user_score[0] + ' : Wins ' + str(user_score[1]) + ' : Losses ' + str(user_score[2])
+    pair_keys = GamePair.query(GamePair.users == user_key).fetch(
+        keys_only=True)
+
+    games_won = games_played = 0
+    for each_pair in ndb.get_multi(pair_keys):
+        if each_pair is None:
+            continue
+        games_played += each_pair.games_played
+        games_won += each_pair.wins[each_pair.users.index(user_key)]
 
+    return (user_score[1] >= games_won and
+            user_score[1] + user_score[2] >= games_played)
 
-def _getUsersWithEmails():
+
+def _getUserScoreMessage(user_score):
     """
-    Get a list of users that have an email entered.
+    Generate a message with the users wins/losses.
+
+    Args:
+      user_score: a tuple with the username[0], games won[1], games lost[2]
+      (this can be generated via _getUserScore).
 
     Returns:
-      A list of User objects.
+      a string in the format; <username> : Wins <x> : Losses <x>
     """
-    return User.query(User.email != '')
+    return user_score[0] + ' : Wins ' + str(user_score[1]) + ' : Losses ' + str(user_score[2])
@@ -7,6 +7,8 @@ Holds all misc helper methods for the battleship API.
 
 from google.appengine.ext import ndb
 
+from battle_consts import PUT_BATCH
+
 
 def _getNDBKey(websafe_key_to_get):
     """
@@ -19,3 +21,42 @@ def _getNDBKey(websafe_key_to_get):
       A Datastore entity key.
     """
     return ndb.Key(urlsafe=websafe_key_to_get)
+
+
+def _getValidNDBKey(websafe_key_to_get, kind_name):
+    """
+    Get the entity key from the websafe key passed in, without a datastore
+    read.
+
+    Args:
+      websafe_key_to_get: the url-safe key of an entity.
+      kind_name: the kind the key must be for ie. 'Game'.
+
+    Returns:
+      An error is raised if the websafe key isn't a key of kind_name.
+      Otherwise a Datastore entity key is returned.
+    """
+    import endpoints
+
+    try:
+        entity_key = ndb.Key(urlsafe=websafe_key_to_get)
+    except:
+        raise endpoints.BadRequestException(
+            '{} does not exist.'.format(kind_name))
+
+    if entity_key.kind() != kind_name:
+        raise endpoints.BadRequestException(
+            '{} does not exist.'.format(kind_name))
+
+    return entity_key
+
+
+def _putInBatches(entities):
+    """
+    Save entities in batches no bigger than the datastore allows.
+
+    Args:
+      entities: a list of the entities to save.
+    """
+    for start in range(0, len(entities), PUT_BATCH):
+        ndb.put_multi(entities[start:start + PUT_BATCH])
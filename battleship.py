@@ -8,8 +8,6 @@ Server-side Google App Engine API for Battleship Game; uses Google Cloud Endpoin
 import endpoints
 
 from google.appengine.ext import ndb
-from google.appengine.api import app_identity
-from google.appengine.api import mail
 
 from protorpc import messages
 from protorpc import message_types
@@ -20,6 +18,19 @@ import battle_users
 import battle_game
 import battle_boat
 import battle_utils
+import battle_archive
+import battle_events
+import battle_throttle
+import battle_cache
+import battle_profile
+import battle_reminders
+import battle_replay
+import battle_board
+import battle_matchmaking
+import battle_tournament
+import battle_analytics
+import battle_hint
+import battle_counters
 
 from battle_containers import USER_POST_REQUEST
 from battle_containers import NEW_GAME_REQUEST
@@ -30,16 +41,34 @@ from battle_containers import GET_GAME_HISTORY_REQUEST
 from battle_containers import GET_GAME_STATE
 from battle_containers import GET_BOAT_LIST
 from battle_containers import GET_USER_SCORE
+from battle_containers import GET_BOARD_AT
+from battle_containers import GET_BOARD_VIEW
+from battle_containers import MATCHMAKING_REQUEST
+from battle_containers import NEW_TOURNAMENT_REQUEST
+from battle_containers import GET_TOURNAMENT_STANDINGS
+from battle_containers import GET_GAMES_STATE
+from battle_containers import GET_SHOT_HINT
 
 from battle_messages import StringMessage
 from battle_messages import ListOfGames
 from battle_messages import ListOfMoves
+from battle_messages import CompactMoves
 from battle_messages import ReturnGameState
 from battle_messages import ListOfBoats
 from battle_messages import ListOfRankings
+from battle_messages import BoardAtMove
+from battle_messages import BoardView
+from battle_messages import MatchmakingStatus
+from battle_messages import TournamentStandings
+from battle_messages import SingleGameState
+from battle_messages import ListOfGameStates
+from battle_messages import Heatmap
+from battle_messages import BoatSinkStats
+from battle_messages import ShotAnalyticsReport
+from battle_messages import ShotHint
+from battle_messages import GlobalStats
 
 from battle_models import User
-from battle_models import Game
 from battle_models import Move
 from battle_models import MoveSequence
 from battle_models import Boat
@@ -62,49 +91,7 @@ class BattleshipApi(remote.Service):
         """
         Send email to remind a user of games in progress.
         """
-
-        # Get a list of users with emails.
-        user_list = battle_users._getUsersWithEmails()
-
-        # If no users have emails, exit the method.
-        if not user_list:
-            return
-
-        for each_user in user_list:
-
-            # Narrow down the list to users that are involved in an active game.
-            game_list = battle_game._getListOfGamesForUser(each_user.key)
-
-            # If this user is not involved in an active game, skip to the next
-            # user.
-            if not game_list:
-                continue
-
-            for each_game in game_list:
-
-                # Determine if the user made the last move.
-                last_move = battle_game._getGameLastMove(each_game.key)
-
-                # If the user made the last move there's no need
-                # to notify them via email, skip to the next game.
-                if last_move.user_id == each_user.key:
-                    continue
-
-                # If the user did not make the last move add
-                # an email notification to the task queue.
-
-                # Get the name of the opponent.
-                opponent = battle_users._getUserViaWebsafeKey(
-                    last_move.user_id.urlsafe())
-
-                # Send email to remind a user of games in progress.
-                mail.send_mail(
-                    'noreply@%s.appspotmail.com' % (
-                        app_identity.get_application_id()),          # from
-                    each_user.email,                                 # to
-                    'Battleship Game is waiting for your move ...',  # subject
-                    'Hey there! %s is waiting for you to make a move!' % opponent.user_name
-                )
+        battle_reminders._sendEmailReminders()
 
     @endpoints.method(USER_POST_REQUEST,
                       StringMessage,
@@ -112,6 +99,7 @@ class BattleshipApi(remote.Service):
                       path='createUser',
                       http_method='POST'
                       )
+    @battle_profile.profiled
     def create_user(self, request):
         """
         Create a User. Username is required. Username must be unique.
@@ -134,6 +122,7 @@ class BattleshipApi(remote.Service):
                       path='newGame',
                       http_method='POST'
                       )
+    @battle_profile.profiled
     def new_game(self, request):
         """
         Create a new game.
@@ -142,11 +131,13 @@ class BattleshipApi(remote.Service):
         user2_key = battle_utils._getNDBKey(request.websafe_username2_key)
 
         # Ensure the users exist.
-        if not user1_key.get():
+        user1 = user1_key.get()
+        if not user1:
             raise endpoints.BadRequestException(
                 'websafe_username1_key does not exist.')
 
-        if not user2_key.get():
+        user2 = user2_key.get()
+        if not user2:
             raise endpoints.BadRequestException(
                 'websafe_username2_key does not exist.')
 
@@ -159,19 +150,26 @@ class BattleshipApi(remote.Service):
             raise endpoints.BadRequestException(
                 'A game is currently in progress for these users.')
 
-        # Create a new game.
-        a_new_game = Game(
-            user1=user1_key,
-            user2=user2_key,
-            status=0,  # In Progress
-        )
-        game_key = a_new_game.put()
+        # Create a new game and both users' boats. The boats are saved
+        # first so the game is never seen without them.
+        game_key = battle_game._newGameKeys(1)[0]
+        a_new_game, new_boats = battle_game._buildNewGame(game_key,
+                                                          user1,
+                                                          user2)
+        ndb.put_multi(new_boats)
+
+        # Save the game, unless a game was started for these users since
+        # the check above.
+        if not battle_game._startGameAsync(a_new_game).get_result():
+            ndb.delete_multi([each_boat.key for each_boat in new_boats])
+            raise endpoints.BadRequestException(
+                'A game is currently in progress for these users.')
 
-        # Auto-generate all boats on user 1's board.
-        battle_boat._generateBoardAndBoats(game_key, user1_key)
+        # The users' cached responses no longer match.
+        battle_cache._bumpVersions(battle_cache._userVersion(user1_key),
+                                   battle_cache._userVersion(user2_key))
 
-        # Auto-generate all boats on user 2's board.
-        battle_boat._generateBoardAndBoats(game_key, user2_key)
+        battle_counters._incrementCounters(games_started=1)
 
         return StringMessage(message='Game was successfully created! Websafe Key: {}'.format(game_key.urlsafe()))
 
@@ -181,6 +179,7 @@ class BattleshipApi(remote.Service):
                       path='cancelGame',
                       http_method='POST'
                       )
+    @battle_profile.profiled
     def cancel_game(self, request):
         """
         Cancel a game that's in progress.
@@ -196,8 +195,25 @@ class BattleshipApi(remote.Service):
             return StringMessage(message='Game is already finished, cannot cancel.')
 
         # Set the status of the game to cancelled.
-        current_game.status = 2
-        current_game.put()
+        current_game = battle_game._endGame(current_game.key, 2)
+
+        # Notify if the game ended since it was read.
+        if current_game is None:
+            return StringMessage(message='Game has already ended, cannot cancel.')
+
+        # Cached responses for the game and its users no longer match.
+        battle_cache._bumpVersions(
+            battle_cache._gameVersion(current_game.key),
+            battle_cache._userVersion(current_game.user1),
+            battle_cache._userVersion(current_game.user2))
+
+        # Let anyone streaming this game know it was cancelled.
+        battle_events._publishGameEvent(current_game.key, {
+            'type': 'status',
+            'game_status': current_game.status
+        })
+
+        battle_counters._incrementCounters(games_cancelled=1)
 
         return StringMessage(message='Game was successfully cancelled.')
 
@@ -207,15 +223,17 @@ class BattleshipApi(remote.Service):
                       path='getUserGames',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_user_games(self, request):
         """Return all active games for a user."""
         user_key = battle_utils._getNDBKey(request.websafe_user_key)
 
-        games = battle_game._getListOfGamesForUser(user_key)
+        games = battle_game._getListOfGamesForUser(user_key).fetch()
+        player_names = battle_game._getPlayerNames(games)
 
         return ListOfGames(
             all_games=[battle_game._copyGameToList(
-                each_game) for each_game in games]
+                each_game, names) for each_game, names in zip(games, player_names)]
         )
 
     @endpoints.method(MOVE_POST_REQUEST,
@@ -224,9 +242,17 @@ class BattleshipApi(remote.Service):
                       path='makeMove',
                       http_method='POST'
                       )
+    @battle_profile.profiled
     def make_move(self, request):
         """Make a move. Requires game ID, user ID, row and col."""
 
+        # Turn away users and games making moves too quickly before
+        # doing any datastore work.
+        if not battle_throttle._admitMove(request.websafe_user_key,
+                                          request.websafe_game_key):
+            raise endpoints.ForbiddenException(
+                'Too many moves, please slow down.')
+
         # Validate that the game exists and get Game object.
         current_game = battle_game._validateAndGetGame(request.websafe_game_key)
         game_key = battle_utils._getNDBKey(request.websafe_game_key)
@@ -236,14 +262,6 @@ class BattleshipApi(remote.Service):
         selected_user = battle_users._getUserViaWebsafeKey(
             request.websafe_user_key)
 
-        # Get the last move in the game to ensure that it is this users' turn.
-        game_last_move = battle_game._getGameLastMove(game_key)
-
-        if game_last_move:
-            if game_last_move.user_id == user_key:
-                return StringMessage(
-                    message='It''s not your turn yet, please wait for the other player to make a move.')
-
         # Validate the row.
         my_row = request.row.upper()
 
@@ -258,14 +276,37 @@ class BattleshipApi(remote.Service):
             raise endpoints.BadRequestException(
                 'That was not a valid column. Valid columns are 1-10 inclusive.')
 
-        return_message = ''
-
         # Get the opponents' key so we can determine if a move has hit a boat.
         if current_game.user1 == user_key:
             opponent_key = current_game.user2
         else:
             opponent_key = current_game.user1
 
+        # Games from before the turn was stored on the Game fall back to
+        # the last move in the game to ensure that it is this users' turn.
+        if current_game.last_move_at is None:
+            game_last_move = battle_game._getGameLastMove(game_key)
+
+            if game_last_move:
+                if game_last_move.user_id == user_key:
+                    return StringMessage(
+                        message='It''s not your turn yet, please wait for the other player to make a move.')
+
+        # Ensure that it is this users' turn and pass the turn to the
+        # opponent in the same transaction.
+        current_game = battle_game._claimTurn(game_key, user_key, opponent_key,
+                                              my_row, my_col)
+
+        if current_game is None:
+            return StringMessage(
+                message='It''s not your turn yet, please wait for the other player to make a move.')
+
+        if current_game.status != 0:
+            raise endpoints.BadRequestException('Game is not in progress.')
+
+        return_message = ''
+        game_won = False
+
         # Get the next move sequence. The sequence is used to generate
         # the game history.
         internal_move_counter = MoveSequence.query().get()
@@ -334,11 +375,18 @@ class BattleshipApi(remote.Service):
                                                    ):
                         a_new_move.sunk += 1
 
-                        current_game.status = 1  # Finished
-                        current_game.winner = user_key
-                        current_game.put()
-
-                        return_message = 'You won!'
+                        finished_game = battle_game._endGame(
+                            game_key, 1, user_key)  # Finished
+
+                        if finished_game is not None:
+                            current_game = finished_game
+                            game_won = True
+                            return_message = 'You won!'
+                        else:
+                            # The game was cancelled while this move
+                            # was being made.
+                            current_game = game_key.get()
+                            return_message = 'That was a hit, but the game has already ended.'
                     else:
                         # The move has sunk a boat! Notify the user.
                         a_new_move.sunk += 1
@@ -369,10 +417,41 @@ class BattleshipApi(remote.Service):
         # Save the Move.
         a_new_move.put()
 
+        # Only now that the Move and any Boat hit are saved does the game
+        # get a new version.
+        battle_game._bumpGameVersion(game_key)
+
         # Increment the sequence and save that too.
         internal_move_counter.current_sequence += 1
         internal_move_counter.put()
 
+        # Cached responses for the game no longer match. Once the game is
+        # won the scores and rankings change as well.
+        if game_won:
+            battle_cache._bumpVersions(
+                battle_cache._gameVersion(game_key),
+                battle_cache._userVersion(current_game.user1),
+                battle_cache._userVersion(current_game.user2),
+                battle_cache.RANKINGS_VERSION)
+        else:
+            battle_cache._bumpVersions(battle_cache._gameVersion(game_key))
+
+        # Let anyone streaming this game know about the move.
+        battle_events._publishGameEvent(game_key, {
+            'type': 'move',
+            'websafe_user_key_for_move': request.websafe_user_key,
+            'row': a_new_move.row,
+            'col': a_new_move.col,
+            'status': battle_game._getMoveStatusName(a_new_move.status),
+            'sequence': a_new_move.sequence,
+            'game_status': current_game.status
+        })
+
+        battle_counters._incrementCounters(
+            shots=1,
+            hits=1 if a_new_move.status == 1 else 0,
+            games_finished=1 if game_won else 0)
+
         return StringMessage(message=return_message)
 
     @endpoints.method(GET_GAME_HISTORY_REQUEST,
@@ -381,16 +460,98 @@ class BattleshipApi(remote.Service):
                       path='getGameHistory',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_game_history(self, request):
         """Get a list of all moves for a game."""
-        game_key = battle_utils._getNDBKey(request.websafe_game_key)
+        game_key = battle_utils._getValidNDBKey(request.websafe_game_key,
+                                                'Game')
 
-        moves = battle_game._getAllMovesForAGame(game_key)
+        # Only the Game is read if the client already has this version.
+        if battle_game._gameIsUnchanged(game_key, request.if_version):
+            return ListOfMoves(version=request.if_version, not_modified=True)
 
-        return ListOfMoves(
-            all_moves=[battle_game._copyMoveToList(
-                each_move) for each_move in moves]
-        )
+        def build_response():
+            selected_game = battle_game._validateAndGetGame(
+                request.websafe_game_key)
+
+            # Archived games keep their moves in the archive blob.
+            if selected_game.archive is not None:
+                moves = battle_archive._getArchivedMoves(selected_game)
+            else:
+                moves = battle_game._getAllMovesForAGame(game_key).fetch()
+
+            # A history missing a move is sent without a version, so it is
+            # neither cached nor matched by if_version.
+            version = None
+            if battle_game._movesAreComplete(selected_game, moves):
+                version = selected_game.version
+
+            return ListOfMoves(
+                all_moves=[battle_game._copyMoveToList(
+                    each_move) for each_move in moves],
+                version=version
+            )
+
+        # The history only changes when the game changes.
+        return battle_cache._cachedResponse(
+            'get_game_history',
+            game_key.urlsafe(),
+            [battle_cache._gameVersion(game_key)],
+            ListOfMoves,
+            build_response,
+            cacheable=lambda response: response.version is not None)
+
+    @endpoints.method(GET_GAME_HISTORY_REQUEST,
+                      CompactMoves,
+                      name='get_compact_game_history',
+                      path='getCompactGameHistory',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_compact_game_history(self, request):
+        """Get all moves for a game, packed into two bytes per move."""
+        game_key = battle_utils._getValidNDBKey(request.websafe_game_key,
+                                                'Game')
+
+        # Only the Game is read if the client already has this version.
+        if battle_game._gameIsUnchanged(game_key, request.if_version):
+            return CompactMoves(version=request.if_version, not_modified=True)
+
+        def build_response():
+            selected_game = battle_game._validateAndGetGame(
+                request.websafe_game_key)
+
+            # Archived games keep their moves in the archive blob.
+            if selected_game.archive is not None:
+                moves = battle_archive._getArchivedMoves(selected_game)
+            else:
+                moves = battle_game._getAllMovesForAGame(game_key).fetch()
+
+            # A history missing a move is sent without a version, so it is
+            # neither cached nor matched by if_version.
+            version = None
+            if battle_game._movesAreComplete(selected_game, moves):
+                version = selected_game.version
+
+            return CompactMoves(
+                websafe_user1_key=selected_game.user1.urlsafe(),
+                websafe_user2_key=selected_game.user2.urlsafe(),
+                moves=battle_board._packMoves(
+                    [(0 if each_move.user_id == selected_game.user1 else 1,
+                      battle_board._cellIndex(each_move.row, each_move.col),
+                      each_move.status) for each_move in moves]),
+                move_count=len(moves),
+                version=version
+            )
+
+        # The history only changes when the game changes.
+        return battle_cache._cachedResponse(
+            'get_compact_game_history',
+            game_key.urlsafe(),
+            [battle_cache._gameVersion(game_key)],
+            CompactMoves,
+            build_response,
+            cacheable=lambda response: response.version is not None)
 
     @endpoints.method(GET_GAME_STATE,
                       ReturnGameState,
@@ -398,26 +559,75 @@ class BattleshipApi(remote.Service):
                       path='getGameState',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_game(self, request):
         """Returns the current state of the game ie. Username : Hits 3 : Miss 12 : Sunk 0"""
+        game_key = battle_utils._getValidNDBKey(request.websafe_game_key,
+                                                'Game')
+
+        # Only the Game is read if the client already has this version.
+        if battle_game._gameIsUnchanged(game_key, request.if_version):
+            return ReturnGameState(version=request.if_version, not_modified=True)
+
+        def build_response():
+            # Get the game info.
+            selected_game = battle_game._validateAndGetGame(
+                request.websafe_game_key)
+
+            user_states = []
+
+            # Get game state for user 1.
+            user_states.append(battle_game._getGameStateForUser(
+                game_key, selected_game, 1))
+
+            # Get game state for user 2.
+            user_states.append(battle_game._getGameStateForUser(
+                game_key, selected_game, 2))
+
+            # Return the pre-formatted state messages.
+            return ReturnGameState(user_states=[StringMessage(message=each_state) for each_state in user_states],
+                                   version=selected_game.version)
+
+        # The state only changes when the game changes.
+        return battle_cache._cachedResponse(
+            'get_game',
+            game_key.urlsafe(),
+            [battle_cache._gameVersion(game_key)],
+            ReturnGameState,
+            build_response)
+
+    @endpoints.method(GET_GAMES_STATE,
+                      ListOfGameStates,
+                      name='get_games_state',
+                      path='getGamesState',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_games_state(self, request):
+        """Returns the current state of many games in one call."""
+        if len(request.websafe_game_keys) > battle_consts.GAMES_STATE_MAX:
+            raise endpoints.BadRequestException(
+                'At most {} games can be requested at once.'.format(
+                    battle_consts.GAMES_STATE_MAX))
 
-        # Get the game info and the game key.
-        selected_game = battle_game._validateAndGetGame(
-            request.websafe_game_key)
-        game_key = battle_utils._getNDBKey(request.websafe_game_key)
+        game_keys = [battle_utils._getValidNDBKey(websafe_game_key, 'Game')
+                     for websafe_game_key in request.websafe_game_keys]
 
-        user_states = []
+        # Get all the games in one read.
+        games = ndb.get_multi(game_keys)
 
-        # Get game state for user 1.
-        user_states.append(battle_game._getGameStateForUser(
-            game_key, selected_game, 1))
+        if None in games:
+            raise endpoints.BadRequestException(
+                'One or more games do not exist.')
 
-        # Get game state for user 2.
-        user_states.append(battle_game._getGameStateForUser(
-            game_key, selected_game, 2))
+        all_states = battle_game._getGamesState(games)
 
-        # Return the pre-formatted state messages.
-        return ReturnGameState(user_states=[StringMessage(message=each_state) for each_state in user_states])
+        return ListOfGameStates(games=[
+            SingleGameState(websafe_game_key=each_game.key.urlsafe(),
+                            status=each_game.status,
+                            user_states=[StringMessage(message=each_state)
+                                         for each_state in game_states])
+            for each_game, game_states in zip(games, all_states)])
 
     @endpoints.method(GET_BOAT_LIST,
                       ListOfBoats,
@@ -425,22 +635,43 @@ class BattleshipApi(remote.Service):
                       path='getUserBoats',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_user_boats(self, request):
         """Get a list of a users' boat coordinates for a game."""
 
-        # Get the game key.
-        battle_game._validateAndGetGame(request.websafe_game_key)
-        game_key = battle_utils._getNDBKey(request.websafe_game_key)
+        # Only the Game is read if the client already has this version.
+        game_key = battle_utils._getValidNDBKey(request.websafe_game_key,
+                                                'Game')
+        if battle_game._gameIsUnchanged(game_key, request.if_version):
+            return ListOfBoats(version=request.if_version, not_modified=True)
+
+        # Get the game.
+        selected_game = battle_game._validateAndGetGame(
+            request.websafe_game_key)
 
         # Get the user key.
         battle_users._getUserViaWebsafeKey(request.websafe_user_key)
         user_key = battle_utils._getNDBKey(request.websafe_user_key)
 
-        # Grab all the boat coords for this user for the game.
-        boat_list = Boat.query(Boat.game_id == game_key,
-                               Boat.user_id == user_key).order(Boat.boat_type, Boat.col, Boat.row)
+        version = selected_game.version
+
+        # Grab all the boat coords for this user for the game. Archived
+        # games keep their boats in the archive blob.
+        if selected_game.archive is not None:
+            boat_list = battle_archive._getArchivedBoats(selected_game,
+                                                         user_key)
+        else:
+            boat_list = Boat.query(Boat.game_id == game_key,
+                                   Boat.user_id == user_key).order(Boat.boat_type, Boat.col, Boat.row).fetch()
 
-        return ListOfBoats(all_boats=[battle_boat._copyBoatToList(each_boat) for each_boat in boat_list])
+            # Don't give a version to boats that are missing a hit, the
+            # client would keep them as the boats for this version.
+            if not battle_game._boatsAreComplete(selected_game, user_key,
+                                                 boat_list):
+                version = None
+
+        return ListOfBoats(all_boats=[battle_boat._copyBoatToList(each_boat) for each_boat in boat_list],
+                           version=version)
 
     @endpoints.method(GET_USER_SCORE,
                       StringMessage,
@@ -448,10 +679,29 @@ class BattleshipApi(remote.Service):
                       path='getUserScore',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_user_score(self, request):
         """Get the number of games that a user has won and lost."""
-        user_score = battle_users._getUserScore(request.websafe_user_key)
-        return StringMessage(message=battle_users._getUserScoreMessage(user_score))
+        user_key = battle_utils._getValidNDBKey(request.websafe_user_key,
+                                                'User')
+
+        complete = []
+
+        def build_response():
+            user_score = battle_users._getUserScore(request.websafe_user_key)
+            complete.append(battle_users._scoreIsComplete(user_key,
+                                                          user_score))
+            return StringMessage(message=battle_users._getUserScoreMessage(user_score))
+
+        # The score only changes when one of the users' games changes. A
+        # score missing a game that was just finished isn't cached.
+        return battle_cache._cachedResponse(
+            'get_user_score',
+            user_key.urlsafe(),
+            [battle_cache._userVersion(user_key)],
+            StringMessage,
+            build_response,
+            cacheable=lambda response: all(complete))
 
     @endpoints.method(message_types.VoidMessage,
                       ListOfRankings,
@@ -459,36 +709,335 @@ class BattleshipApi(remote.Service):
                       path='getUserRankings',
                       http_method='GET'
                       )
+    @battle_profile.profiled
     def get_user_rankings(self, request):
         """Get a list of users ordered by wins/losses."""
-        all_rankings = []
 
-        # Get a list of all users.
-        all_users = User.query()
+        complete = []
+
+        def build_response():
+            all_rankings = []
+
+            # Get a list of all users.
+            all_users = User.query()
+
+            # Iterate through the users.
+            for each_user in all_users:
+                # Get the users' score.
+                single_rank = battle_users._getUserScore(each_user.key.urlsafe())
+                complete.append(battle_users._scoreIsComplete(each_user.key,
+                                                              single_rank))
+
+                # Only include the user if they've actually played a game.
+                if (single_rank[1] == 0) and (single_rank[2] == 0):
+                    continue
+
+                # Save the score to the main list.
+                all_rankings.append(single_rank)
+
+            # Sort the list by losses ascending first ie. loss 1, loss 5, loss 8
+            all_rankings = sorted(all_rankings,
+                                  key=itemgetter(2))
+
+            # Then sort it by wins descending ie. wins 10, wins 2, wins 1
+            all_rankings = sorted(all_rankings,
+                                  key=itemgetter(1),
+                                  reverse=True)
+
+            # Return the user rankings.
+            return ListOfRankings(rankings=[StringMessage(message=battle_users._getUserScoreMessage(each_rank)) for each_rank in all_rankings])
+
+        # The rankings only change when a game is finished. Rankings missing
+        # a game that was just finished aren't cached.
+        return battle_cache._cachedResponse(
+            'get_user_rankings',
+            '',
+            [battle_cache.RANKINGS_VERSION],
+            ListOfRankings,
+            build_response,
+            cacheable=lambda response: all(complete))
+
+    @endpoints.method(GET_BOARD_AT,
+                      BoardAtMove,
+                      name='get_board_at',
+                      path='getBoardAt',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_board_at(self, request):
+        """Get both boards of a game as they were after a number of moves."""
+        selected_game = battle_game._validateAndGetGame(
+            request.websafe_game_key)
+
+        total_moves = battle_replay._getMoveCount(selected_game)
+
+        if request.move_index < 0 or request.move_index > total_moves:
+            raise endpoints.BadRequestException(
+                'move_index must be between 0 and {}.'.format(total_moves))
+
+        board1, board2 = battle_replay._getBoardsAt(selected_game,
+                                                    request.move_index)
+
+        return BoardAtMove(move_index=request.move_index,
+                           total_moves=total_moves,
+                           user1=selected_game.user1.urlsafe(),
+                           user2=selected_game.user2.urlsafe(),
+                           board1=board1,
+                           board2=board2)
+
+    @endpoints.method(GET_BOARD_VIEW,
+                      BoardView,
+                      name='get_board_view',
+                      path='getBoardView',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_board_view(self, request):
+        """Get a users' own board, their target board and the scoreboard."""
+        selected_game = battle_game._validateAndGetGame(
+            request.websafe_game_key)
+        user_key = battle_utils._getValidNDBKey(request.websafe_user_key,
+                                                'User')
+
+        board1, board2 = battle_replay._getCurrentBoards(selected_game)
+
+        # The user sees all of their own board but only the shots they've
+        # made on their opponents' board.
+        if user_key == selected_game.user1:
+            own_board, opponent_board = board1, board2
+        elif user_key == selected_game.user2:
+            own_board, opponent_board = board2, board1
+        else:
+            raise endpoints.BadRequestException(
+                'User is not playing this game.')
+
+        # The names are on the Game, only older games read the users.
+        user1_name, user2_name = battle_game._getPlayerNames(
+            [selected_game])[0]
+
+        user_states = [
+            battle_game._getGameStateFromBoard(user1_name, board2),
+            battle_game._getGameStateFromBoard(user2_name, board1)
+        ]
+
+        next_to_move = None
+        if selected_game.next_to_move is not None:
+            next_to_move = selected_game.next_to_move.urlsafe()
+
+        return BoardView(
+            own_board=own_board,
+            target_board=battle_board._targetView(opponent_board),
+            user_states=[StringMessage(message=each_state)
+                         for each_state in user_states],
+            status=selected_game.status,
+            next_to_move=next_to_move)
+
+    @endpoints.method(MATCHMAKING_REQUEST,
+                      StringMessage,
+                      name='join_matchmaking',
+                      path='joinMatchmaking',
+                      http_method='POST'
+                      )
+    @battle_profile.profiled
+    def join_matchmaking(self, request):
+        """Wait to be paired with another user for a new game."""
+        # Validate that the user exists.
+        battle_users._getUserViaWebsafeKey(request.websafe_user_key)
+        user_key = battle_utils._getValidNDBKey(request.websafe_user_key,
+                                                'User')
+
+        if not battle_matchmaking._joinQueue(user_key):
+            return StringMessage(message='You are already waiting for a game.')
+
+        return StringMessage(
+            message='You are waiting for a game. Use get_matchmaking_status to find your game.')
 
-        # Iterate through the users.
-        for each_user in all_users:
-            # Get the users' score.
-            single_rank = battle_users._getUserScore(each_user.key.urlsafe())
+    @endpoints.method(MATCHMAKING_REQUEST,
+                      MatchmakingStatus,
+                      name='get_matchmaking_status',
+                      path='getMatchmakingStatus',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_matchmaking_status(self, request):
+        """Find out if a waiting user has been paired, and with which game."""
+        user_key = battle_utils._getValidNDBKey(request.websafe_user_key,
+                                                'User')
+
+        entry = battle_matchmaking._getEntry(user_key)
+
+        if entry is None:
+            return MatchmakingStatus(status='Not waiting')
+
+        if entry.status == 0:
+            return MatchmakingStatus(status='Waiting')
+
+        return MatchmakingStatus(status='Matched',
+                                 websafe_game_key=entry.game.urlsafe(),
+                                 websafe_opponent_key=entry.opponent.urlsafe())
+
+    @endpoints.method(NEW_TOURNAMENT_REQUEST,
+                      StringMessage,
+                      name='create_tournament',
+                      path='createTournament',
+                      http_method='POST'
+                      )
+    @battle_profile.profiled
+    def create_tournament(self, request):
+        """Create a round robin tournament; every player plays every other player."""
+        user_keys = [battle_utils._getValidNDBKey(websafe_user_key, 'User')
+                     for websafe_user_key in request.websafe_user_keys]
+
+        error = battle_tournament._validatePlayers(user_keys)
+        if error:
+            raise endpoints.BadRequestException(error)
+
+        tournament_key = battle_tournament._createTournament(request.name,
+                                                             user_keys)
+
+        return StringMessage(message='Tournament was successfully created! Websafe Key: {}'.format(tournament_key.urlsafe()))
+
+    @endpoints.method(GET_TOURNAMENT_STANDINGS,
+                      TournamentStandings,
+                      name='get_tournament_standings',
+                      path='getTournamentStandings',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_tournament_standings(self, request):
+        """Get the standings of a tournament ordered by wins."""
+        tournament_key = battle_utils._getValidNDBKey(
+            request.websafe_tournament_key, 'Tournament')
+        tournament = tournament_key.get()
+
+        if tournament is None:
+            raise endpoints.BadRequestException('Tournament does not exist.')
+
+        standings, games_finished = battle_tournament._getStandings(
+            tournament)
+
+        # Get all players' names in one read.
+        players = ndb.get_multi([standing[0] for standing in standings])
+
+        return TournamentStandings(
+            standings=[StringMessage(message='{} : Played {} : Wins {} : Losses {}'.format(
+                each_player.user_name, played, won, played - won))
+                for each_player, (user_key, played, won) in zip(players, standings)],
+            games_finished=games_finished,
+            games_total=tournament.total_games,
+            games_skipped=len(tournament.skipped_pairs))
 
-            # Only include the user if they've actually played a game.
-            if (single_rank[1] == 0) and (single_rank[2] == 0):
-                continue
+    @endpoints.method(message_types.VoidMessage,
+                      ShotAnalyticsReport,
+                      name='get_shot_analytics',
+                      path='getShotAnalytics',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_shot_analytics(self, request):
+        """Get shot heatmaps and the average shots to sink each boat type."""
+
+        def build_response():
+            analytics = battle_analytics._getLatestAnalytics()
+
+            if analytics is None:
+                raise endpoints.NotFoundException(
+                    'Shot analytics have not been run yet.')
+
+            return ShotAnalyticsReport(
+                heatmaps=[Heatmap(name=name, cells=cells) for name, cells
+                          in battle_analytics._getHeatmaps(analytics)],
+                sink_stats=[BoatSinkStats(boat_type=boat_name,
+                                          boats_sunk=boats_sunk,
+                                          average_shots=average_shots)
+                            for boat_name, boats_sunk, average_shots
+                            in battle_analytics._getSinkStats(analytics)],
+                games=analytics.games,
+                moves=analytics.moves,
+                updated=str(analytics.updated))
+
+        # The figures only change when the job finishes a run.
+        return battle_cache._cachedResponse(
+            'get_shot_analytics',
+            '',
+            [battle_cache.ANALYTICS_VERSION],
+            ShotAnalyticsReport,
+            build_response)
 
-            # Save the score to the main list.
-            all_rankings.append(single_rank)
+    @endpoints.method(message_types.VoidMessage,
+                      GlobalStats,
+                      name='get_global_stats',
+                      path='getGlobalStats',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_global_stats(self, request):
+        """Get the number of games played and in progress and the shots fired."""
+        totals = battle_counters._getCounterTotals()
+
+        games_ended = (totals[battle_counters.GAMES_FINISHED] +
+                       totals[battle_counters.GAMES_CANCELLED])
+
+        return GlobalStats(
+            games_played=totals[battle_counters.GAMES_FINISHED],
+            games_in_progress=(totals[battle_counters.GAMES_STARTED] -
+                               games_ended),
+            games_cancelled=totals[battle_counters.GAMES_CANCELLED],
+            shots=totals[battle_counters.SHOTS],
+            hits=totals[battle_counters.HITS],
+            hit_ratio=(float(totals[battle_counters.HITS]) /
+                       max(totals[battle_counters.SHOTS], 1)))
+
+    @endpoints.method(GET_SHOT_HINT,
+                      ShotHint,
+                      name='get_shot_hint',
+                      path='getShotHint',
+                      http_method='GET'
+                      )
+    @battle_profile.profiled
+    def get_shot_hint(self, request):
+        """Get the chance of a boat in each cell and the best next shot."""
+        selected_game = battle_game._validateAndGetGame(
+            request.websafe_game_key)
+        user_key = battle_utils._getValidNDBKey(request.websafe_user_key,
+                                                'User')
 
-        # Sort the list by losses ascending first ie. loss 1, loss 5, loss 8
-        all_rankings = sorted(all_rankings,
-                              key=itemgetter(2))
+        if user_key not in (selected_game.user1, selected_game.user2):
+            raise endpoints.BadRequestException(
+                'User is not playing this game.')
 
-        # Then sort it by wins descending ie. wins 10, wins 2, wins 1
-        all_rankings = sorted(all_rankings,
-                              key=itemgetter(1),
-                              reverse=True)
+        move_count = battle_replay._getMoveCount(selected_game)
 
-        # Return the user rankings.
-        return ListOfRankings(rankings=[StringMessage(message=battle_users._getUserScoreMessage(each_rank)) for each_rank in all_rankings])
+        def build_response():
+            board1, board2 = battle_replay._getCurrentBoards(selected_game)
+            if user_key == selected_game.user1:
+                opponent_board = board2
+            else:
+                opponent_board = board1
+
+            probabilities, samples = battle_hint._getShotProbabilities(
+                opponent_board)
+
+            best_cell = max(range(len(probabilities)),
+                            key=lambda cell_index: probabilities[cell_index])
+            row, col = battle_board._cellRowCol(best_cell)
+
+            return ShotHint(probabilities=probabilities,
+                            row=row,
+                            col=col,
+                            samples=samples,
+                            move_count=move_count)
+
+        # A position is the same until the next move, so the hint is cached
+        # by the number of moves made.
+        return battle_cache._cachedResponse(
+            'get_shot_hint',
+            '{}:{}:{}'.format(selected_game.key.urlsafe(),
+                              user_key.urlsafe(),
+                              move_count),
+            [],
+            ShotHint,
+            build_response)
 
 
 api = endpoints.api_server([BattleshipApi])  # Register API
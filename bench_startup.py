@@ -0,0 +1,101 @@
+"""
+
+Measure how long each module of the app takes to import on a cold start.
+
+Every module is imported in a fresh interpreter, so the time includes
+everything the module pulls in, just like on a new App Engine instance.
+
+Usage:
+  python bench_startup.py --sdk <path to google_appengine> [--runs 5]
+
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+MODULES = [
+    'battle_consts',
+    'battle_models',
+    'battle_utils',
+    'battle_users',
+    'battle_archive',
+    'battle_game',
+    'battle_boat',
+    'battle_events',
+    'battle_cache',
+    'battle_throttle',
+    'battle_reminders',
+    'battle_board',
+    'battle_replay',
+    'battle_matchmaking',
+    'battle_profile',
+    'battle_tournament',
+    'battle_analytics',
+    'battle_hint',
+    'battle_expiry',
+    'battle_counters',
+    'battle_deletion',
+    'battle_backfill',
+    'battle_messages',
+    'battle_containers',
+    'crons',
+    'main',
+    'battleship',
+]
+
+IMPORT_SCRIPT = '''
+import sys
+sys.path.insert(0, %(sdk)r)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, %(app)r)
+import time
+start = time.time()
+import %(module)s
+sys.stdout.write('%%f' %% (time.time() - start))
+'''
+
+
+def _timeImport(module, sdk_path, app_path):
+    """
+    Import a module in a fresh interpreter.
+
+    Args:
+      module: the name of the module to import.
+      sdk_path: the path to the App Engine SDK.
+      app_path: the path to the app.
+
+    Returns:
+      The number of seconds the import took.
+    """
+    script = IMPORT_SCRIPT % {'sdk': sdk_path, 'app': app_path,
+                              'module': module}
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sdk', required=True,
+                        help='path to the google_appengine SDK directory')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of cold imports per module')
+    args = parser.parse_args()
+
+    app_path = os.path.dirname(os.path.abspath(__file__))
+
+    print '%-20s %10s %10s' % ('module', 'best ms', 'median ms')
+    for module in MODULES:
+        times = sorted(_timeImport(module, args.sdk, app_path)
+                       for run in range(args.runs))
+        print '%-20s %10.1f %10.1f' % (module,
+                                       times[0] * 1000,
+                                       times[len(times) // 2] * 1000)
+
+
+if __name__ == '__main__':
+    main()
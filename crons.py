@@ -0,0 +1,174 @@
+"""
+
+Google App Engine HTTP handlers for cron jobs, tasks and instance warmup.
+
+This module only imports the datastore helpers the jobs need, not the
+endpoints API, so a new instance started for a cron job is ready sooner.
+
+"""
+
+
+import webapp2
+
+import battle_analytics
+import battle_archive
+import battle_backfill
+import battle_cache
+import battle_counters
+import battle_deletion
+import battle_events
+import battle_expiry
+import battle_matchmaking
+import battle_tournament
+import battle_utils
+import battle_reminders
+
+
+class SendEmailReminderHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Send an email to remind a user of games in progress.
+        """
+        battle_reminders._sendEmailReminders()
+        self.response.set_status(204)  # 204 = no content
+
+
+class CompactGamesHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Fold the moves and boats of completed games into an archive.
+        """
+        battle_archive._compactFinishedGames()
+        self.response.set_status(204)  # 204 = no content
+
+
+class MatchPlayersHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Pair users waiting in the matchmaking queue and create their games.
+        """
+        battle_matchmaking._pairWaitingUsers()
+        self.response.set_status(204)  # 204 = no content
+
+
+class ShotAnalyticsHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Start a run of the shot analytics job.
+        """
+        battle_analytics._startShotAnalytics()
+        self.response.set_status(204)  # 204 = no content
+
+
+class ExpireGamesHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Cancel games in progress that have gone without a move for too long.
+        """
+        battle_expiry._expireStaleGames()
+        self.response.set_status(204)  # 204 = no content
+
+
+class CreateTournamentGamesHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Create the games for a chunk of a tournaments' pairings.
+        """
+        battle_tournament._createTournamentGames(
+            battle_utils._getNDBKey(self.request.get('tournament')),
+            int(self.request.get('start')),
+            int(self.request.get('end')))
+        self.response.set_status(204)  # 204 = no content
+
+
+class ShotAnalyticsTaskHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Carry on the shot analytics job from where the last task stopped.
+        """
+        battle_analytics._runShotAnalytics(int(self.request.get('step')))
+        self.response.set_status(204)  # 204 = no content
+
+
+class ExpireGamesTaskHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Carry on cancelling stale games from where the last batch stopped.
+        """
+        battle_expiry._expireStaleGames(self.request.get('cursor'))
+        self.response.set_status(204)  # 204 = no content
+
+
+class DeleteUserTaskHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Delete the next batch of a deleted users' data.
+        """
+        battle_deletion._deleteUserData(
+            battle_utils._getNDBKey(self.request.get('user')),
+            self.request.get('phase'),
+            self.request.get('cursor'))
+        self.response.set_status(204)  # 204 = no content
+
+
+class BackfillGamesTaskHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Carry on the game backfill from where the last batch stopped.
+        """
+        battle_backfill._backfillGames(self.request.get('cursor'))
+        self.response.set_status(204)  # 204 = no content
+
+
+class SeedCountersTaskHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Carry on the counter seed from where the last batch stopped.
+        """
+        counted = dict((counter_name, int(self.request.get(counter_name, 0)))
+                       for counter_name in battle_counters.COUNTER_NAMES)
+        battle_backfill._countGames(self.request.get('cursor'), counted)
+        self.response.set_status(204)  # 204 = no content
+
+
+class WarmupHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Load the API and build caches before the instance takes traffic.
+        """
+        # Importing the API builds the endpoints API server, which is
+        # battleship.api.
+        import battleship
+        battleship.api
+
+        battle_events._getPubSub()
+        battle_cache._getBackend()
+        self.response.set_status(204)  # 204 = no content
+
+
+app = webapp2.WSGIApplication([
+    ('/crons/send_email_reminder', SendEmailReminderHandler),
+    ('/crons/compact_games', CompactGamesHandler),
+    ('/crons/match_players', MatchPlayersHandler),
+    ('/crons/shot_analytics', ShotAnalyticsHandler),
+    ('/crons/expire_games', ExpireGamesHandler),
+    ('/tasks/create_tournament_games', CreateTournamentGamesHandler),
+    ('/tasks/shot_analytics', ShotAnalyticsTaskHandler),
+    ('/tasks/expire_games', ExpireGamesTaskHandler),
+    ('/tasks/delete_user', DeleteUserTaskHandler),
+    ('/tasks/backfill_games', BackfillGamesTaskHandler),
+    ('/tasks/seed_counters', SeedCountersTaskHandler),
+    ('/_ah/warmup', WarmupHandler)
+], debug=True)
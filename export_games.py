@@ -0,0 +1,346 @@
+"""
+
+Export finished games, their moves and boats to columnar binary files.
+
+Each column is a file of fixed-width little-endian values, so a column
+can be memory-mapped with NumPy and scanned without any parsing:
+
+  games.game_id  games.user1  games.user2  games.winner  games.finished
+  games.move_start  games.move_count
+  moves.game_id  moves.player  moves.cell  moves.result  moves.sequence
+  boats.game_id  boats.player  boats.boat_type  boats.cell
+
+player is 0 for user1 and 1 for user2, cell is row * 10 + col - 1 (see
+battle_board) and result is the Move status. manifest.json lists the
+dtype and number of rows of every column.
+
+The datastore is read through remote_api. With --incremental only games
+finished since the last export are appended.
+
+This file is not deployed with the app (see skip_files in app.yaml).
+
+Usage:
+  python export_games.py --sdk <path to google_appengine> --app <app id>
+                         --out <directory> [--incremental]
+                         [--host localhost:8080]
+
+  # Then, in an analysis session;
+  from export_games import load
+  tables = load('<directory>')
+  hit_rate = (tables['moves']['result'] == 1).mean()
+
+"""
+
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy
+
+
+# dtype of every column, by table.
+COLUMNS = {
+    'games': [('game_id', '<i8'),
+              ('user1', '<i8'),
+              ('user2', '<i8'),
+              ('winner', 'u1'),  # 0 = user1, 1 = user2
+              ('finished', '<i8'),  # seconds since the epoch, 0 if unknown
+              ('move_start', '<i8'),  # first row of the game in moves
+              ('move_count', '<i4')],
+    'moves': [('game_id', '<i8'),
+              ('player', 'u1'),
+              ('cell', 'u1'),
+              ('result', 'u1'),  # 0 = miss, 1 = hit, 2 = duplicate
+              ('sequence', '<i8')],
+    'boats': [('game_id', '<i8'),
+              ('player', 'u1'),
+              ('boat_type', 'u1'),
+              ('cell', 'u1')],
+}
+
+MANIFEST = 'manifest.json'
+
+# Number of games read from the datastore at a time.
+EXPORT_BATCH = 50
+
+# A game's last move is saved just before the game is marked finished,
+# so games whose last move is more recent than this are left for the
+# next export in case they're still being finished.
+EXPORT_LAG = timedelta(minutes=1)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def load(directory):
+    """
+    Memory-map an export.
+
+    Args:
+      directory: the directory of the export.
+
+    Returns:
+      A dict of table name to a dict of column name to a read-only
+      numpy.memmap.
+    """
+    with open(os.path.join(directory, MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    tables = {}
+    for table, columns in COLUMNS.iteritems():
+        rows = manifest['rows'][table]
+        tables[table] = {}
+        for column, dtype in columns:
+            path = _columnPath(directory, table, column)
+            if rows == 0:
+                tables[table][column] = numpy.zeros(0, dtype=dtype)
+            else:
+                tables[table][column] = numpy.memmap(path, dtype=dtype,
+                                                     mode='r', shape=(rows,))
+    return tables
+
+
+def _columnPath(directory, table, column):
+    return os.path.join(directory, '{}.{}.bin'.format(table, column))
+
+
+def _newManifest():
+    return {'format': 1,
+            'columns': COLUMNS,
+            'rows': dict((table, 0) for table in COLUMNS),
+            'last_move_at': None}
+
+
+def _readManifest(directory):
+    """
+    Read the manifest of an earlier export.
+
+    Returns:
+      The manifest dict, or a new one if there's no export yet.
+    """
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return _newManifest()
+
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _writeManifest(directory, manifest):
+    """Replace the manifest in one step, so a reader never sees half."""
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def _openColumns(directory, manifest):
+    """
+    Open every column for appending.
+
+    Rows written after the manifest by an export that didn't finish are
+    cut off first.
+
+    Returns:
+      A dict of (table, column) to an open file.
+    """
+    files = {}
+    for table, columns in COLUMNS.iteritems():
+        for column, dtype in columns:
+            path = _columnPath(directory, table, column)
+            column_file = open(path, 'ab')
+            column_file.truncate(manifest['rows'][table] *
+                                 numpy.dtype(dtype).itemsize)
+            files[(table, column)] = column_file
+    return files
+
+
+def _appendRows(files, table, rows):
+    """
+    Append rows to a tables' columns.
+
+    Args:
+      files: the dict from _openColumns.
+      table: the table name.
+      rows: a list of tuples in the order of COLUMNS[table].
+    """
+    if not rows:
+        return
+    for index, (column, dtype) in enumerate(COLUMNS[table]):
+        values = numpy.array([row[index] for row in rows], dtype=dtype)
+        files[(table, column)].write(values.tostring())
+
+
+def _gameRows(batch):
+    """
+    Read the moves and boats of a batch of games.
+
+    The Move and Boat queries of every game that isn't archived are all
+    started before any of them is waited on.
+
+    Args:
+      batch: a list of finished Game objects.
+
+    Returns:
+      A list of (game, moves, boats) tuples.
+    """
+    from battle_models import Boat
+    from battle_models import Move
+
+    import battle_archive
+
+    pending = {}
+    for each_game in batch:
+        if each_game.archive is None:
+            pending[each_game.key] = (
+                Move.query(Move.game_id == each_game.key).order(
+                    Move.sequence).fetch_async(),
+                Boat.query(Boat.game_id == each_game.key).fetch_async())
+
+    results = []
+    for each_game in batch:
+        if each_game.archive is not None:
+            moves = battle_archive._getArchivedMoves(each_game)
+            boats = (battle_archive._getArchivedBoats(each_game,
+                                                      each_game.user1) +
+                     battle_archive._getArchivedBoats(each_game,
+                                                      each_game.user2))
+        else:
+            moves = pending[each_game.key][0].get_result()
+            boats = pending[each_game.key][1].get_result()
+        results.append((each_game, moves, boats))
+    return results
+
+
+def export(directory, incremental):
+    """
+    Export finished games.
+
+    Args:
+      directory: the directory to write the export to.
+      incremental: True to append games finished since the last export,
+        False to export every finished game from scratch.
+
+    Returns:
+      The number of games exported.
+    """
+    from battle_models import Game
+
+    import battle_board
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    manifest = _readManifest(directory) if incremental else _newManifest()
+    files = _openColumns(directory, manifest)
+
+    until = datetime.utcnow() - EXPORT_LAG
+    # Games finished before moves were timed have no last_move_at, so
+    # they sort first and are only in full exports.
+    query = Game.query(Game.status == 1,  # Finished
+                       Game.last_move_at <= until)
+    if manifest['last_move_at']:
+        query = query.filter(Game.last_move_at > datetime.strptime(
+            manifest['last_move_at'], '%Y-%m-%dT%H:%M:%S.%f'))
+    query = query.order(Game.last_move_at)
+
+    exported = 0
+    last_move_at = manifest['last_move_at']
+    cursor = None
+
+    while True:
+        batch, cursor, more = query.fetch_page(EXPORT_BATCH,
+                                               start_cursor=cursor)
+        game_rows, move_rows, boat_rows = [], [], []
+
+        for each_game, moves, boats in _gameRows(batch):
+            game_id = each_game.key.id()
+            user1 = each_game.user1
+
+            finished = 0
+            if each_game.last_move_at is not None:
+                finished = int(
+                    (each_game.last_move_at - _EPOCH).total_seconds())
+                last_move_at = each_game.last_move_at.strftime(
+                    '%Y-%m-%dT%H:%M:%S.%f')
+
+            game_rows.append((
+                game_id,
+                user1.id(),
+                each_game.user2.id(),
+                0 if each_game.winner == user1 else 1,
+                finished,
+                manifest['rows']['moves'] + len(move_rows),
+                len(moves)))
+
+            move_rows.extend(
+                (game_id,
+                 0 if each_move.user_id == user1 else 1,
+                 battle_board._cellIndex(each_move.row, each_move.col),
+                 each_move.status,
+                 each_move.sequence) for each_move in moves)
+
+            boat_rows.extend(
+                (game_id,
+                 0 if each_boat.user_id == user1 else 1,
+                 each_boat.boat_type,
+                 battle_board._cellIndex(each_boat.row, each_boat.col))
+                for each_boat in boats)
+
+        _appendRows(files, 'games', game_rows)
+        _appendRows(files, 'moves', move_rows)
+        _appendRows(files, 'boats', boat_rows)
+
+        # Only count the rows once they're on disk.
+        for column_file in files.itervalues():
+            column_file.flush()
+            os.fsync(column_file.fileno())
+        manifest['rows']['games'] += len(game_rows)
+        manifest['rows']['moves'] += len(move_rows)
+        manifest['rows']['boats'] += len(boat_rows)
+        manifest['last_move_at'] = last_move_at
+        _writeManifest(directory, manifest)
+
+        exported += len(game_rows)
+        if not more:
+            break
+
+    for column_file in files.itervalues():
+        column_file.close()
+
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sdk', required=True,
+                        help='path to the google_appengine SDK directory')
+    parser.add_argument('--app', required=True, help='the app id')
+    parser.add_argument('--host',
+                        help='host to export from, default <app>.appspot.com')
+    parser.add_argument('--out', required=True,
+                        help='directory to write the export to')
+    parser.add_argument('--incremental', action='store_true',
+                        help='append games finished since the last export')
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from google.appengine.ext.remote_api import remote_api_stub
+
+    host = args.host or '{}.appspot.com'.format(args.app)
+    remote_api_stub.ConfigureRemoteApiForOAuth(
+        host, '/_ah/remote_api', secure=not host.startswith('localhost'),
+        app_id=args.app)
+
+    print '{} games exported to {}'.format(
+        export(args.out, args.incremental), args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,20 +5,152 @@ Google App Engine HTTP handlers
 """
 
 
+import json
+
 import webapp2
-from battleship import BattleshipApi
 
+import battle_backfill
+import battle_deletion
+import battle_events
+import battle_utils
+import battle_profile
+
+from battle_models import ProfileReport
+
+from battle_consts import EVENTS_MAX_WAIT
+
+
+class GameEventsHandler(webapp2.RequestHandler):
+
+    def get(self):
+        """
+        Long-poll for the events of a game.
+
+        Query parameters:
+          websafe_game_key: the url-safe key of the game.
+          since: the id of the last event seen. Omit it to get the current
+            id without waiting.
+          timeout: seconds to wait for an event, up to EVENTS_MAX_WAIT.
+
+        Responds with JSON: {"last_id": x, "events": [...], "resync": bool}.
+        """
+        try:
+            game_key = battle_utils._getNDBKey(
+                self.request.get('websafe_game_key'))
+            since = self.request.get('since')
+            since = int(since) if since else None
+            timeout = min(float(self.request.get('timeout', EVENTS_MAX_WAIT)),
+                          EVENTS_MAX_WAIT)
+        except Exception:
+            self.abort(400)
+
+        if game_key.kind() != 'Game' or game_key.get() is None:
+            self.abort(404)
+
+        result = battle_events._waitForGameEvents(game_key, since, timeout)
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.response.write(json.dumps(result))
+
+
+class DeleteUserHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Delete a user with all of their games, moves and boats.
+
+        Query parameters:
+          websafe_user_key: the url-safe key of the user.
+
+        The user is deleted straight away and the rest is deleted by tasks.
+        Responds with 202 once the deletion is queued, 404 if there's no
+        such user.
+        """
+        try:
+            user_key = battle_utils._getNDBKey(
+                self.request.get('websafe_user_key'))
+        except Exception:
+            self.abort(400)
+
+        if user_key.kind() != 'User':
+            self.abort(400)
+
+        if not battle_deletion._startUserDeletion(user_key):
+            self.abort(404)
+
+        self.response.set_status(202)  # 202 = accepted
 
-class SendEmailReminderHandler(webapp2.RequestHandler):
+
+class BackfillGamesHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Start the one-off backfill of games saved before newer Game
+        properties existed, see battle_backfill.
+        """
+        battle_backfill._startGameBackfill()
+        self.response.set_status(202)  # 202 = accepted
+
+
+class SeedCountersHandler(webapp2.RequestHandler):
+
+    def post(self):
+        """
+        Start the one-off count of games played before the global
+        statistics counters existed, see battle_backfill.
+        """
+        battle_backfill._startCounterSeed()
+        self.response.set_status(202)  # 202 = accepted
+
+
+class ProfileListHandler(webapp2.RequestHandler):
 
     def get(self):
         """
-        Send an email to remind a user of games in progress.
+        List the most recent profiled API calls.
+        """
+        self.response.headers['Content-Type'] = 'text/plain'
+        for each_report in battle_profile._getRecentReports():
+            self.response.write('%s  %s  %s  %.1f ms  /admin/profiles/%d\n' % (
+                each_report.created,
+                each_report.method_name,
+                each_report.trigger,
+                each_report.duration_ms,
+                each_report.key.id()))
+
+
+class ProfileDownloadHandler(webapp2.RequestHandler):
+
+    def get(self, report_id, part):
+        """
+        Download a profiled API call.
+
+        The .prof part is the raw cProfile data, load it with pstats.
+        The summary and allocations parts are plain text.
         """
-        BattleshipApi.send_email_reminder()
-        self.response.set_status(204)  # 204 = no content
+        report = ProfileReport.get_by_id(int(report_id))
+        if report is None:
+            self.abort(404)
+
+        if part == '.prof':
+            self.response.headers['Content-Type'] = 'application/octet-stream'
+            self.response.headers['Content-Disposition'] = (
+                'attachment; filename=%s-%s.prof' % (report.method_name,
+                                                     report_id))
+            self.response.write(report.stats)
+        else:
+            self.response.headers['Content-Type'] = 'text/plain'
+            self.response.write(report.summary)
+            self.response.write('\nAllocations:\n')
+            self.response.write(report.allocations)
 
 
 app = webapp2.WSGIApplication([
-    ('/crons/send_email_reminder', SendEmailReminderHandler)
+    ('/events/game', GameEventsHandler),
+    ('/admin/users/delete', DeleteUserHandler),
+    ('/admin/backfill_games', BackfillGamesHandler),
+    ('/admin/seed_counters', SeedCountersHandler),
+    ('/admin/profiles', ProfileListHandler),
+    (r'/admin/profiles/(\d+)(\.prof)?', ProfileDownloadHandler)
 ], debug=True)